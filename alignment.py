@@ -0,0 +1,318 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import time
+import uuid
+from difflib import SequenceMatcher
+
+import numpy as np
+import soundfile as sf
+
+from audio import StreamWriter, open_binary, resample, match_channels
+from postprocess import PostProcessingWriter
+
+RENDERS_DIR = os.environ.get(
+    "RENDERS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "yt-voiceover", "renders")
+)
+RENDER_RETENTION = float(os.environ.get("RENDER_RETENTION_HOURS", "24")) * 3600
+MAX_RENDERS_BYTES = int(os.environ.get("RENDERS_MAX_MB", "2048")) * 1024 * 1024
+ALIGNMENT_FILE = "alignment.json"
+# The audio of every sentence of a render, one after the other: decoded
+# samples, or the MP3 bytes when MP3 segments are passed through. Samples are
+# kept as floats, so a reused sentence is exactly what was rendered before,
+# including processed samples beyond full scale that only the final gain
+# brings back in range.
+SAMPLES_FILE = "sentences.wav"
+BYTES_FILE = "sentences.mp3"
+
+
+def render_mode(settings):
+    # How segments become the render; pieces are only reusable between
+    # renders of the same mode.
+    if settings.postprocess and settings.native_format == "wav":
+        return "postprocess"
+    if settings.native_format == "mp3" and settings.audio_format == "mp3":
+        return "mp3"
+    return "samples"
+
+
+def _directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def new_render_directory(max_age=RENDER_RETENTION, max_bytes=MAX_RENDERS_BYTES):
+    # A fresh directory under RENDERS_DIR. On the way, directories not used
+    # for max_age seconds are removed, and then the least recently used ones
+    # until the rest fit in max_bytes, even if another session still has one
+    # as its previous render (see AlignedWriter).
+    os.makedirs(RENDERS_DIR, exist_ok=True)
+    cutoff = time.time() - max_age
+    renders = []
+    for name in os.listdir(RENDERS_DIR):
+        path = os.path.join(RENDERS_DIR, name)
+        try:
+            used = os.path.getmtime(path)
+            if used < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                renders.append((used, _directory_size(path), path))
+        except OSError:
+            pass
+    total = sum(size for _, size, _ in renders)
+    for _, size, path in sorted(renders):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+    path = os.path.join(RENDERS_DIR, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+
+def discard_render_directory(path):
+    # Removes a render that no session uses any more; renders outside
+    # RENDERS_DIR, those of background jobs, are left to job pruning.
+    if path and os.path.dirname(os.path.abspath(path)) == os.path.abspath(RENDERS_DIR):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class Alignment:
+    # Which sentence of a script is where in its render. Each sentence has
+    # its text, its synthesis cache key, the start and end of its piece in
+    # the render directory (samples, or bytes in mp3 mode) and the offset at
+    # which it starts in the rendered audio (samples at samplerate, or bytes
+    # in mp3 mode; None for a sentence that was all silence). In samples
+    # mode subtype is the WAV subtype the render was written in.
+
+    def __init__(self, mode, samplerate=None, channels=None, sentences=None, subtype=None):
+        self.mode = mode
+        self.samplerate = samplerate
+        self.channels = channels
+        self.sentences = sentences or []
+        self.subtype = subtype
+
+    def add(self, text, key, start, end, offset):
+        self.sentences.append(
+            {"text": text, "key": key, "start": start, "end": end, "offset": offset}
+        )
+
+    def match(self, keys):
+        # For each of keys, the index of an unchanged sentence of this render
+        # in the same order, or None for one that has to be synthesized.
+        sources = [None] * len(keys)
+        matcher = SequenceMatcher(None, [s["key"] for s in self.sentences], keys, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                sources[j1:j2] = range(i1, i2)
+        return sources
+
+    def to_dict(self):
+        return {
+            "mode": self.mode,
+            "samplerate": self.samplerate,
+            "channels": self.channels,
+            "sentences": self.sentences,
+            "subtype": self.subtype,
+        }
+
+    def save(self, render_dir):
+        path = os.path.join(render_dir, ALIGNMENT_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, render_dir):
+        try:
+            with open(os.path.join(render_dir, ALIGNMENT_FILE), encoding="utf-8") as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+
+class AlignedWriter:
+    # Writes a render like the writers of audio and postprocess, and keeps
+    # the piece of every sentence in render_dir together with the alignment.
+    # Sentences found in a previous render are copied from its directory
+    # with reuse() instead of being decoded and processed again. The
+    # alignment is saved when the render completes.
+    #
+    # The sentence file of the previous render is opened up front: once
+    # open it stays readable if the directory is pruned, and a previous
+    # render that is already gone is treated as no previous render. Opening
+    # it counts as a use of the previous render for pruning.
+
+    def __init__(self, render_dir, mode, target, output_format="wav", bitrate=None,
+                 previous_dir=None):
+        self.render_dir = render_dir
+        self.mode = mode
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.alignment = Alignment(mode)
+        self.previous = Alignment.load(previous_dir) if previous_dir else None
+        if self.previous is not None and self.previous.mode != mode:
+            self.previous = None
+        self.previous_dir = previous_dir
+        os.makedirs(render_dir, exist_ok=True)
+        self._stack = contextlib.ExitStack()
+        self._store = None
+        self._source = None
+        self._output = None
+        if self.previous is not None:
+            try:
+                if mode == "mp3":
+                    self._source = self._stack.enter_context(
+                        open(os.path.join(previous_dir, BYTES_FILE), "rb")
+                    )
+                else:
+                    self._source = self._stack.enter_context(
+                        sf.SoundFile(os.path.join(previous_dir, SAMPLES_FILE))
+                    )
+                os.utime(previous_dir)
+            except (OSError, RuntimeError):  # soundfile raises LibsndfileError, a RuntimeError
+                self.previous = None
+        if mode == "mp3":
+            self._output = self._stack.enter_context(open_binary(target))
+            self._store = self._stack.enter_context(
+                open(os.path.join(render_dir, BYTES_FILE), "wb")
+            )
+        elif mode == "postprocess":
+            self._output = PostProcessingWriter(target, output_format, bitrate)
+        else:
+            # Segments go to a StreamWriter as they are, so WAV segments are
+            # copied into WAV output without conversion as in a render
+            # without alignment; reused sentences are encoded back to the
+            # subtype of the render first.
+            self._output = StreamWriter(target, output_format, bitrate)
+            self._format = None  # samplerate, channels and subtype of the render
+        self._offset = 0
+
+    def match(self, keys):
+        if self.previous is None:
+            return [None] * len(keys)
+        return self.previous.match(keys)
+
+    def write(self, text, key, segment):
+        # Adds a newly synthesized segment.
+        if self.mode == "mp3":
+            self._append_bytes(text, key, segment)
+        elif self.mode == "postprocess":
+            self._append(text, key, self._output.prepare(segment))
+        else:
+            with sf.SoundFile(io.BytesIO(segment)) as source:
+                data = source.read(dtype="float32", always_2d=True)
+                if self._format is None:
+                    subtype = source.subtype
+                    if source.format != "WAV" or not sf.check_format("WAV", subtype):
+                        subtype = "FLOAT"
+                    self._format = (source.samplerate, source.channels, subtype)
+                rate = source.samplerate
+            self._output.write(segment)
+            self._append(text, key, self._conform(data, rate, data.shape[1]))
+
+    def reuse(self, text, key, index, as_segment=False):
+        # Adds sentence index of the previous render. With as_segment its
+        # audio is returned as a segment: the MP3 bytes, or the samples
+        # encoded as WAV.
+        sentence = self.previous.sentences[index]
+        start, end = sentence["start"], sentence["end"]
+        if self.mode == "mp3":
+            self._source.seek(start)
+            segment = self._source.read(end - start)
+            self._append_bytes(text, key, segment)
+            return segment if as_segment else None
+        self._source.seek(start)
+        data = self._source.read(end - start, dtype="float32", always_2d=True)
+        previous = self.previous
+        if self.mode == "postprocess":
+            if self.samplerate is None:
+                self._output.write_piece(np.zeros((0, previous.channels), np.float32),
+                                         previous.samplerate, previous.channels)
+            data = self._conform(data, previous.samplerate, previous.channels)
+            self._append(text, key, data)
+        else:
+            if self._format is None:
+                self._format = (previous.samplerate, previous.channels,
+                                previous.subtype or "FLOAT")
+            data = self._conform(data, previous.samplerate, previous.channels)
+            self._output.write(self._encode(data, self._format[2]))
+            self._append(text, key, data)
+        if not as_segment:
+            return None
+        return self._encode(data, "PCM_16")
+
+    @property
+    def samplerate(self):
+        if self.mode == "samples":
+            return self._format[0] if self._format is not None else None
+        if self.mode == "mp3":
+            return None
+        return self._output.samplerate
+
+    @property
+    def channels(self):
+        if self.mode == "samples":
+            return self._format[1] if self._format is not None else None
+        if self.mode == "mp3":
+            return None
+        return self._output.channels
+
+    def _encode(self, data, subtype):
+        buffer = io.BytesIO()
+        sf.write(buffer, data, self.samplerate, format="WAV", subtype=subtype)
+        return buffer.getvalue()
+
+    def _conform(self, data, rate, channels):
+        # Pieces of a previous render may differ in rate or channels from
+        # the first segment of this one.
+        if rate == self.samplerate and channels == self.channels:
+            return data
+        data = match_channels(resample(data, rate, self.samplerate), self.channels)
+        return data.astype(np.float32)
+
+    def _append(self, text, key, data):
+        if self._store is None:
+            self._store = self._stack.enter_context(sf.SoundFile(
+                os.path.join(self.render_dir, SAMPLES_FILE), "w", samplerate=self.samplerate,
+                channels=data.shape[1], format="WAV", subtype="FLOAT"
+            ))
+        start = self._offset
+        self._store.write(data)
+        self._offset += len(data)
+        if self.mode == "postprocess":
+            offset = self._output.write_piece(data)
+        else:  # the pieces are the render, written by the caller
+            offset = start if len(data) else None
+        self.alignment.add(text, key, start, self._offset, offset)
+
+    def _append_bytes(self, text, key, segment):
+        start = self._offset
+        self._store.write(segment)
+        self._output.write(segment)
+        self._offset += len(segment)
+        self.alignment.add(text, key, start, self._offset, start)
+
+    def close(self):
+        if self.mode != "mp3":
+            self._output.close()
+        self._stack.close()
+        self.alignment.samplerate = self.samplerate
+        self.alignment.channels = self.channels
+        if self.mode == "samples" and self._format is not None:
+            self.alignment.subtype = self._format[2]
+        self.alignment.save(self.render_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            if self.mode == "postprocess":
+                self._output.__exit__(exc_type, *exc_info)
+            elif self.mode == "samples":
+                self._output.close()
+            self._stack.close()
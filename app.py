@@ -1,20 +1,32 @@
 import streamlit as st
-from duckduckgo_search import DDGS
-import google.generativeai as genai
-from gradio_client import Client
-from groq import Groq
-from elevenlabs.client import ElevenLabs
 from elevenlabs import play, save, stream, Voice, VoiceSettings
-import soundfile as sf
 import os
-import tempfile
-import time
 import io
+import json
+import dataclasses
 from streamlit_extras.colored_header import colored_header
+from audio import join_wav, join_mp3
+from synthesis_cache import get_default_cache
+import longform
+import pipeline
+from pipeline import PipelineSettings, TEXT_MODELS, TTS_MODELS, ELEVEN_LABS_VOICES, PIPER_MODEL, LLAMA_MODEL
+from tts_backends import get_backend_class
+import text_backends
+import jobs
+import tracing
+import alignment
+from scheduler import BACKGROUND
+from speculative import SpeculativeSynthesis
+from audio import OUTPUT_FORMATS
 
 
 st.set_page_config(page_title="YouTube Script and Voiceover Generator", layout="wide")
 
+# Prometheus metrics of this server, including its background workers.
+if os.environ.get("METRICS_PORT"):
+    tracing.serve_metrics(int(os.environ["METRICS_PORT"]),
+                          os.environ.get("METRICS_HOST", "127.0.0.1"))
+
 # Custom CSS
 st.markdown("""
 <style>
@@ -51,36 +63,38 @@ st.sidebar.header("Model and API Key Settings")
 # Text Model Selection in Sidebar
 text_model = st.sidebar.selectbox(
     "Select Text Generation Model:",
-    ["gemini-1.5-pro", "gemini-1.5-flash", "gemma2-9b-it", "gemma2-2b-it", 
-     "llama3-8b-8192", "llama-3.1-8b-instant", "llama-3.1-70b-versatile", 
-     "gemma2-9b-it", "gemma-7b-it"],
+    TEXT_MODELS,
     index=0  # Default to the first option
 )
 
-ELEVEN_LABS_VOICES = ['Sarah', 'Laura', 'Charlie', 'George', 'Callum', 'Liam', 'Charlotte', 'Alice', 'Matilda', 'Will', 'Jessica', 'Eric', 'Chris', 'Brian', 'Daniel', 'Lily', 'Bill']
-
 # Conditional API Key Input for Text Model
-if text_model.startswith("gemini"):
-    user_api_key = st.sidebar.text_input("Enter your Gemini API key:", type="password")
-    if user_api_key:
-        genai.configure(api_key=user_api_key)
-elif text_model.startswith("llama") or text_model.startswith("gemma"):
-    user_api_key = st.sidebar.text_input("Enter your Groq API key:", type="password")
-    if user_api_key:
-        os.environ['GROQ_API_KEY'] = user_api_key
+text_backend = text_backends.get_backend_class(text_model)
+user_api_key = None
+local_text_model = LLAMA_MODEL
+if text_backend is text_backends.LlamaCppBackend:
+    local_text_model = st.sidebar.text_input(
+        "Path to a GGUF text model:",
+        value=LLAMA_MODEL or "",
+        help="Runs on this machine's CPU; no API key or network access needed"
+    )
+else:
+    user_api_key = st.sidebar.text_input(f"Enter your {text_backend.label} API key:", type="password")
 
 # TTS Model Selection in Sidebar
 tts_model = st.sidebar.selectbox(
     "Select TTS Model:",
-    ["mrfakename/MeloTTS", "ElevenLabs"],
-    index=0  # Default to MeloTTS model
+    TTS_MODELS,
+    index=0,  # Default to MeloTTS model
+    format_func=lambda name: get_backend_class(name).label
 )
 
+eleven_labs_api_key = None
+selected_voice = ELEVEN_LABS_VOICES[0]
+local_voice_model = PIPER_MODEL
+
 # Conditional API Key Input and Voice Selection for TTS Model
 if tts_model == "ElevenLabs":
     eleven_labs_api_key = st.sidebar.text_input("Enter your ElevenLabs API key:", type="password")
-    if eleven_labs_api_key:
-        client_e = ElevenLabs(api_key=eleven_labs_api_key)
     
     # Add voice selection dropdown
     selected_voice = st.sidebar.selectbox(
@@ -88,6 +102,81 @@ if tts_model == "ElevenLabs":
         ELEVEN_LABS_VOICES,
         index=0  # Default to the first voice
     )
+elif tts_model == "local/piper":
+    local_voice_model = st.sidebar.text_input(
+        "Path to a Piper voice model (.onnx):",
+        value=PIPER_MODEL or "",
+        help="Runs on this machine's CPU; no API key or network access needed"
+    )
+
+cache_stats = get_default_cache().stats()
+st.sidebar.caption(
+    f"Audio cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+    f"{cache_stats['entries']} segments ({cache_stats['bytes'] / 1024 / 1024:.1f} MB)"
+)
+
+run_in_background = st.sidebar.checkbox(
+    "Run in background",
+    value=False,
+    help="Generate on shared background workers; the work keeps going when you "
+         "change settings or reload the page, but the script and audio are not streamed"
+)
+
+stream_script = st.sidebar.checkbox(
+    "Stream script as it is generated",
+    value=True,
+    disabled=run_in_background,
+    help="Show the script token by token instead of waiting for the full response"
+)
+
+stream_audio = st.sidebar.checkbox(
+    "Stream audio while generating",
+    value=False,
+    disabled=run_in_background,
+    help="Start playback as soon as the first sentence is ready"
+)
+
+speculative_audio = st.sidebar.checkbox(
+    "Pre-render audio",
+    value=False,
+    help="Start converting the script to speech at low priority as soon as it is written, "
+         "so most of the audio is ready when you click Generate Audio; the work is dropped "
+         "when the script is regenerated"
+)
+
+long_form_mode = st.sidebar.checkbox(
+    "Long-form mode",
+    value=True,
+    help=f"For videos of {longform.LONGFORM_THRESHOLD_MINUTES} minutes or more, "
+         "outline the script first and draft its sections in parallel"
+)
+
+postprocess_audio = st.sidebar.checkbox(
+    "Normalize loudness and trim silences",
+    value=True,
+    help="Post-process WAV audio from MeloTTS or Piper: even loudness, shorter pauses and smooth joins"
+)
+
+show_timings = st.sidebar.checkbox(
+    "Show timings",
+    value=False,
+    help="Show how long each stage and provider call of the last run took"
+)
+
+output_format = st.sidebar.selectbox(
+    "Output Format:",
+    list(OUTPUT_FORMATS),
+    index=list(OUTPUT_FORMATS).index("mp3"),  # MP3 plays in every browser
+    format_func=lambda name: OUTPUT_FORMATS[name]["label"],
+    help="Compressed formats are much smaller to play and download"
+)
+bitrate = None
+if "bitrates" in OUTPUT_FORMATS[output_format]:
+    bitrate = st.sidebar.select_slider(
+        "Bitrate (kbps):",
+        OUTPUT_FORMATS[output_format]["bitrates"],
+        value=OUTPUT_FORMATS[output_format]["default_bitrate"]
+    )
 
 # User Input for Video Title
 title = st.text_input("Enter the title of your YouTube video:")
@@ -95,129 +184,255 @@ title = st.text_input("Enter the title of your YouTube video:")
 # User Input for Video Length in Minutes
 video_length = st.number_input("Enter the desired length of the video in minutes:", min_value=1, max_value=120, value=5)
 
-def search_and_summarize(search_query):
-    results = DDGS().text(
-        keywords=search_query,
-        region='us-en',
-        safesearch='off',
-        timelimit='2m',
-        max_results=5
+settings = PipelineSettings(
+    text_model=text_model,
+    text_api_key=user_api_key,
+    local_text_model=local_text_model,
+    tts_model=tts_model,
+    eleven_labs_api_key=eleven_labs_api_key,
+    voice=selected_voice,
+    local_voice_model=local_voice_model,
+    long_form=long_form_mode,
+    postprocess=postprocess_audio,
+    output_format=output_format,
+    bitrate=bitrate
+)
+
+# Background jobs are tracked in the session and mirrored in the URL, so a
+# reloaded page picks up the jobs it started.
+for job_name in ("script_job", "audio_job"):
+    if job_name not in st.session_state and job_name in st.query_params:
+        st.session_state[job_name] = st.query_params[job_name]
+
+def track_job(name, job_id):
+    st.session_state[name] = job_id
+    st.query_params[name] = job_id
+
+def submit_script_job(status):
+    if not title:
+        st.error("Please enter a title for the YouTube video.")
+        return
+    job_id = jobs.get_pool().submit(
+        "script", settings, title=title, video_length=video_length,
+        regenerate=status == 'regenerated'
     )
-    if not results:
-        raise ValueError("No search results found.")
-    text_content = [result['body'] for result in results]
-
-    if text_model.startswith("gemini"):
-        gemini = genai.GenerativeModel(text_model)
-        summary = gemini.generate_content(
-            "Summarize the following text: " + " ".join(text_content),
+    track_job("script_job", job_id)
+
+def submit_audio_job(script):
+    # Sentences that are unchanged since the last render are taken from it.
+    track_job("audio_job", jobs.get_pool().submit(
+        "audio", settings, script=script, previous_dir=st.session_state.get('render_dir')
+    ))
+
+def submit_speculative_job(script):
+    st.session_state['speculative_job'] = jobs.get_pool().submit(
+        "audio", dataclasses.replace(settings, priority=BACKGROUND), script=script,
+        previous_dir=st.session_state.get('render_dir')
+    )
+
+def adopt_speculative_job(script):
+    # Takes over the speculative render when it is of this script with the
+    # current settings, at the priority of the user's own requests; a render
+    # that is already running is promoted at its next progress report. A
+    # finished render of another script still serves as the base of this
+    # one, so only the edited sentences are synthesized.
+    job_id = st.session_state.pop('speculative_job', None)
+    if not job_id:
+        return False
+    pool = jobs.get_pool()
+    job = pool.get(job_id)
+    if job is None or job["status"] in (jobs.FAILED, jobs.CANCELLED):
+        return False
+    expected = jobs.public_settings(dataclasses.replace(settings, priority=BACKGROUND))
+    if job["params"]["settings"] == expected and job["params"]["script"] == script:
+        pool.prioritize(job_id, settings.priority)
+        track_job("audio_job", job_id)
+        return True
+    if job["status"] == jobs.DONE and job["params"]["settings"] == expected:
+        replace_render(job["result"]["render_dir"])
+    else:
+        pool.cancel(job_id)
+    return False
+
+def cancel_speculation(wait=False):
+    speculation = st.session_state.pop('speculation', None)
+    if speculation is not None:
+        speculation.cancel(wait=wait)
+    job_id = st.session_state.pop('speculative_job', None)
+    if job_id:
+        jobs.get_pool().cancel(job_id)
+
+def speculate(tokens, speculation):
+    # Passes streamed tokens through, queuing each sentence as it completes.
+    for text in tokens:
+        speculation.feed(text)
+        yield text
+
+def replace_render(render_dir):
+    # A session keeps only its latest render; the one it replaces is removed.
+    previous_dir = st.session_state.get('render_dir')
+    if previous_dir != render_dir:
+        alignment.discard_render_directory(previous_dir)
+    st.session_state['render_dir'] = render_dir
+
+def keep_render(script, render_dir):
+    # The script the audio was rendered from becomes the current script, and
+    # its render the base of the next one.
+    replace_render(render_dir)
+    if script != st.session_state.get('current_script'):
+        st.session_state['current_script'] = script
+        return True
+    return False
+
+@st.fragment(run_every=1.0)
+def job_progress(job_id, label):
+    job = jobs.get_pool().get(job_id)
+    if job is None or job["status"] in jobs.FINISHED:
+        st.rerun()
+    message = job["message"] or ("Waiting for a worker..." if job["status"] == jobs.QUEUED else "")
+    st.progress(min(job["progress"], 1.0), text=f"{label} {message}")
+    if st.button("Cancel", key=f"cancel_{job_id}"):
+        jobs.get_pool().cancel(job_id)
+
+def collect_script_job():
+    # Takes over the script of a finished job once; while the job runs its
+    # progress is shown instead.
+    job_id = st.session_state.get("script_job")
+    if not job_id or st.session_state.get("script_job_loaded") == job_id:
+        return
+    job = jobs.get_pool().get(job_id)
+    if job is None:
+        st.session_state["script_job_loaded"] = job_id
+    elif job["status"] == jobs.DONE:
+        st.session_state['current_script'] = job["result"]["script"]
+        st.session_state['summary'] = job["result"]["summary"]
+        st.session_state['script_status'] = (
+            'regenerated' if job["params"].get("regenerate") else 'new'
         )
-        return summary.text
-    else:  # Groq models
-        llm = Groq(api_key=user_api_key)
-        summary = llm.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": "Summarize the following text: " + " ".join(text_content)
-                }
-            ],
-            model=text_model
+        st.session_state["script_job_loaded"] = job_id
+        if speculative_audio:
+            submit_speculative_job(job["result"]["script"])
+    elif job["status"] == jobs.FAILED:
+        st.error(f"An error occurred during script generation: {job['error']}")
+        st.session_state["script_job_loaded"] = job_id
+    elif job["status"] == jobs.CANCELLED:
+        st.session_state["script_job_loaded"] = job_id
+    else:
+        job_progress(job_id, "Generating script...")
+
+def show_audio_job():
+    job_id = st.session_state.get("audio_job")
+    if not job_id:
+        return
+    job = jobs.get_pool().get(job_id)
+    if job is None or job["status"] == jobs.CANCELLED:
+        return
+    if job["status"] == jobs.FAILED:
+        st.error(f"An error occurred during text-to-speech conversion: {job['error']}")
+    elif job["status"] == jobs.DONE:
+        if st.session_state.get("audio_job_loaded") != job_id:
+            st.session_state["audio_job_loaded"] = job_id
+            if keep_render(job["params"]["script"], job["result"].get("render_dir")):
+                st.rerun()
+        try:
+            with open(job["result"]["path"], "rb") as f:
+                audio_bytes = f.read()
+        except OSError:
+            return  # pruned
+        st.success("Audio conversion complete!")
+        st.audio(audio_bytes, format=job["result"]["mime"])
+        st.download_button(
+            label="Download Audio",
+            data=audio_bytes,
+            file_name="tts_output" + job["result"]["suffix"],
+            mime=job["result"]["mime"]
         )
-        return summary.choices[0].message.content
-
-def generate_youtube_script(title, context, video_length, regenerate=False):
-    regenerate_note = " (This is a regenerated script.)" if regenerate else ""
-    prompt = f'''
-    Generate a YouTube script voiceover based on the following title and context. Make it sound like a natural conversation, with pauses and a conversational tone.
-
-    Title: {title}
-
-    Context: {context}
-
-    The voiceover should be suitable for a video that is approximately {video_length} minutes long. It should start with a strong introduction, followed by key points that highlight the main aspects of the topic, and conclude with a statement that leaves the viewer wanting to learn more.
-
-    Only provide the voiceover text, without any additional formatting or instructions.{regenerate_note}
-    '''
-
-    if text_model.startswith("gemini"):
-        gemini = genai.GenerativeModel(text_model)
-        script = gemini.generate_content(prompt)
-        return script.text
-    else:  # Groq models
-        llm = Groq(api_key=user_api_key)
-        response = llm.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model=text_model
+    else:
+        job_progress(job_id, "Converting text to speech...")
+
+def keep_trace(kind, trace):
+    st.session_state.setdefault('traces', {})[kind] = trace.to_dict()
+
+def show_trace(label, trace):
+    depth = {}
+    rows = []
+    for span in trace["spans"]:
+        depth[span["id"]] = depth.get(span["parent"], -1) + 1
+        details = {k: v for k, v in span["attributes"].items() if v is not None}
+        rows.append({
+            "span": "· " * depth[span["id"]] + span["name"],
+            "start (s)": round(span["start"], 3),
+            "duration (s)": round(span["duration"] or 0, 3),
+            "status": span["error"] or span["status"],
+            "details": ", ".join(f"{k}={v}" for k, v in details.items()),
+        })
+    duration = trace["duration"] or 0
+    with st.expander(f"Timings: {label} ({duration:.2f}s)"):
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        st.download_button(
+            label="Download trace (JSON)",
+            data=json.dumps(trace, indent=2, default=str),
+            file_name=f"trace-{trace['trace_id']}.json",
+            mime="application/json",
+            key=f"trace_{trace['trace_id']}"
         )
-        return response.choices[0].message.content
 
-def text_to_speech(script):
+def show_timings_panel():
+    traces = dict(st.session_state.get('traces', {}))
+    if run_in_background:
+        for kind, job_name in (("script", "script_job"), ("audio", "audio_job")):
+            if st.session_state.get(job_name):
+                trace = jobs.load_trace(st.session_state[job_name])
+                if trace is not None:
+                    traces[kind] = trace
+    for kind, label in (("script", "script generation"), ("audio", "text to speech")):
+        if kind in traces:
+            show_trace(label, traces[kind])
+
+def text_to_speech(script, on_segment=None, on_progress=None):
+    render_dir = alignment.new_render_directory()
     try:
-        if tts_model == "mrfakename/MeloTTS":
-            client = Client("mrfakename/MeloTTS")
-            result = client.predict(
-                text=script,
-                speaker="EN-US",
-                speed=1,
-                language="EN",
-                api_name="/synthesize"
-            )
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-                output_filename = temp_file.name
-                data, samplerate = sf.read(result)
-                sf.write(output_filename, data, samplerate)
-        
-        elif tts_model == "ElevenLabs":
-            audio_generator = client_e.generate(
-                text=script,
-                voice=selected_voice,
-                model="eleven_multilingual_v2"
-            )
-            
-            audio_bytes = b"".join(audio_chunk for audio_chunk in audio_generator)
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-                output_filename = temp_file.name
-                with open(output_filename, "wb") as f:
-                    f.write(audio_bytes)  # Write the combined audio bytes to the file
-                
-        else:
-            raise ValueError(f"Unsupported TTS model: {tts_model}")
-
-        return output_filename
+        audio_bytes = pipeline.text_to_speech(
+            settings, script, on_segment=on_segment, on_progress=on_progress,
+            render_dir=render_dir, previous_dir=st.session_state.get('render_dir')
+        )
+        keep_render(script, render_dir)
+        return audio_bytes
     except Exception as e:
+        alignment.discard_render_directory(render_dir)
         st.error(f"An error occurred during text-to-speech conversion: {str(e)}")
         return None
 
-def delayed_file_cleanup(file_path, max_attempts=5, delay=1):
-    for _ in range(max_attempts):
-        try:
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-            return
-        except PermissionError:
-            time.sleep(delay)
-    print(f"Warning: Unable to delete temporary file: {file_path}")
-
 def generate_script():
     if title:
+        speculation = SpeculativeSynthesis(settings) if speculative_audio else None
         try:
-            summary = search_and_summarize(title)
+            summary = pipeline.search_and_summarize(settings, title)
             st.write("**Summary:**")
             st.write(summary)
 
-            script = generate_youtube_script(title, summary, video_length)
             st.write("**Generated Script:**")
-            st.write(script)
+            if pipeline.is_long_form(settings, video_length):
+                with st.spinner("Drafting the script section by section..."):
+                    script = pipeline.generate_youtube_script(settings, title, summary, video_length)
+                st.write(script)
+            elif stream_script:
+                # write_stream renders tokens as they arrive and returns the full text.
+                tokens = pipeline.stream_youtube_script(settings, title, summary, video_length)
+                if speculation is not None:
+                    tokens = speculate(tokens, speculation)
+                script = st.write_stream(tokens)
+            else:
+                script = pipeline.generate_youtube_script(settings, title, summary, video_length)
+                st.write(script)
 
+            if speculation is not None:
+                speculation.finish(script)
+                st.session_state['speculation'] = speculation
             return script
         except Exception as e:
+            if speculation is not None:
+                speculation.cancel()
             st.error(f"An error occurred during script generation: {str(e)}")
             return None
     else:
@@ -228,50 +443,88 @@ def generate_audio(script):
     progress_bar = st.progress(0)
     status_text = st.empty()
 
-    for i in range(101):
-        progress_bar.progress(i)
-        status_text.text(f"Converting text to speech... {i}%")
-        time.sleep(0.01)  # Simulate processing time
+    def on_progress(snapshot):
+        progress_bar.progress(min(snapshot.fraction, 1.0))
+        eta = f", about {snapshot.eta:.0f}s left" if snapshot.eta is not None else ""
+        status_text.text(
+            f"Converting text to speech... {snapshot.done}/{snapshot.total} segments, "
+            f"{snapshot.bytes_received / 1024 / 1024:.1f} MB received{eta}"
+        )
 
-    output_file = text_to_speech(script)
+    on_segment = None
+    if stream_audio:
+        audio_format = settings.audio_mime
+        stream_container = st.container()
+        pending = []
+        played = {'segments': 0}
+
+        # The first sentence is played on its own; after that each player
+        # holds as many segments as all the players before it, so a long
+        # script needs only a handful of players.
+        def on_segment(segment):
+            pending.append(segment)
+            if len(pending) >= max(1, played['segments']):
+                flush_segments()
+
+        def flush_segments():
+            if not pending:
+                return
+            first = played['segments'] == 0
+            with stream_container:
+                if alignment.render_mode(settings) != "mp3":
+                    # WAV segments, and sentences reused from the last render
+                    data, samplerate = join_wav(pending)
+                    st.audio(data.T, format=audio_format, sample_rate=samplerate, autoplay=first)
+                else:
+                    st.audio(join_mp3(pending), format=audio_format, autoplay=first)
+            played['segments'] += len(pending)
+            pending.clear()
+
+    audio_bytes = text_to_speech(script, on_segment=on_segment, on_progress=on_progress)
+    if stream_audio:
+        flush_segments()
     
-    if output_file:
+    if audio_bytes:
         st.success("Audio conversion complete!")
         
-        audio_file = open(output_file, 'rb')
-        audio_bytes = audio_file.read()
-        audio_file.close()
-        
-        st.audio(audio_bytes, format='audio/wav' if tts_model == "mrfakename/MeloTTS" else 'audio/mp3')
+        # The same bytes object backs the player and the download, so
+        # Streamlit stores the audio once.
+        st.audio(audio_bytes, format=settings.audio_mime)
         
         st.download_button(
             label="Download Audio",
             data=audio_bytes,
-            file_name="tts_output.wav" if tts_model == "mrfakename/MeloTTS" else "tts_output.mp3",
-            mime="audio/wav" if tts_model == "mrfakename/MeloTTS" else "audio/mp3"
+            file_name="tts_output" + settings.audio_suffix,
+            mime=settings.audio_mime
         )
-        
-        st.session_state['cleanup_file'] = output_file
     else:
         st.error("Failed to convert text to speech. Please try again.")
 
 def main():
     if st.button("🔄 Refresh", key="refresh"):
+        cancel_speculation()
         st.session_state.clear()
+        st.query_params.clear()
         st.rerun()
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Generate Script", key="generate_script", help="Click to generate a new script based on the title"):
-            if (text_model.startswith("gemini") and not user_api_key) or \
-               ((text_model.startswith("llama") or text_model.startswith("gemma")) and not user_api_key) or \
-               (tts_model == "ElevenLabs" and not eleven_labs_api_key):
+            if settings.missing_keys():
                 st.error("Please enter the required API keys.")
+            elif run_in_background:
+                cancel_speculation()
+                submit_script_job('new')
             else:
-                script = generate_script()
+                cancel_speculation()
+                with tracing.trace("generate_script", title=title) as trace:
+                    script = generate_script()
+                keep_trace("script", trace)
                 if script:
                     st.session_state['current_script'] = script
                     st.session_state['script_status'] = 'new'
 
+    collect_script_job()
+
     if 'current_script' in st.session_state:
         st.markdown("---")
         if st.session_state.get('script_status') == 'regenerated':
@@ -279,17 +532,35 @@ def main():
         else:
             st.subheader("Generated Script:")
         st.write(st.session_state['current_script'])
+        if run_in_background and 'summary' in st.session_state:
+            with st.expander("Research summary"):
+                st.write(st.session_state['summary'])
 
         col1, col2, col3 = st.columns(3)
         with col1:
             if st.button("Generate Audio", key="generate_audio", help="Generate audio from the current script"):
-                generate_audio(st.session_state['current_script'])
+                if run_in_background:
+                    if not adopt_speculative_job(st.session_state['current_script']):
+                        submit_audio_job(st.session_state['current_script'])
+                else:
+                    # What is left of the pre-rendering is synthesized by
+                    # this render at full priority.
+                    cancel_speculation(wait=True)
+                    with tracing.trace("generate_audio") as trace:
+                        generate_audio(st.session_state['current_script'])
+                    keep_trace("audio", trace)
         with col2:
             if st.button("Edit Script", key="edit_script", help="Edit the current script"):
                 st.session_state['edit_mode'] = True
         with col3:
             if st.button("Regenerate Script", key="regenerate_script", help="Generate a new script"):
-                new_script = generate_script()
+                cancel_speculation()
+                if run_in_background:
+                    submit_script_job('regenerated')
+                    st.rerun()
+                with tracing.trace("generate_script", title=title, regenerate=True) as trace:
+                    new_script = generate_script()
+                keep_trace("script", trace)
                 if new_script:
                     st.session_state['current_script'] = new_script
                     st.session_state['script_status'] = 'regenerated'
@@ -298,12 +569,20 @@ def main():
         if st.session_state.get('edit_mode', False):
             edited_script = st.text_area("Edit Script", st.session_state['current_script'], height=300)
             if st.button("Generate Audio from Edited Script", key="generate_audio_edited"):
-                generate_audio(edited_script)
-
-    # Attempt cleanup of previous file, if any
-    if 'cleanup_file' in st.session_state:
-        delayed_file_cleanup(st.session_state['cleanup_file'])
-        del st.session_state['cleanup_file']
+                if run_in_background:
+                    if not adopt_speculative_job(edited_script):
+                        submit_audio_job(edited_script)
+                else:
+                    cancel_speculation(wait=True)
+                    with tracing.trace("generate_audio", edited=True) as trace:
+                        generate_audio(edited_script)
+                    keep_trace("audio", trace)
+
+        if run_in_background:
+            show_audio_job()
+
+    if show_timings:
+        show_timings_panel()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,209 @@
+import contextlib
+import io
+
+import numpy as np
+import soundfile as sf
+
+# WAV subtypes whose samples can be copied from one file to another without
+# converting them, and the dtype that reads them as-is.
+PASSTHROUGH_DTYPES = {
+    "PCM_16": "int16",
+    "PCM_32": "int32",
+    "FLOAT": "float32",
+    "DOUBLE": "float64",
+}
+
+
+# Output encodings. Bitrates are in kbps and only apply to the lossy formats.
+OUTPUT_FORMATS = {
+    "wav": {"label": "WAV (uncompressed)", "format": "WAV", "subtype": "PCM_16",
+            "suffix": ".wav", "mime": "audio/wav"},
+    "flac": {"label": "FLAC (lossless)", "format": "FLAC", "subtype": "PCM_16",
+             "suffix": ".flac", "mime": "audio/flac"},
+    "opus": {"label": "Ogg/Opus", "format": "OGG", "subtype": "OPUS",
+             "suffix": ".ogg", "mime": "audio/ogg",
+             "bitrates": [24, 32, 48, 64, 96], "default_bitrate": 48},
+    "mp3": {"label": "MP3", "format": "MP3", "subtype": "MPEG_LAYER_III",
+            "suffix": ".mp3", "mime": "audio/mp3",
+            "bitrates": [64, 96, 128, 160, 192], "default_bitrate": 128},
+}
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def resample(data, from_rate, to_rate):
+    if from_rate == to_rate or len(data) == 0:
+        return data
+    duration = len(data) / from_rate
+    target_length = int(round(duration * to_rate))
+    source_times = np.arange(len(data)) / from_rate
+    target_times = np.arange(target_length) / to_rate
+    return np.stack(
+        [np.interp(target_times, source_times, data[:, c]) for c in range(data.shape[1])],
+        axis=1,
+    )
+
+
+def match_channels(data, channels):
+    if data.shape[1] == channels:
+        return data
+    if data.shape[1] == 1:
+        return np.repeat(data, channels, axis=1)
+    mono = data.mean(axis=1, keepdims=True)
+    return mono if channels == 1 else np.repeat(mono, channels, axis=1)
+
+
+def join_wav(segments):
+    # Decodes each encoded segment and concatenates them at the sample rate
+    # and channel count of the first one.
+    decoded = [sf.read(io.BytesIO(segment), always_2d=True) for segment in segments]
+    samplerate = decoded[0][1]
+    channels = decoded[0][0].shape[1]
+    data = np.concatenate([
+        match_channels(resample(d, rate, samplerate), channels) for d, rate in decoded
+    ])
+    return (data[:, 0] if channels == 1 else data), samplerate
+
+
+def join_mp3(segments):
+    # MP3 is a sequence of self-contained frames, so segments can be joined
+    # without decoding.
+    return b"".join(segments)
+
+
+class StreamResampler:
+    # Linear-interpolation resampler for audio that arrives in blocks. The last
+    # input frame and the fractional read position carry over between blocks,
+    # so block boundaries are seamless.
+
+    def __init__(self, from_rate, to_rate):
+        self.step = from_rate / to_rate
+        self._position = 0.0
+        self._previous = None
+
+    def process(self, data):
+        if self._previous is not None:
+            data = np.concatenate([self._previous, data])
+        last = len(data) - 1
+        if last < self._position:
+            self._previous = data
+            return data[:0]
+        count = int((last - self._position) // self.step) + 1
+        positions = self._position + np.arange(count) * self.step
+        indices = np.arange(len(data))
+        out = np.stack(
+            [np.interp(positions, indices, data[:, c]) for c in range(data.shape[1])], axis=1
+        )
+        self._position = positions[-1] + self.step - last
+        self._previous = data[last:]
+        return out
+
+
+def output_samplerate(output_format, samplerate):
+    if output_format != "opus":
+        return samplerate
+    # Opus only encodes at these rates; never go below the source rate.
+    return next((rate for rate in OPUS_RATES if rate >= samplerate), OPUS_RATES[-1])
+
+
+def compression_level(output_format, bitrate, samplerate, channels):
+    # libsndfile takes a compression level in [0, 1] rather than a bitrate.
+    # For Opus it spans 256 to 6 kbps per channel; for MP3 it spans the
+    # bitrate table of the MPEG version the sample rate implies.
+    if output_format == "opus":
+        high, low = 256 * channels, 6 * channels
+    elif samplerate >= 32000:
+        high, low = 320, 32
+    elif samplerate >= 16000:
+        high, low = 160, 8
+    else:
+        high, low = 64, 8
+    level = (high - bitrate) / (high - low)
+    return min(max(level, 0.0), 0.99)
+
+
+class EncodedOutput:
+    # Encodes blocks of samples into one of OUTPUT_FORMATS as they are
+    # written, so a compressed render never exists uncompressed in full.
+
+    def __init__(self, target, samplerate, channels, output_format="wav", bitrate=None,
+                 subtype=None):
+        spec = OUTPUT_FORMATS[output_format]
+        rate = output_samplerate(output_format, samplerate)
+        self._resampler = StreamResampler(samplerate, rate) if rate != samplerate else None
+        options = {}
+        if "bitrates" in spec:
+            bitrate = bitrate or spec["default_bitrate"]
+            options["compression_level"] = compression_level(output_format, bitrate, rate, channels)
+            if output_format == "mp3":
+                options["bitrate_mode"] = "CONSTANT"
+        self.samplerate = samplerate
+        self.channels = channels
+        self.file = sf.SoundFile(
+            target, "w", samplerate=rate, channels=channels,
+            format=spec["format"], subtype=subtype or spec["subtype"], **options
+        )
+
+    def write(self, data):
+        if self._resampler is not None:
+            data = self._resampler.process(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+class StreamWriter:
+    # Appends encoded segments (WAV, or anything libsndfile decodes) to a
+    # path or binary file object as they arrive, encoding to output_format at
+    # the rate and channel count of the first segment. For WAV output,
+    # segments already in the output's format have their sample buffer copied
+    # across unconverted; everything else is decoded, resampled and remixed.
+
+    def __init__(self, target, output_format="wav", bitrate=None):
+        self.target = target
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self._output = None
+
+    def write(self, segment):
+        with sf.SoundFile(io.BytesIO(segment)) as source:
+            dtype = PASSTHROUGH_DTYPES.get(source.subtype)
+            if self._output is None:
+                passthrough = self.output_format == "wav" and dtype is not None
+                self._output = EncodedOutput(
+                    self.target, source.samplerate, source.channels, self.output_format,
+                    self.bitrate, subtype=source.subtype if passthrough else None
+                )
+            out = self._output
+            if (self.output_format == "wav" and dtype is not None
+                    and source.subtype == out.file.subtype
+                    and source.samplerate == out.samplerate
+                    and source.channels == out.channels):
+                out.file.buffer_write(source.buffer_read(dtype=dtype), dtype=dtype)
+                return
+            data = source.read(always_2d=True)
+            rate = source.samplerate
+        out.write(match_channels(resample(data, rate, out.samplerate), out.channels))
+
+    def close(self):
+        if self._output is not None:
+            self._output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_binary(target):
+    # Opens a path for writing; a file object is used as-is and left open.
+    if isinstance(target, (str, bytes)) or hasattr(target, "__fspath__"):
+        return open(target, "wb")
+    return contextlib.nullcontext(target)
+
+
+def open_writer(source_format, target, output_format="wav", bitrate=None):
+    if source_format == "mp3" and output_format == "mp3":
+        return open_binary(target)  # MP3 segments are appended as-is
+    return StreamWriter(target, output_format, bitrate)
@@ -0,0 +1,237 @@
+import argparse
+import csv
+import dataclasses
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pipeline
+from pipeline import PipelineSettings, TEXT_MODELS, TTS_MODELS, ELEVEN_LABS_VOICES, PIPER_MODEL, LLAMA_MODEL
+import text_backends
+import tracing
+from scheduler import BATCH
+from audio import OUTPUT_FORMATS
+
+CHECKPOINT_FILE = "job.json"
+TRACE_FILE = "trace.json"
+DEFAULT_LENGTH = 5
+# Settings that do not change what a job produces.
+UNHASHED_SETTINGS = ("text_api_key", "eleven_labs_api_key", "priority")
+
+
+def read_jobs(path, default_length=DEFAULT_LENGTH):
+    # Accepts a CSV with a header row or a JSONL file; each entry needs a
+    # title and may give its length in minutes as "length" or "video_length".
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    jobs = []
+    for row in rows:
+        title = (row.get("title") or "").strip()
+        if not title:
+            continue
+        length = row.get("length") or row.get("video_length") or default_length
+        jobs.append({"title": title, "length": int(float(length))})
+    return jobs
+
+
+def slugify(title, max_length=60):
+    slug = re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")
+    return slug[:max_length].rstrip("-") or "untitled"
+
+
+def job_key(settings, job):
+    # Identifies a job by what it is asked to produce, not by its line in the
+    # input, so reordering or inserting lines still resumes the right jobs.
+    values = {name: value for name, value in dataclasses.asdict(settings).items()
+              if name not in UNHASHED_SETTINGS}
+    payload = json.dumps({"title": job["title"], "length": job["length"], "settings": values},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def job_directory(output_dir, settings, job):
+    return os.path.join(output_dir, f"{slugify(job['title'])}-{job_key(settings, job)}")
+
+
+def load_checkpoint(job_dir):
+    try:
+        with open(os.path.join(job_dir, CHECKPOINT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(job_dir, state):
+    path = os.path.join(job_dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _read_text(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def run_job(settings, job, job_dir, limits):
+    # Runs research, script and TTS for one title, checkpointing after every
+    # stage so an interrupted batch picks up where each job left off.
+    os.makedirs(job_dir, exist_ok=True)
+    state = load_checkpoint(job_dir) or {
+        "title": job["title"], "length": job["length"], "stages": {}
+    }
+    stages = state["stages"]
+    summary_path = os.path.join(job_dir, "summary.txt")
+    script_path = os.path.join(job_dir, "script.txt")
+    audio_path = os.path.join(job_dir, "voiceover" + settings.audio_suffix)
+
+    job_trace = None
+    try:
+        with tracing.trace("job", title=job["title"], length=job["length"]) as job_trace:
+            if stages.get("research") == "done":
+                summary = _read_text(summary_path)
+            else:
+                with limits["research"]:
+                    summary = pipeline.search_and_summarize(settings, job["title"])
+                _write_text(summary_path, summary)
+                stages["research"] = "done"
+                save_checkpoint(job_dir, state)
+
+            if stages.get("script") == "done":
+                script = _read_text(script_path)
+            else:
+                with limits["script"]:
+                    script = pipeline.generate_youtube_script(
+                        settings, job["title"], summary, job["length"]
+                    )
+                _write_text(script_path, script)
+                stages["script"] = "done"
+                save_checkpoint(job_dir, state)
+
+            if stages.get("tts") != "done":
+                with limits["tts"]:
+                    pipeline.text_to_speech(settings, script, output=audio_path)
+                stages["tts"] = "done"
+
+        state["status"] = "done"
+        state.pop("error", None)
+    except Exception as e:
+        state["status"] = "failed"
+        state["error"] = str(e)
+    if job_trace is not None:
+        # Timings of this run only; stages restored from a checkpoint are absent.
+        job_trace.save(os.path.join(job_dir, TRACE_FILE))
+    save_checkpoint(job_dir, state)
+    return state
+
+
+def _api_keys(text_model, tts_model):
+    names = text_backends.get_backend_class(text_model).api_key_env
+    text_key = next((os.environ[name] for name in names if os.environ.get(name)), None)
+    eleven_labs_key = os.environ.get("ELEVENLABS_API_KEY") if tts_model == "ElevenLabs" else None
+    return text_key, eleven_labs_key
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate scripts and voiceovers for a list of YouTube titles.",
+        epilog="API keys are read from GEMINI_API_KEY (or GOOGLE_API_KEY), GROQ_API_KEY "
+               "and ELEVENLABS_API_KEY.",
+    )
+    parser.add_argument("input", help="CSV or JSONL file with title and length columns")
+    parser.add_argument("--output-dir", default="output",
+                        help="directory that receives one subdirectory per job")
+    parser.add_argument("--text-model", choices=TEXT_MODELS, default=TEXT_MODELS[0])
+    parser.add_argument("--llama-model", default=LLAMA_MODEL,
+                        help="GGUF file for --text-model local/llama.cpp (default: $LLAMA_MODEL)")
+    parser.add_argument("--tts-model", choices=TTS_MODELS, default=TTS_MODELS[0])
+    parser.add_argument("--voice", choices=ELEVEN_LABS_VOICES, default=ELEVEN_LABS_VOICES[0],
+                        help="ElevenLabs voice")
+    parser.add_argument("--piper-model", default=PIPER_MODEL,
+                        help="Piper .onnx voice for --tts-model local/piper (default: $PIPER_MODEL)")
+    parser.add_argument("--default-length", type=int, default=DEFAULT_LENGTH,
+                        help="video length in minutes for entries that do not give one")
+    parser.add_argument("--no-long-form", action="store_true",
+                        help="always generate the script with a single prompt")
+    parser.add_argument("--no-postprocess", action="store_true",
+                        help="skip loudness normalization and silence trimming")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default=None,
+                        help="output encoding (default: the TTS model's own format)")
+    parser.add_argument("--bitrate", type=int, default=None,
+                        help="bitrate in kbps for opus and mp3 output")
+    parser.add_argument("--workers", type=int, default=4, help="jobs processed at the same time")
+    parser.add_argument("--research-concurrency", type=int, default=4)
+    parser.add_argument("--script-concurrency", type=int, default=2)
+    parser.add_argument("--tts-concurrency", type=int, default=2)
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write Prometheus metrics of the run to FILE")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    text_key, eleven_labs_key = _api_keys(args.text_model, args.tts_model)
+    settings = PipelineSettings(
+        text_model=args.text_model,
+        text_api_key=text_key,
+        local_text_model=args.llama_model,
+        tts_model=args.tts_model,
+        eleven_labs_api_key=eleven_labs_key,
+        voice=args.voice,
+        local_voice_model=args.piper_model,
+        long_form=not args.no_long_form,
+        postprocess=not args.no_postprocess,
+        output_format=args.format,
+        bitrate=args.bitrate,
+        priority=BATCH,
+    )
+    missing = settings.missing_keys()
+    if missing:
+        parser.error(f"missing API key or setting for {', '.join(missing)}")
+
+    jobs = {}
+    for job in read_jobs(args.input, args.default_length):
+        # Repeated entries would share a directory; each is run once.
+        jobs.setdefault(job_directory(args.output_dir, settings, job), job)
+    limits = {
+        "research": threading.BoundedSemaphore(args.research_concurrency),
+        "script": threading.BoundedSemaphore(args.script_concurrency),
+        "tts": threading.BoundedSemaphore(args.tts_concurrency),
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(run_job, settings, job, job_dir, limits): job
+            for job_dir, job in jobs.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            state = future.result()
+            if state["status"] != "done":
+                failed += 1
+            message = state["status"] + (f" ({state['error']})" if "error" in state else "")
+            print(f"[{done}/{len(jobs)}] {futures[future]['title']}: {message}", flush=True)
+
+    print(f"{len(jobs) - failed} of {len(jobs)} jobs completed.")
+    if args.metrics:
+        tracing.metrics.write(args.metrics)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
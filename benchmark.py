@@ -0,0 +1,584 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from google.ai.generativelanguage import Candidate, Content, GenerateContentResponse, Part
+
+import pipeline
+from pipeline import PipelineSettings, TEXT_MODELS
+import research
+import research_cache
+import synthesis_cache
+import text_backends
+import tts_backends
+import longform
+from scheduler import scheduler, PROVIDER_LIMITS
+
+# Offline benchmark of the pipeline. DDGS and the Gemini, Groq, gradio and
+# ElevenLabs clients are replaced by local stand-ins that answer with
+# synthetic data after a configurable latency; everything between them is
+# the code the app runs.
+
+STAGES = ("research", "summarize", "script", "tts", "postprocess")
+DEFAULT_LENGTHS = (1, 5, 10, 30, 60, 120)
+# Characters of script per second of speech for the TTS stand-ins.
+CHARS_PER_SECOND = 15
+TTS_SAMPLERATE = 44100
+# Regressions smaller than these are treated as noise by --compare.
+MIN_SECONDS_DELTA = 0.05
+MIN_MB_DELTA = 5.0
+
+_WORDS = (
+    "the research shows that new models change how people build and test software while "
+    "teams measure results across many projects and share what they learn about data "
+    "systems design performance costs users markets history science energy climate cities "
+    "health education games music video design tools open source community future"
+).split()
+
+
+class Latency:
+    # base seconds per call plus per_unit seconds per word or second of
+    # audio, scaled by a random factor within +/- jitter.
+
+    def __init__(self, base, per_unit=0.0, jitter=0.0, seed=0):
+        self.base = base
+        self.per_unit = per_unit
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def duration(self, units=0):
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, (self.base + self.per_unit * units) * factor)
+
+    def sleep(self, units=0):
+        time.sleep(self.duration(units))
+
+
+def _seed(*parts):
+    return zlib.crc32(repr(parts).encode("utf-8"))
+
+
+def _text(seed, words):
+    # Deterministic filler prose of the given length, in sentences.
+    rng = random.Random(seed)
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(_WORDS) for _ in range(length))
+        sentences.append(sentence[0].upper() + sentence[1:] + rng.choice(".!?"))
+        words -= length
+    return " ".join(sentences)
+
+
+def fake_completion(prompt):
+    # Answers the prompts of research, pipeline and longform with text of
+    # the length and shape each one asks for.
+    seed = _seed(prompt)
+    if prompt.startswith((research.SUMMARIZE_PROMPT, research.MERGE_PROMPT)):
+        return _text(seed, 150)
+    match = re.search(r"Write exactly (\d+) sections", prompt)
+    if match:
+        return "\n".join(
+            f"Part {i + 1}: {_text(seed + i, 10)}" for i in range(int(match.group(1)))
+        )
+    match = re.search(r"about (\d+) words long", prompt)
+    if match:
+        return _text(seed, int(match.group(1)))
+    match = re.search(r"approximately (\d+) minutes long", prompt)
+    if match:
+        return _text(seed, longform.word_budget(int(match.group(1))))
+    return _text(seed, 50)
+
+
+class StandIns:
+    # Replacements for the provider SDKs, installed with install().
+
+    def __init__(self, search_latency, llm_latency, tts_latency, results_per_query=8):
+        self.search_latency = search_latency
+        self.llm_latency = llm_latency
+        self.tts_latency = tts_latency
+        self.results_per_query = results_per_query
+        self._mp3_second = None
+        self._lock = threading.Lock()
+
+    def install(self):
+        stand_ins = self
+
+        class DDGS:
+            def text(self, keywords, region=None, safesearch=None, timelimit=None,
+                     max_results=None):
+                stand_ins.search_latency.sleep()
+                count = min(max_results or stand_ins.results_per_query,
+                            stand_ins.results_per_query)
+                return [
+                    {"title": f"{keywords} {i}", "href": f"https://example.com/{i}",
+                     "body": _text(_seed(keywords, i), 60)}
+                    for i in range(count)
+                ]
+
+        research.DDGS = DDGS
+        text_backends.GenerativeServiceClient = self._gemini_client
+        text_backends.Groq = self._groq_client
+        tts_backends.Client = self._gradio_client
+        tts_backends.ElevenLabs = self._elevenlabs_client
+
+    def _completion(self, prompt):
+        text = fake_completion(prompt)
+        self.llm_latency.sleep(len(text.split()))
+        return text
+
+    def _stream(self, prompt):
+        # The first token arrives after the base latency, the rest at the
+        # configured token rate.
+        words = fake_completion(prompt).split(" ")
+        self.llm_latency.sleep()
+        for word in words:
+            time.sleep(self.llm_latency.per_unit)
+            yield word + " "
+
+    def _gemini_client(self, client_options):
+        stand_ins = self
+
+        def response(text):
+            return GenerateContentResponse(
+                candidates=[Candidate(content=Content(parts=[Part(text=text)]))]
+            )
+
+        class GenerativeServiceClient:
+            def generate_content(self, request):
+                return response(stand_ins._completion(request.contents[-1].parts[0].text))
+
+            def stream_generate_content(self, request):
+                prompt = request.contents[-1].parts[0].text
+                return (response(text) for text in stand_ins._stream(prompt))
+
+        return GenerativeServiceClient()
+
+    def _groq_client(self, api_key):
+        stand_ins = self
+
+        def create(messages, model, stream=False):
+            prompt = messages[-1]["content"]
+            if stream:
+                return (
+                    types.SimpleNamespace(choices=[types.SimpleNamespace(
+                        delta=types.SimpleNamespace(content=text))])
+                    for text in stand_ins._stream(prompt)
+                )
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(
+                message=types.SimpleNamespace(content=stand_ins._completion(prompt)))])
+
+        return types.SimpleNamespace(
+            models=types.SimpleNamespace(list=lambda: list(TEXT_MODELS)),
+            chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)),
+        )
+
+    @staticmethod
+    def _speech(text):
+        # A tone with a syllable-rate envelope and short pauses at both ends,
+        # so trimming and loudness measurement have real work to do.
+        seconds = max(0.5, len(text) / CHARS_PER_SECOND)
+        t = np.arange(int(seconds * TTS_SAMPLERATE)) / TTS_SAMPLERATE
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+        data = 0.3 * envelope * np.sin(2 * np.pi * 220 * t)
+        pad = np.zeros(int(0.2 * TTS_SAMPLERATE))
+        return np.concatenate([pad, data, pad]), seconds
+
+    def _gradio_client(self, src):
+        stand_ins = self
+
+        class Client:
+            def view_api(self, print_info=False, return_format=None):
+                return {}
+
+            def predict(self, text, speaker, speed, language, api_name):
+                data, seconds = stand_ins._speech(text)
+                stand_ins.tts_latency.sleep(seconds)
+                fd, path = tempfile.mkstemp(suffix=".wav")
+                with os.fdopen(fd, "wb") as f:
+                    sf.write(f, data, TTS_SAMPLERATE, format="WAV", subtype="PCM_16")
+                return path
+
+        return Client()
+
+    def _mp3(self, seconds):
+        # One second of encoded MP3, repeated; MP3 frames concatenate.
+        with self._lock:
+            if self._mp3_second is None:
+                data, _ = self._speech("x" * CHARS_PER_SECOND)
+                buffer = io.BytesIO()
+                sf.write(buffer, data[:TTS_SAMPLERATE], TTS_SAMPLERATE, format="MP3")
+                self._mp3_second = buffer.getvalue()
+        return self._mp3_second * max(1, int(round(seconds)))
+
+    def _elevenlabs_client(self, api_key):
+        stand_ins = self
+
+        class ElevenLabs:
+            def generate(self, text, voice, model):
+                seconds = max(0.5, len(text) / CHARS_PER_SECOND)
+                stand_ins.tts_latency.sleep(seconds)
+                audio = stand_ins._mp3(seconds)
+                for start in range(0, len(audio), 4096):
+                    yield audio[start:start + 4096]
+
+        return ElevenLabs()
+
+
+def lift_provider_limits():
+    unlimited = {"rate": 1e9, "burst": 1e9, "max_concurrency": 1024}
+    scheduler.limits = {name: unlimited for name in PROVIDER_LIMITS}
+
+
+def use_scratch_caches(directory):
+    # Cold caches in a scratch directory, so every run does all the work and
+    # the user's caches are left alone.
+    research_cache._default_cache = research_cache.ResearchCache(
+        os.path.join(directory, "research.sqlite3")
+    )
+    synthesis_cache._default_cache = synthesis_cache.SynthesisCache(os.path.join(directory, "tts"))
+
+
+class StageTimer:
+    # Wall-clock time per stage for one job. Overlapping intervals of the
+    # same stage, e.g. parallel summaries, are counted once.
+
+    def __init__(self):
+        self.intervals = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def add(self, stage, start, end):
+        with self._lock:
+            self.intervals[stage].append((start, end))
+
+    def timed(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.add(stage, start, time.perf_counter())
+
+    def total(self, stage):
+        total, reach = 0.0, None
+        for start, end in sorted(self.intervals[stage]):
+            if reach is None or start > reach:
+                total += end - start
+                reach = end
+            elif end > reach:
+                total += end - reach
+                reach = end
+        return total
+
+
+# The writer of the job running on the current thread; text_to_speech writes
+# segments on the thread that called it.
+_current = threading.local()
+
+
+def _timed_writer(writer):
+    class TimedWriter:
+        def write(self, *args):
+            timer = getattr(_current, "timer", None)
+            start = time.perf_counter()
+            writer.write(*args)
+            if timer is not None:
+                timer.add("postprocess", start, time.perf_counter())
+
+        def __getattr__(self, name):  # match() and reuse() of an AlignedWriter
+            return getattr(writer, name)
+
+        def __enter__(self):
+            writer.__enter__()
+            return self
+
+        def __exit__(self, *exc_info):
+            timer = getattr(_current, "timer", None)
+            start = time.perf_counter()
+            try:
+                return writer.__exit__(*exc_info)
+            finally:
+                if timer is not None:
+                    timer.add("postprocess", start, time.perf_counter())
+
+    return TimedWriter()
+
+
+def instrument_writers():
+    # Time spent in the writers is post-processing and encoding; the rest of
+    # text_to_speech is waiting for and caching segments.
+    post_processing_writer, open_writer = pipeline.PostProcessingWriter, pipeline.open_writer
+    aligned_writer = pipeline.AlignedWriter
+    pipeline.PostProcessingWriter = lambda *a, **kw: _timed_writer(post_processing_writer(*a, **kw))
+    pipeline.open_writer = lambda *a, **kw: _timed_writer(open_writer(*a, **kw))
+    pipeline.AlignedWriter = lambda *a, **kw: _timed_writer(aligned_writer(*a, **kw))
+
+
+def run_job(settings, title, minutes, output_dir):
+    timer = StageTimer()
+    start = time.perf_counter()
+    summary = research.search_and_summarize(
+        title,
+        lambda prompt: timer.timed("summarize", pipeline.complete_text, settings, prompt),
+        cache=research_cache.get_default_cache(),
+        model=text_backends.get_backend(settings).model_id,
+        priority=settings.priority
+    )
+    timer.add("research", start, time.perf_counter())
+    script = timer.timed(
+        "script", pipeline.generate_youtube_script, settings, title, summary, minutes
+    )
+    path = os.path.join(output_dir, f"{_seed(title)}{settings.audio_suffix}")
+    # Renders keep the pieces of every sentence for editing, as in the app.
+    render_dir = os.path.join(output_dir, f"{_seed(title)}.render")
+    _current.timer = timer
+    try:
+        tts = timer.timed("tts", pipeline.text_to_speech, settings, script, output=path,
+                          render_dir=render_dir)
+    finally:
+        _current.timer = None
+        shutil.rmtree(render_dir, ignore_errors=True)
+    os.unlink(tts)
+
+    stages = {stage: timer.total(stage) for stage in STAGES}
+    # research and tts include the stages nested in them.
+    stages["research"] -= stages["summarize"]
+    stages["tts"] -= stages["postprocess"]
+    return {
+        "stages": stages,
+        "total": time.perf_counter() - start,
+        "script_words": len(script.split()),
+    }
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"mean": sum(values) / len(values), "p50": pick(0.5), "p95": pick(0.95),
+            "max": values[-1]}
+
+
+def _setup(config, directory):
+    stand_ins = StandIns(
+        Latency(config["search_latency"], jitter=config["jitter"], seed=1),
+        Latency(config["llm_latency"], 1 / config["llm_tokens_per_second"],
+                jitter=config["jitter"], seed=2),
+        Latency(config["tts_latency"], config["tts_realtime_factor"],
+                jitter=config["jitter"], seed=3),
+    )
+    stand_ins.install()
+    if not config["provider_limits"]:
+        lift_provider_limits()
+    use_scratch_caches(directory)
+    instrument_writers()
+    return PipelineSettings(
+        text_model=config["text_model"],
+        text_api_key="benchmark",
+        tts_model=config["tts_model"],
+        eleven_labs_api_key="benchmark",
+        long_form=config["long_form"],
+        postprocess=config["postprocess"],
+        output_format=config["format"],
+        bitrate=config["bitrate"],
+    )
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def measure_memory(config, minutes):
+    # Runs in a fresh process, so the high-water mark belongs to this job.
+    with tempfile.TemporaryDirectory() as directory:
+        settings = _setup(config, directory)
+        baseline = _max_rss_mb()
+        result = run_job(settings, f"Benchmark topic {minutes}", minutes, directory)
+    result["minutes"] = minutes
+    result["peak_mb"] = _max_rss_mb()
+    result["baseline_mb"] = baseline
+    return result
+
+
+def measure_throughput(config):
+    with tempfile.TemporaryDirectory() as directory:
+        settings = _setup(config, directory)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=config["concurrency"]) as executor:
+            results = list(executor.map(
+                lambda i: run_job(settings, f"Benchmark topic {i}", config["length"], directory),
+                range(config["jobs"])
+            ))
+        elapsed = time.perf_counter() - start
+    return {
+        "jobs": config["jobs"],
+        "concurrency": config["concurrency"],
+        "minutes": config["length"],
+        "elapsed": elapsed,
+        "jobs_per_minute": 60 * len(results) / elapsed,
+        "audio_minutes_per_minute": config["length"] * len(results) / (elapsed / 60),
+        "stages": {stage: _summary([r["stages"][stage] for r in results]) for stage in STAGES},
+        "total": _summary([r["total"] for r in results]),
+    }
+
+
+def _in_subprocess(fn, *args):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def compare(report, baseline, tolerance):
+    # Lists the measurements that are worse than the baseline by more than
+    # tolerance (a fraction) and by more than the noise floor.
+    regressions = []
+
+    def check(name, new, old, floor):
+        if old is not None and new > old * (1 + tolerance) and new - old > floor:
+            regressions.append(f"{name}: {old:.3f} -> {new:.3f}")
+
+    old_throughput = baseline.get("throughput")
+    if report.get("throughput") and old_throughput:
+        for stage in STAGES:
+            check(f"throughput {stage} mean (s)", report["throughput"]["stages"][stage]["mean"],
+                  old_throughput["stages"].get(stage, {}).get("mean"), MIN_SECONDS_DELTA)
+        check("throughput elapsed (s)", report["throughput"]["elapsed"],
+              old_throughput.get("elapsed"), MIN_SECONDS_DELTA)
+    old_memory = {entry["minutes"]: entry for entry in baseline.get("memory", [])}
+    for entry in report.get("memory", []):
+        old = old_memory.get(entry["minutes"])
+        if old is None:
+            continue
+        check(f"{entry['minutes']} min peak memory (MB)", entry["peak_mb"], old["peak_mb"],
+              MIN_MB_DELTA)
+        for stage in STAGES:
+            check(f"{entry['minutes']} min {stage} (s)", entry["stages"][stage],
+                  old["stages"].get(stage), MIN_SECONDS_DELTA)
+    return regressions
+
+
+def print_report(report):
+    throughput = report.get("throughput")
+    if throughput:
+        print(f"Throughput: {throughput['jobs']} jobs of {throughput['minutes']} min at "
+              f"concurrency {throughput['concurrency']}: {throughput['elapsed']:.2f}s, "
+              f"{throughput['jobs_per_minute']:.1f} jobs/min")
+        print(f"  {'stage':<12}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+        for stage in STAGES + ("total",):
+            values = throughput["total"] if stage == "total" else throughput["stages"][stage]
+            print(f"  {stage:<12}" + "".join(f"{values[k]:>9.3f}" for k in ("mean", "p50", "p95", "max")))
+    if report.get("memory"):
+        print("Single job by script length:")
+        print(f"  {'minutes':>7}{'words':>8}" + "".join(f"{stage:>12}" for stage in STAGES)
+              + f"{'peak MB':>10}{'base MB':>10}")
+        for entry in report["memory"]:
+            print(f"  {entry['minutes']:>7}{entry['script_words']:>8}"
+                  + "".join(f"{entry['stages'][stage]:>12.3f}" for stage in STAGES)
+                  + f"{entry['peak_mb']:>10.1f}{entry['baseline_mb']:>10.1f}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline offline against simulated providers.",
+    )
+    parser.add_argument("--text-model", choices=[m for m in TEXT_MODELS if not m.startswith("local/")],
+                        default=TEXT_MODELS[0])
+    parser.add_argument("--tts-model", choices=["mrfakename/MeloTTS", "ElevenLabs"],
+                        default="mrfakename/MeloTTS")
+    parser.add_argument("--no-long-form", action="store_true")
+    parser.add_argument("--no-postprocess", action="store_true")
+    parser.add_argument("--format", default=None, help="output encoding (default: native)")
+    parser.add_argument("--bitrate", type=int, default=None)
+    parser.add_argument("--jobs", type=int, default=8, help="jobs in the throughput run")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="jobs running at the same time in the throughput run")
+    parser.add_argument("--length", type=int, default=5,
+                        help="script length in minutes for the throughput run")
+    parser.add_argument("--lengths", default=",".join(map(str, DEFAULT_LENGTHS)),
+                        help="comma-separated script lengths in minutes for the memory runs; "
+                             "empty to skip them")
+    parser.add_argument("--search-latency", type=float, default=0.3,
+                        help="seconds per search request")
+    parser.add_argument("--llm-latency", type=float, default=0.5,
+                        help="seconds to the first token of a completion")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=500)
+    parser.add_argument("--tts-latency", type=float, default=0.3,
+                        help="seconds per TTS request")
+    parser.add_argument("--tts-realtime-factor", type=float, default=0.02,
+                        help="seconds of TTS time per second of audio")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="random variation of every latency, as a fraction")
+    parser.add_argument("--provider-limits", action="store_true",
+                        help="keep the scheduler's provider rate limits")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run; exit with 1 "
+                                          "if a stage, the elapsed time or peak memory regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against --compare, as a fraction")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    config = {
+        "text_model": args.text_model,
+        "tts_model": args.tts_model,
+        "long_form": not args.no_long_form,
+        "postprocess": not args.no_postprocess,
+        "format": args.format,
+        "bitrate": args.bitrate,
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "length": args.length,
+        "search_latency": args.search_latency,
+        "llm_latency": args.llm_latency,
+        "llm_tokens_per_second": args.llm_tokens_per_second,
+        "tts_latency": args.tts_latency,
+        "tts_realtime_factor": args.tts_realtime_factor,
+        "jitter": args.jitter,
+        "provider_limits": args.provider_limits,
+    }
+    lengths = [int(length) for length in args.lengths.split(",") if length.strip()]
+
+    report = {"config": config, "memory": []}
+    if args.jobs:
+        report["throughput"] = _in_subprocess(measure_throughput, config)
+    for minutes in lengths:
+        report["memory"].append(_in_subprocess(measure_memory, config, minutes))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
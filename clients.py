@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import time
+
+from scheduler import is_throttled, is_transient
+
+IDLE_TIMEOUT = 30 * 60
+HEALTH_CHECK_INTERVAL = 5 * 60
+
+
+class _Entry:
+    def __init__(self, client, health_check):
+        self.client = client
+        self.health_check = health_check
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+
+def _busy(client):
+    # Clients that do work of their own (a local model) report whether it is
+    # in progress; they are not evicted while it is.
+    busy = getattr(client, "busy", None)
+    return callable(busy) and busy()
+
+
+def _close(client):
+    close = getattr(client, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class ClientRegistry:
+    # Keeps one client per (backend, key) alive for the life of the process.
+    # Imported modules survive Streamlit reruns, so the module-level registry
+    # below is shared by every rerun and every session.
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._entries = {}
+        self._creating = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _slot(backend, key):
+        # API keys are hashed so they never appear in the registry itself.
+        return backend, hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+
+    def get(self, backend, key, factory, health_check=None):
+        slot = self._slot(backend, key)
+        self.evict_idle()
+        with self._lock:
+            entry = self._entries.get(slot)
+            creating = self._creating.setdefault(slot, threading.Lock())
+        if entry is not None and self._healthy(entry):
+            entry.last_used = time.monotonic()
+            return entry.client
+        if entry is not None:
+            # Other threads may still be using the client, so it is only
+            # dropped from the registry and closed once nothing refers to it.
+            with self._lock:
+                if self._entries.get(slot) is entry:
+                    del self._entries[slot]
+
+        # Only one thread builds a given client; the others wait for it.
+        with creating:
+            with self._lock:
+                entry = self._entries.get(slot)
+            if entry is None:
+                entry = _Entry(factory(), health_check)
+                with self._lock:
+                    self._entries[slot] = entry
+            entry.last_used = time.monotonic()
+            return entry.client
+
+    def _healthy(self, entry):
+        now = time.monotonic()
+        if entry.health_check is None or now - entry.last_checked < self.health_check_interval:
+            return True
+        entry.last_checked = now
+        try:
+            return bool(entry.health_check(entry.client))
+        except Exception as e:
+            # Throttling or a network blip says nothing about the client.
+            return is_throttled(e) or is_transient(e)
+
+    def discard(self, backend, key):
+        with self._lock:
+            entry = self._entries.pop(self._slot(backend, key), None)
+        if entry is not None:
+            _close(entry.client)
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [
+                slot for slot, entry in self._entries.items()
+                if entry.last_used < cutoff and not _busy(entry.client)
+            ]
+            evicted = [self._entries.pop(slot) for slot in idle]
+        for entry in evicted:
+            _close(entry.client)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+registry = ClientRegistry()
@@ -0,0 +1,471 @@
+import dataclasses
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import pipeline
+import tracing
+from pipeline import PipelineSettings
+
+JOBS_DIR = os.environ.get(
+    "JOBS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "yt-voiceover", "jobs")
+)
+WORKERS = int(os.environ.get("JOB_WORKERS", str(min(4, os.cpu_count() or 1))))
+RETENTION = float(os.environ.get("JOB_RETENTION_HOURS", "168")) * 3600
+POLL_INTERVAL = 0.5
+# Progress is written to the queue at most this often.
+PROGRESS_INTERVAL = 0.5
+# A job whose worker died is queued again until it has been started this often.
+MAX_ATTEMPTS = 2
+# Every pool records that it is alive this often; the jobs of a pool that has
+# not done so for POOL_TIMEOUT seconds are taken over by another.
+HEARTBEAT_INTERVAL = 5
+POOL_TIMEOUT = 30
+# Every job leaves its span timings in this file of its directory.
+TRACE_FILE = "trace.json"
+# Audio jobs keep the alignment of their render here, so a job for an edited
+# script can reuse the unchanged sentences.
+RENDER_DIR = "render"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# API keys never reach the queue on disk; they are handed to the workers in
+# memory and are lost when the app restarts.
+SECRET_FIELDS = ("text_api_key", "eleven_labs_api_key")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    # Persistent job queue in SQLite. Any process can submit and read jobs;
+    # workers take them in priority order with claim(), which is a single
+    # UPDATE and so never hands one job to two workers. Several app servers
+    # can share the queue: a job belongs to the pool that submitted it, the
+    # only one holding its keys, and only that pool's workers claim it.
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " priority INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"
+                " progress REAL NOT NULL DEFAULT 0,"
+                " message TEXT,"
+                " result TEXT,"
+                " error TEXT,"
+                " pool TEXT,"
+                " worker TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " created REAL NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "pool" not in columns:  # a queue created before jobs had owners
+                conn.execute("ALTER TABLE jobs ADD COLUMN pool TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, created)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pools (id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # A connection per operation keeps the queue usable from any thread.
+        return sqlite3.connect(self.path, timeout=30)
+
+    def submit(self, job_id, kind, params, priority, pool=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, priority, status, pool, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), priority, QUEUED, pool, now, now),
+            )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def claim(self, worker, pool=None):
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, updated = ?"
+                " WHERE id = (SELECT id FROM jobs WHERE status = ? AND pool IS ?"
+                "             ORDER BY priority, created LIMIT 1)"
+                " RETURNING id",
+                (RUNNING, worker, time.time(), QUEUED, pool),
+            ).fetchone()
+        return self.get(row[0]) if row is not None else None
+
+    def report(self, job_id, progress, message):
+        # Returns whether the job has been asked to stop, and its priority,
+        # which may have changed since it was claimed.
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, message = ?, updated = ? WHERE id = ?",
+                (progress, message, time.time(), job_id),
+            )
+            row = conn.execute(
+                "SELECT cancel_requested, priority FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return False, None
+        return bool(row[0]), row[1]
+
+    def _finish(self, job_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def complete(self, job_id, result):
+        # A job asked to stop after its last progress report is cancelled
+        # rather than done, and its result is dropped.
+        now = time.time()
+        with self._connect() as conn:
+            done = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, progress = 1, updated = ?"
+                " WHERE id = ? AND NOT cancel_requested",
+                (DONE, json.dumps(result), now, job_id),
+            ).rowcount
+            if not done:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                    (CANCELLED, now, job_id),
+                )
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def mark_cancelled(self, job_id):
+        self._finish(job_id, CANCELLED)
+
+    def prioritize(self, job_id, priority):
+        # Moves a job to another priority; a running one schedules its
+        # provider calls at the new priority from its next progress report.
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET priority = ?, updated = ? WHERE id = ? AND status IN (?, ?)",
+                (priority, time.time(), job_id, QUEUED, RUNNING),
+            )
+
+    def cancel(self, job_id):
+        # A queued job is cancelled at once; a running one stops at its next
+        # progress report.
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                (CANCELLED, now, job_id, QUEUED),
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated = ? WHERE id = ? AND status = ?",
+                (now, job_id, RUNNING),
+            )
+
+    def recover(self, is_alive, pool=None):
+        # Jobs of this pool left running by a worker that no longer exists
+        # are queued again, or failed once they have used up their attempts.
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, worker, attempts FROM jobs WHERE status = ? AND pool IS ?",
+                (RUNNING, pool),
+            ).fetchall()
+        for job_id, worker, attempts in rows:
+            if is_alive(worker):
+                continue
+            if attempts < MAX_ATTEMPTS:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                        (QUEUED, time.time(), job_id, RUNNING),
+                    )
+            else:
+                self.fail(job_id, "The worker running this job stopped unexpectedly.")
+
+    def heartbeat(self, pool):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pools (id, heartbeat) VALUES (?, ?)", (pool, time.time())
+            )
+
+    def adopt(self, pool, timeout=POOL_TIMEOUT):
+        # Moves the unfinished jobs of pools that have stopped, and of queues
+        # from before jobs had owners, to this pool. Their running jobs count
+        # as interrupted, as in recover().
+        now = time.time()
+        stale = "(pool IS NULL OR pool NOT IN (SELECT id FROM pools WHERE heartbeat >= ?))"
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ?"
+                f" WHERE status = ? AND attempts >= ? AND {stale}",
+                (FAILED, "The worker running this job stopped unexpectedly.", now,
+                 RUNNING, MAX_ATTEMPTS, now - timeout),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, pool = ?, worker = NULL, updated = ?"
+                f" WHERE status IN (?, ?) AND {stale}",
+                (QUEUED, pool, now, QUEUED, RUNNING, now - timeout),
+            )
+            conn.execute("DELETE FROM pools WHERE heartbeat < ?", (now - timeout,))
+
+    def prune(self, max_age):
+        # Finished jobs older than max_age seconds are removed together with
+        # their output directories.
+        cutoff = time.time() - max_age
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?, ?) AND updated < ?",
+                (*FINISHED, cutoff),
+            ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE id = ?", rows)
+        for (job_id,) in rows:
+            shutil.rmtree(job_directory(job_id), ignore_errors=True)
+
+
+def public_settings(settings):
+    # The settings of a job as they are stored in the queue.
+    values = dataclasses.asdict(settings)
+    for field in SECRET_FIELDS:
+        values.pop(field)
+    return values
+
+
+def job_directory(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def load_trace(job_id):
+    try:
+        with open(os.path.join(job_directory(job_id), TRACE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run_script_job(settings, params, job_dir, report):
+    report(0.0, "Researching the topic...")
+    summary = pipeline.search_and_summarize(settings, params["title"])
+    report(0.5, "Writing the script...")
+    script = pipeline.generate_youtube_script(
+        settings, params["title"], summary, params["video_length"], params.get("regenerate", False),
+        report=lambda fraction, message: report(0.5 + 0.5 * fraction, message)
+    )
+    return {"summary": summary, "script": script}
+
+
+def run_audio_job(settings, params, job_dir, report):
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, "voiceover" + settings.audio_suffix)
+
+    def on_progress(snapshot):
+        report(min(snapshot.fraction, 1.0), f"{snapshot.done}/{snapshot.total} segments")
+
+    render_dir = os.path.join(job_dir, RENDER_DIR)
+    pipeline.text_to_speech(
+        settings, params["script"], output=path, on_progress=on_progress,
+        render_dir=render_dir, previous_dir=params.get("previous_dir")
+    )
+    return {"path": path, "mime": settings.audio_mime, "suffix": settings.audio_suffix,
+            "render_dir": render_dir}
+
+
+HANDLERS = {
+    "script": run_script_job,
+    "audio": run_audio_job,
+}
+
+
+def run_job(queue, job, secrets, traces=None):
+    job_id = job["id"]
+    params = dict(job["params"])
+    values = dict(params.pop("settings"), **dict.fromkeys(SECRET_FIELDS))
+    values.update(secrets or {})
+    settings = PipelineSettings(**values)
+    if settings.missing_keys():
+        queue.fail(job_id, "The API keys for this job are no longer available; submit it again.")
+        return
+
+    last_report = [0.0]
+
+    def report(progress, message):
+        now = time.monotonic()
+        if now - last_report[0] < PROGRESS_INTERVAL and progress < 1:
+            return
+        last_report[0] = now
+        cancelled, priority = queue.report(job_id, progress, message)
+        if cancelled:
+            raise JobCancelled()
+        if priority is not None:
+            # The backends read the priority from the settings on every call.
+            settings.priority = priority
+
+    job_dir = job_directory(job_id)
+    job_trace = None
+    try:
+        with tracing.trace(f"job.{job['kind']}", job_id=job_id) as job_trace:
+            result = HANDLERS[job["kind"]](settings, params, job_dir, report)
+    except JobCancelled:
+        queue.mark_cancelled(job_id)
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job_id, str(e))
+    else:
+        queue.complete(job_id, result)
+    finally:
+        if job_trace is not None:
+            os.makedirs(job_dir, exist_ok=True)
+            job_trace.save(os.path.join(job_dir, TRACE_FILE))
+            if traces is not None:
+                traces.put(job_trace.to_dict())
+
+
+def _worker_main(path, pool, worker, secrets, traces):
+    queue = JobQueue(path)
+    parent = multiprocessing.parent_process()
+    # A worker whose pool is gone stops; its jobs are adopted by another pool.
+    while parent.is_alive():
+        job = queue.claim(worker, pool)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        # The keys stay available until the job is over, in case this worker
+        # dies and the job is recovered by another.
+        run_job(queue, job, secrets.get(job["id"]), traces)
+        secrets.pop(job["id"], None)
+
+
+class WorkerPool:
+    # Worker processes that run the jobs of a JobQueue. One pool is started
+    # per server process and shared by all its sessions; jobs and their
+    # results live in the queue, so they outlast reruns, page reloads and
+    # the pool itself. Workers are known by a token of their own rather than
+    # their PID, which the system may hand to another process.
+
+    def __init__(self, path=None, workers=WORKERS):
+        path = path or os.path.join(JOBS_DIR, "queue.sqlite3")
+        self.path = path
+        self.id = uuid.uuid4().hex
+        self.queue = JobQueue(path)
+        self.queue.heartbeat(self.id)
+        self.queue.prune(RETENTION)
+        self.queue.adopt(self.id)
+        # spawn rather than fork: the app process runs threads of its own.
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = self._context.Manager()
+        self._secrets = self._manager.dict()
+        # Traces of finished jobs come back to this process, so its metrics
+        # cover the work of the workers.
+        self._traces = self._manager.Queue()
+        self._processes = [None] * workers
+        self._tokens = [None] * workers
+        self._lock = threading.Lock()
+        self._ensure_workers()
+        threading.Thread(target=self._collect_traces, name="job-traces", daemon=True).start()
+        threading.Thread(target=self._keep_alive, name="job-heartbeat", daemon=True).start()
+
+    def _keep_alive(self):
+        # Besides the heartbeat, replaces crashed workers without waiting for
+        # the next submission, so the jobs they were running are queued again.
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.queue.heartbeat(self.id)
+                self.queue.adopt(self.id)
+                self._ensure_workers()
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def _collect_traces(self):
+        while True:
+            try:
+                job_trace = self._traces.get()
+            except (EOFError, OSError):  # the manager has shut down
+                return
+            tracing.metrics.record_trace(job_trace)
+
+    def _alive(self, worker):
+        return any(
+            token == worker and process.is_alive()
+            for process, token in zip(self._processes, self._tokens) if process is not None
+        )
+
+    def _ensure_workers(self):
+        # Replaces workers that have died, e.g. after a crash in a native
+        # library; their jobs are recovered first.
+        with self._lock:
+            dead = [i for i, p in enumerate(self._processes) if p is None or not p.is_alive()]
+            if not dead:
+                return
+            if any(p is not None for p in self._processes):
+                self.queue.recover(self._alive, self.id)
+            for i in dead:
+                token = uuid.uuid4().hex
+                process = self._context.Process(
+                    target=_worker_main,
+                    args=(self.path, self.id, token, self._secrets, self._traces),
+                    name=f"job-worker-{i}", daemon=True
+                )
+                process.start()
+                self._processes[i] = process
+                self._tokens[i] = token
+
+    def submit(self, kind, settings, priority=None, **params):
+        secrets = {field: getattr(settings, field) for field in SECRET_FIELDS}
+        job_id = uuid.uuid4().hex
+        # The keys are in place before the job can be claimed.
+        self._secrets[job_id] = secrets
+        self.queue.submit(
+            job_id, kind, dict(params, settings=public_settings(settings)),
+            settings.priority if priority is None else priority, pool=self.id
+        )
+        self._ensure_workers()
+        return job_id
+
+    def get(self, job_id):
+        return self.queue.get(job_id)
+
+    def prioritize(self, job_id, priority):
+        self.queue.prioritize(job_id, priority)
+
+    def cancel(self, job_id):
+        self.queue.cancel(job_id)
+        self._secrets.pop(job_id, None)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = WorkerPool()
+        return _default_pool
@@ -0,0 +1,215 @@
+import contextlib
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from tts_pipeline import split_sentences
+
+WORDS_PER_MINUTE = 150
+# Videos at least this long are drafted section by section.
+LONGFORM_THRESHOLD_MINUTES = 10
+SECTION_WORDS = 600
+MAX_SECTIONS = 24
+# A section more than this fraction over or under its word budget is
+# revised once.
+LENGTH_TOLERANCE = 0.2
+
+_LIST_MARKER = re.compile(r'^\s*(?:[-*•]|\d+[.)]|section\s+\d+\s*[:.-])\s*', re.IGNORECASE)
+_GREETING = re.compile(
+    r"^(?:hi|hello|hey|welcome(?: back)?|greetings)\b.*(?:everyone|folks|guys|channel|video|back)\b",
+    re.IGNORECASE,
+)
+_SIGN_OFF = re.compile(
+    r"\b(?:thanks for watching|thank you for watching|see you (?:next time|in the next)|"
+    r"don't forget to (?:like|subscribe)|hit (?:the )?subscribe|until next time)\b",
+    re.IGNORECASE,
+)
+
+
+def word_budget(video_length, words_per_minute=WORDS_PER_MINUTE):
+    return int(video_length * words_per_minute)
+
+
+def section_count(video_length, words_per_minute=WORDS_PER_MINUTE):
+    sections = math.ceil(word_budget(video_length, words_per_minute) / SECTION_WORDS)
+    return max(3, min(MAX_SECTIONS, sections))
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def allocate_budgets(total_words, sections):
+    # Introduction and conclusion get half the weight of a body section.
+    weights = [1.0] * sections
+    weights[0] = weights[-1] = 0.5
+    scale = total_words / sum(weights)
+    return [max(50, int(round(weight * scale))) for weight in weights]
+
+
+def parse_outline(text):
+    sections = []
+    for line in text.splitlines():
+        line = _LIST_MARKER.sub("", line.strip()).strip("*# ")
+        if not line:
+            continue
+        heading, _, summary = line.partition(":")
+        sections.append({"heading": heading.strip(" *#"), "summary": summary.strip(" *")})
+    return sections
+
+
+def generate_outline(title, context, video_length, complete,
+                     words_per_minute=WORDS_PER_MINUTE):
+    sections = section_count(video_length, words_per_minute)
+    prompt = f'''
+    Plan the structure of a YouTube voiceover script.
+
+    Title: {title}
+
+    Context: {context}
+
+    Write exactly {sections} sections, one per line, in the form "Heading: one sentence describing what the section covers". The first section is the introduction and the last section is the conclusion.
+
+    Only provide the {sections} lines, without any additional formatting or instructions.
+    '''
+    with tracing.span("outline", sections=sections):
+        outline = parse_outline(complete(prompt))[:sections]
+    if len(outline) < 2:
+        raise ValueError("Could not generate an outline for the script.")
+    budgets = allocate_budgets(word_budget(video_length, words_per_minute), len(outline))
+    for section, budget in zip(outline, budgets):
+        section["words"] = budget
+    return outline
+
+
+def draft_section(title, context, outline, index, complete):
+    section = outline[index]
+    plan = "\n".join(
+        f"{i + 1}. {s['heading']}: {s['summary']}" for i, s in enumerate(outline)
+    )
+    if index == 0:
+        role = "This is the opening section. Start with a strong introduction that hooks the viewer."
+    elif index == len(outline) - 1:
+        role = (f"This is the closing section, following \"{outline[index - 1]['heading']}\". "
+                "Conclude with a statement that leaves the viewer wanting to learn more.")
+    else:
+        role = (f"This section follows \"{outline[index - 1]['heading']}\" and leads into "
+                f"\"{outline[index + 1]['heading']}\". Continue naturally from the previous section; "
+                "do not greet the viewer, introduce the video or wrap it up.")
+    prompt = f'''
+    You are writing one section of a YouTube script voiceover. Make it sound like a natural conversation, with pauses and a conversational tone.
+
+    Title: {title}
+
+    Context: {context}
+
+    Full outline:
+    {plan}
+
+    Write section {index + 1}: {section['heading']} - {section['summary']}
+    {role}
+    The section should be about {section['words']} words long.
+
+    Only provide the voiceover text for this section, without headings, formatting or instructions.
+    '''
+    with tracing.span("section", index=index, words=section['words']):
+        return complete(prompt).strip()
+
+
+def within_budget(text, words, tolerance=LENGTH_TOLERANCE):
+    return abs(word_count(text) - words) <= tolerance * words
+
+
+def revise_section(title, outline, index, draft, complete):
+    section = outline[index]
+    words = word_count(draft)
+    if words < section['words']:
+        action = "Expand it with more detail and examples"
+    else:
+        action = "Tighten it by cutting repetition and minor points"
+    prompt = f'''
+    The following section of a YouTube script voiceover is {words} words long but should be about {section['words']} words long. {action}. Keep its content, conversational tone and paragraph breaks.
+
+    Title: {title}
+
+    Section {index + 1}: {section['heading']} - {section['summary']}
+
+    {draft}
+
+    Only provide the revised voiceover text for this section, without headings, formatting or instructions.
+    '''
+    with tracing.span("revise", index=index, words=words, target=section['words']):
+        return complete(prompt).strip()
+
+
+def _drop_first(text, sentence):
+    return text[text.index(sentence) + len(sentence):].lstrip()
+
+
+def _drop_last(text, sentence):
+    return text[:text.rindex(sentence)].rstrip()
+
+
+def smooth_transitions(sections):
+    # Drops greetings that open a later section, sign-offs that close an
+    # earlier one, and a sentence repeated across a section boundary. The
+    # sentences are cut out of the section text, so the paragraph breaks
+    # inside it are kept.
+    smoothed = []
+    for index, text in enumerate(sections):
+        text = text.strip()
+        if index > 0:
+            while text and _GREETING.search(split_sentences(text)[0]):
+                text = _drop_first(text, split_sentences(text)[0])
+            if smoothed and text and (split_sentences(text)[0]
+                                      == split_sentences(smoothed[-1])[-1]):
+                text = _drop_first(text, split_sentences(text)[0])
+        if index < len(sections) - 1:
+            while text and _SIGN_OFF.search(split_sentences(text)[-1]):
+                text = _drop_last(text, split_sentences(text)[-1])
+        if text:
+            smoothed.append(text)
+    return "\n\n".join(smoothed)
+
+
+def generate_longform_script(title, context, video_length, complete,
+                             max_workers=None, words_per_minute=WORDS_PER_MINUTE, report=None):
+    # complete(prompt) is a blocking LLM call. All sections are drafted at
+    # once, or max_workers at a time when the provider allows fewer
+    # concurrent requests, so latency is bounded by the slowest section.
+    # Sections that miss their word budget by more than LENGTH_TOLERANCE are
+    # revised once, also concurrently. report(fraction, message) is called
+    # on this thread after the outline and after every section; an exception
+    # it raises cancels the sections that have not started yet.
+    if report is None:
+        report = lambda fraction, message: None
+    outline = generate_outline(title, context, video_length, complete, words_per_minute)
+    report(0.1, f"Drafting {len(outline)} sections...")
+    workers = min(len(outline), max_workers or len(outline))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sections = []
+        drafts = executor.map(
+            tracing.propagate(lambda index: draft_section(title, context, outline, index, complete)),
+            range(len(outline))
+        )
+        with contextlib.closing(drafts):
+            for text in drafts:
+                sections.append(text)
+                report(0.1 + 0.7 * len(sections) / len(outline),
+                       f"{len(sections)}/{len(outline)} sections drafted")
+        missed = [index for index, text in enumerate(sections)
+                  if not within_budget(text, outline[index]['words'])]
+        revised = executor.map(
+            tracing.propagate(
+                lambda index: revise_section(title, outline, index, sections[index], complete)
+            ),
+            missed
+        )
+        with contextlib.closing(revised):
+            for done, (index, text) in enumerate(zip(missed, revised), 1):
+                budget = outline[index]['words']
+                if abs(word_count(text) - budget) < abs(word_count(sections[index]) - budget):
+                    sections[index] = text
+                report(0.8 + 0.2 * done / len(missed), f"{done}/{len(missed)} sections revised")
+    return smooth_transitions(sections)
@@ -0,0 +1,239 @@
+import contextlib
+import io
+import time
+from dataclasses import dataclass
+
+from tts_pipeline import split_script, iter_synthesized
+from tts_backends import get_backend, get_backend_class, backend_names, ELEVEN_LABS_VOICES, PIPER_MODEL
+import text_backends
+from text_backends import model_names, LLAMA_MODEL
+from audio import open_writer, OUTPUT_FORMATS
+from postprocess import PostProcessingWriter
+from alignment import AlignedWriter, render_mode
+from synthesis_cache import get_default_cache
+from progress import ProgressTracker
+import research
+import research_cache
+import longform
+import tracing
+from scheduler import INTERACTIVE
+
+TEXT_MODELS = model_names()
+TTS_MODELS = backend_names()
+
+
+@dataclass
+class PipelineSettings:
+    # Everything the pipeline needs to know about models and keys; the
+    # Streamlit app builds one from its sidebar, the batch runner from its
+    # command line.
+    text_model: str
+    text_api_key: str
+    # Path to the GGUF file of the local llama.cpp text model.
+    local_text_model: str = LLAMA_MODEL
+    tts_model: str = "mrfakename/MeloTTS"
+    eleven_labs_api_key: str = None
+    voice: str = ELEVEN_LABS_VOICES[0]
+    # Path to the .onnx voice of the local Piper backend.
+    local_voice_model: str = PIPER_MODEL
+    long_form: bool = True
+    # Loudness normalization, silence trimming and fades; applied to backends
+    # that return WAV segments, MP3 segments are not processed.
+    postprocess: bool = True
+    # One of audio.OUTPUT_FORMATS, or None for the backend's own format.
+    # bitrate (kbps) applies to Opus and MP3 output.
+    output_format: str = None
+    bitrate: int = None
+    # Scheduling priority of this caller's provider requests; batch jobs use
+    # scheduler.BATCH so they yield to interactive use of the same keys.
+    priority: int = INTERACTIVE
+
+    @property
+    def native_format(self):
+        return get_backend_class(self.tts_model).native_format
+
+    @property
+    def audio_format(self):
+        return self.output_format or self.native_format
+
+    @property
+    def audio_suffix(self):
+        return OUTPUT_FORMATS[self.audio_format]["suffix"]
+
+    @property
+    def audio_mime(self):
+        return OUTPUT_FORMATS[self.audio_format]["mime"]
+
+    def missing_keys(self):
+        return (text_backends.get_backend_class(self.text_model).missing_settings(self)
+                + get_backend_class(self.tts_model).missing_settings(self))
+
+
+def complete_text(settings, prompt):
+    backend = text_backends.get_backend(settings)
+    with tracing.span("llm", backend=backend.name, model=settings.text_model,
+                      chars_in=len(prompt)) as span:
+        text = backend.complete(prompt)
+        span.set(chars_out=len(text))
+    return text
+
+
+def search_and_summarize(settings, search_query):
+    with tracing.span("research", title=search_query) as span:
+        summary = research.search_and_summarize(
+            search_query,
+            lambda prompt: complete_text(settings, prompt),
+            cache=research_cache.get_default_cache(),
+            model=text_backends.get_backend(settings).model_id,
+            priority=settings.priority
+        )
+        span.set(chars_out=len(summary))
+    return summary
+
+
+def build_script_prompt(title, context, video_length, regenerate=False):
+    regenerate_note = " (This is a regenerated script.)" if regenerate else ""
+    prompt = f'''
+    Generate a YouTube script voiceover based on the following title and context. Make it sound like a natural conversation, with pauses and a conversational tone.
+
+    Title: {title}
+
+    Context: {context}
+
+    The voiceover should be suitable for a video that is approximately {video_length} minutes long. It should start with a strong introduction, followed by key points that highlight the main aspects of the topic, and conclude with a statement that leaves the viewer wanting to learn more.
+
+    Only provide the voiceover text, without any additional formatting or instructions.{regenerate_note}
+    '''
+    return prompt
+
+
+def is_long_form(settings, video_length):
+    return settings.long_form and video_length >= longform.LONGFORM_THRESHOLD_MINUTES
+
+
+def generate_youtube_script(settings, title, context, video_length, regenerate=False,
+                            report=None):
+    # report(fraction, message) follows the sections of a long-form script.
+    long_form = is_long_form(settings, video_length)
+    with tracing.span("script", video_length=video_length, long_form=long_form) as span:
+        if long_form:
+            script = longform.generate_longform_script(
+                title, context, video_length, lambda prompt: complete_text(settings, prompt),
+                max_workers=text_backends.get_backend(settings).max_concurrency, report=report
+            )
+        else:
+            prompt = build_script_prompt(title, context, video_length, regenerate)
+            script = complete_text(settings, prompt)
+        span.set(chars_out=len(script))
+    return script
+
+
+def stream_youtube_script(settings, title, context, video_length, regenerate=False):
+    prompt = build_script_prompt(title, context, video_length, regenerate)
+    # The span is not made current: the consumer runs between the yields.
+    span = tracing.start_span("script", video_length=video_length, streaming=True,
+                              chars_in=len(prompt))
+    chars = 0
+    try:
+        for text in text_backends.get_backend(settings).stream(prompt):
+            chars += len(text)
+            yield text
+    except Exception as e:
+        span.finish(e)
+        raise
+    finally:
+        span.set(chars_out=chars)
+        span.finish()
+
+
+def text_to_speech(settings, script, output=None, on_segment=None, on_progress=None,
+                   render_dir=None, previous_dir=None):
+    # Writes the rendered audio to output, a path or binary file object, and
+    # returns it. Without an output the audio is rendered in memory and the
+    # bytes are returned, so nothing touches the disk. Errors are raised to
+    # the caller.
+    #
+    # With a render_dir, the audio of each sentence and the alignment of the
+    # script to the render are kept there (see alignment.AlignedWriter).
+    # Passing the render_dir of an earlier render as previous_dir then only
+    # synthesizes the sentences that changed since; the others are copied
+    # from the earlier render.
+    with tracing.span("tts", backend=settings.tts_model) as span:
+        return _text_to_speech(settings, script, output, on_segment, on_progress, span,
+                               render_dir, previous_dir)
+
+
+def _text_to_speech(settings, script, output, on_segment, on_progress, span,
+                    render_dir=None, previous_dir=None):
+    backend = get_backend(settings)
+    # One chunk per sentence so that an edit only invalidates the cached
+    # audio of the sentences it touches.
+    chunks = split_script(script, max_chars=backend.max_chunk_chars, pack=False)
+    if not chunks:
+        raise ValueError("The script is empty.")
+    span.set(chunks=len(chunks), chars_in=sum(len(chunk) for chunk in chunks))
+    cache = get_default_cache()
+    progress = ProgressTracker(chunks)
+    if on_progress is not None:
+        progress.subscribe(on_progress)
+        on_progress(progress.snapshot())
+
+    buffer = io.BytesIO() if output is None else None
+    # Segments are written out as soon as they are ready, in script order,
+    # so nothing waits for the whole script and on_segment can start
+    # playback early.
+    target = output if buffer is None else buffer
+    if render_dir is not None:
+        _render_aligned(settings, backend, chunks, target, on_segment, progress, span,
+                        render_dir, previous_dir)
+        return output if buffer is None else buffer.getvalue()
+    if settings.postprocess and settings.native_format == "wav":
+        writer = PostProcessingWriter(target, settings.audio_format, settings.bitrate)
+    else:
+        writer = open_writer(settings.native_format, target, settings.audio_format, settings.bitrate)
+    # open_writer() may return a context manager around the file to write to.
+    with writer as writer:
+        for segment in iter_synthesized(chunks, backend.synthesize,
+                                        max_workers=backend.max_workers,
+                                        max_attempts=backend.max_attempts,
+                                        cache=cache, key_for=backend.cache_key,
+                                        progress=progress):
+            started = time.perf_counter()
+            writer.write(segment)
+            # Time spent decoding, processing and encoding segments.
+            span.add("write_seconds", time.perf_counter() - started)
+            span.add("bytes", len(segment))
+            if on_segment is not None:
+                on_segment(segment)
+
+    return output if buffer is None else buffer.getvalue()
+
+
+def _render_aligned(settings, backend, chunks, target, on_segment, progress, span, render_dir,
+                    previous_dir):
+    keys = [backend.cache_key(chunk) for chunk in chunks]
+    writer = AlignedWriter(render_dir, render_mode(settings), target, settings.audio_format,
+                           settings.bitrate, previous_dir=previous_dir)
+    with writer:
+        sources = writer.match(keys)
+        # Only the sentences without a match in the previous render are
+        # synthesized; they come out in script order like every render.
+        fresh = [chunk for chunk, source in zip(chunks, sources) if source is None]
+        span.set(reused=len(chunks) - len(fresh), synthesized=len(fresh))
+        segments = iter_synthesized(fresh, backend.synthesize, max_workers=backend.max_workers,
+                                    max_attempts=backend.max_attempts,
+                                    cache=get_default_cache(), key_for=backend.cache_key)
+        with contextlib.closing(segments):
+            for chunk, key, source in zip(chunks, keys, sources):
+                if source is None:
+                    segment = next(segments)
+                    started = time.perf_counter()
+                    writer.write(chunk, key, segment)
+                    span.add("bytes", len(segment))
+                else:
+                    started = time.perf_counter()
+                    segment = writer.reuse(chunk, key, source, as_segment=on_segment is not None)
+                span.add("write_seconds", time.perf_counter() - started)
+                progress.advance(chunk, len(segment) if source is None else 0)
+                if on_segment is not None:
+                    on_segment(segment)
@@ -0,0 +1,305 @@
+import io
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+import tracing
+from audio import resample, match_channels, EncodedOutput
+
+TARGET_LUFS = -16.0
+# Ceiling for the true peak (dBTP), measured on the signal oversampled
+# TRUE_PEAK_OVERSAMPLING times.
+PEAK_CEILING_DB = -1.0
+TRUE_PEAK_OVERSAMPLING = 4
+SILENCE_THRESHOLD_DB = -45.0
+# Pauses longer than MAX_PAUSE inside or between sentences are shortened to
+# it; leading and trailing silence is cut down to EDGE_PAD.
+MAX_PAUSE = 0.35
+EDGE_PAD = 0.05
+# Segments are faded out into SENTENCE_GAP seconds of silence and the next
+# one faded in; with a gap of 0 they are crossfaded instead.
+SENTENCE_GAP = 0.25
+FADE = 0.01
+FRAME = 0.01
+BLOCK_FRAMES = 1 << 16
+# The intermediate render stays in memory up to this size and spills to a
+# temporary file beyond it, so memory use is bounded for any script length.
+SPOOL_BYTES = 64 * 1024 * 1024
+
+# ITU-R BS.1770 K-weighting filter (shelf, then high-pass), specified at 48 kHz.
+_K_SHELF = ([1.53512485958697, -2.69169618940638, 1.19839281085285],
+            [1.0, -1.69065929318241, 0.73248077421585])
+_K_HIGHPASS = ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])
+
+
+def _k_weight_power(freqs):
+    z = np.exp(-2j * np.pi * np.asarray(freqs) / 48000.0)
+    response = np.ones_like(z)
+    for b, a in (_K_SHELF, _K_HIGHPASS):
+        response *= np.polyval(b[::-1], z) / np.polyval(a[::-1], z)
+    return np.abs(response) ** 2
+
+
+class TruePeakMeter:
+    # Peak of the signal after 4x oversampling, in the manner of BS.1770
+    # annex 2: it catches the peaks between samples that a DAC or a lossy
+    # encoder reconstructs, which can be several dB above the sample peak.
+    # The polyphase interpolator (12 taps per phase) runs as FFT convolution
+    # over fixed-size blocks.
+
+    def __init__(self, factor=TRUE_PEAK_OVERSAMPLING, taps_per_phase=12, fft_size=1 << 14):
+        taps = factor * taps_per_phase
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = np.sinc(n / factor) * np.kaiser(taps, 8.0)
+        kernel *= factor / kernel.sum()
+        # Row p holds phase p, kernel[p::factor].
+        phases = kernel.reshape(-1, factor).T
+        self._spectra = np.fft.rfft(phases, fft_size, axis=1).astype(np.complex64)
+        # No interpolated sample exceeds the block's sample peak by more than
+        # this, so quieter blocks can be skipped.
+        self._overshoot = float(np.abs(phases).sum(axis=1).max())
+        self._history = taps_per_phase - 1
+        self._fft_size = fft_size
+        self._pending = None
+        self._peak = 0.0
+
+    def add(self, data):
+        if self._pending is None:
+            self._pending = np.zeros((self._history, data.shape[1]), np.float32)
+        self._peak = max(self._peak, float(np.max(np.abs(data), initial=0.0)))
+        data = np.concatenate([self._pending, data])
+        step = self._fft_size - self._history
+        start = 0
+        while len(data) - start >= self._fft_size:
+            self._measure(data[start:start + self._fft_size])
+            start += step
+        self._pending = data[start:]
+
+    def _measure(self, block):
+        if float(np.max(np.abs(block), initial=0.0)) * self._overshoot <= self._peak:
+            return
+        spectrum = np.fft.rfft(block, self._fft_size, axis=0)
+        phases = np.fft.irfft(self._spectra[:, :, None] * spectrum[None], self._fft_size, axis=1)
+        # The first outputs wrap around the block; the history covers them.
+        valid = phases[:, self._history:len(block)]
+        if valid.size:
+            self._peak = max(self._peak, float(np.max(np.abs(valid))))
+
+    def peak(self):
+        # Measures what is pending, including the ringing after the last
+        # sample; call once all audio has been added.
+        if self._pending is not None and len(self._pending) > self._history:
+            tail = np.zeros((self._history, self._pending.shape[1]), np.float32)
+            self._measure(np.concatenate([self._pending, tail]))
+            self._pending = self._pending[len(self._pending) - self._history:]
+        return self._peak
+
+
+class LoudnessMeter:
+    # Integrated loudness in the style of BS.1770: K-weighted mean square over
+    # 400 ms blocks with 75% overlap, absolute gate at -70 LUFS and relative
+    # gate at -10 LU. K-weighting is applied per 100 ms sub-block in the
+    # frequency domain, which avoids a per-sample IIR loop in Python.
+
+    def __init__(self, samplerate):
+        self.samplerate = samplerate
+        self.sub_block = int(round(samplerate * 0.1))
+        self._weights = _k_weight_power(np.fft.rfftfreq(self.sub_block, 1.0 / samplerate))
+        self._weights[1:-1] *= 2  # one-sided spectrum
+        self._pending = np.zeros((0, 0))
+        self._powers = []
+        self.true_peak = TruePeakMeter()
+
+    def add(self, data):
+        if len(data) == 0:
+            return
+        self.true_peak.add(data)
+        if self._pending.size:
+            data = np.concatenate([self._pending, data])
+        usable = len(data) // self.sub_block * self.sub_block
+        self._pending = data[usable:]
+        if not usable:
+            return
+        blocks = data[:usable].reshape(-1, self.sub_block, data.shape[1])
+        spectra = np.abs(np.fft.rfft(blocks, axis=1)) ** 2
+        power = (spectra * self._weights[None, :, None]).sum(axis=1) / self.sub_block ** 2
+        self._powers.extend(power.sum(axis=1))
+
+    def integrated(self):
+        powers = np.asarray(self._powers)
+        if len(powers) < 4:
+            return None
+        blocks = np.convolve(powers, np.ones(4) / 4, mode="valid")
+        loudness = -0.691 + 10 * np.log10(np.maximum(blocks, 1e-12))
+        gated = blocks[loudness > -70]
+        if not len(gated):
+            return None
+        relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+        gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def compress_silence(data, samplerate, threshold_db=SILENCE_THRESHOLD_DB,
+                     max_pause=MAX_PAUSE, edge_pad=EDGE_PAD):
+    # Shortens every run of silent 10 ms frames: runs at the edges to
+    # edge_pad, runs inside to max_pause.
+    frame = max(1, int(samplerate * FRAME))
+    frames = len(data) // frame
+    if frames == 0:
+        return data
+    energy = (data[:frames * frame].reshape(frames, frame, -1) ** 2).mean(axis=(1, 2))
+    loud = 10 * np.log10(np.maximum(energy, 1e-12)) > threshold_db
+    if not loud.any():
+        return data[:0]
+
+    keep = np.ones(frames, dtype=bool)
+    first, last = np.argmax(loud), frames - 1 - np.argmax(loud[::-1])
+    pad = int(edge_pad / FRAME)
+    keep[:max(0, first - pad)] = False
+    keep[last + 1 + pad:] = False
+    # Silent runs strictly between the first and last loud frames.
+    quiet = ~loud[first:last + 1]
+    edges = np.diff(np.concatenate([[0], quiet.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    limit = int(max_pause / FRAME)
+    for start, end in zip(starts[ends - starts > limit], ends[ends - starts > limit]):
+        keep[first + start + limit:first + end] = False
+
+    mask = np.repeat(keep, frame)
+    tail = data[frames * frame:] if keep[-1] else data[:0]
+    return np.concatenate([data[:frames * frame][mask], tail])
+
+
+class PostProcessingWriter:
+    # Drop-in replacement for audio.StreamWriter that trims silences, joins
+    # segments and normalizes the loudness of the whole render. Joins fade
+    # into and out of a sentence_gap of silence, or are equal-power
+    # crossfades when sentence_gap is 0. The first pass processes each
+    # segment as it arrives and measures loudness and true peak; close()
+    # applies the gain in fixed-size blocks.
+
+    def __init__(self, target, output_format="wav", bitrate=None, target_lufs=TARGET_LUFS,
+                 sentence_gap=SENTENCE_GAP, fade=FADE):
+        self.target = target
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.target_lufs = target_lufs
+        self.sentence_gap = sentence_gap
+        self.fade = fade
+        self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        self._stage = None
+        self._meter = None
+        self._tail = None
+        self._frames = 0
+        # Rate and channel count of the render, set by the first segment.
+        self.samplerate = None
+        self.channels = None
+
+    def write(self, segment):
+        self.write_piece(self.prepare(segment))
+
+    def prepare(self, segment):
+        # Decodes a segment and trims its silences: the part of the
+        # processing that only depends on the segment itself.
+        data, source_rate = sf.read(io.BytesIO(segment), always_2d=True, dtype="float32")
+        if self._stage is None:
+            self._open(source_rate, data.shape[1])
+        data = match_channels(resample(data, source_rate, self.samplerate), self.channels)
+        return compress_silence(data, self.samplerate).astype(np.float32)
+
+    def write_piece(self, data, samplerate=None, channels=None):
+        # Joins a prepared segment to the render and returns the sample
+        # offset at which it starts, or None if nothing of it was left.
+        # samplerate and channels are needed when it is the first one.
+        if self._stage is None:
+            self._open(samplerate, channels)
+        if not len(data):
+            return None
+        return self._join(np.array(data, dtype=np.float32))
+
+    def _open(self, samplerate, channels):
+        self._stage = sf.SoundFile(
+            self._spool, "w", samplerate=samplerate, channels=channels,
+            format="WAV", subtype="FLOAT"
+        )
+        self._meter = LoudnessMeter(samplerate)
+        self.samplerate, self.channels = samplerate, channels
+
+    def _join(self, data):
+        rate = self._stage.samplerate
+        fade = min(int(rate * self.fade), len(data) // 2)
+        if self._tail is None:
+            self._tail = data
+            return self._frames
+        previous = self._tail
+        fade = min(fade, len(previous))
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+        if self.sentence_gap > 0:
+            # Fade out into the pause and back in, so the joins never click.
+            previous[len(previous) - fade:] *= ramp[::-1]
+            data[:fade] *= ramp
+            self._emit(previous)
+            self._emit(np.zeros((int(rate * self.sentence_gap), data.shape[1]), np.float32))
+            self._tail = data
+            return self._frames
+        else:
+            # Equal-power crossfade over the overlap.
+            head = data[:fade]
+            overlap = (previous[len(previous) - fade:] * np.cos(ramp * np.pi / 2)
+                       + head * np.sin(ramp * np.pi / 2))
+            self._emit(previous[:len(previous) - fade])
+            start = self._frames
+            self._emit(overlap)
+            self._tail = data[fade:]
+            return start
+
+    def _emit(self, data):
+        self._meter.add(data)
+        self._stage.write(data)
+        self._frames += len(data)
+
+    def close(self):
+        if self._stage is None:
+            return
+        if self._tail is not None:
+            self._emit(self._tail)
+            self._tail = None
+        self._stage.close()
+        self._stage = None
+        with tracing.span("normalize") as span:
+            self._normalize(span)
+
+    def _normalize(self, span):
+        gain = 1.0
+        loudness = self._meter.integrated()
+        if loudness is not None:
+            gain = 10 ** ((self.target_lufs - loudness) / 20)
+        peak = self._meter.true_peak.peak()
+        if peak > 0:
+            gain = min(gain, 10 ** (PEAK_CEILING_DB / 20) / peak)
+        span.set(loudness=loudness, true_peak_db=float(20 * np.log10(max(peak, 1e-12))),
+                 gain_db=float(20 * np.log10(gain)))
+
+        self._spool.seek(0)
+        with sf.SoundFile(self._spool) as source:
+            output = EncodedOutput(
+                self.target, source.samplerate, source.channels, self.output_format, self.bitrate
+            )
+            try:
+                for block in source.blocks(blocksize=BLOCK_FRAMES, dtype="float32", always_2d=True):
+                    output.write(block * np.float32(gain))
+            finally:
+                output.close()
+        self._spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:  # nothing worth normalizing was rendered
+            if self._stage is not None:
+                self._stage.close()
+            self._spool.close()
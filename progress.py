@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import namedtuple
+
+ProgressSnapshot = namedtuple(
+    "ProgressSnapshot",
+    ["done", "total", "fraction", "bytes_received", "elapsed", "eta"],
+)
+
+
+class ProgressTracker:
+    # Progress of a synthesis run. Segments are weighted by their text length,
+    # so the time estimate follows the measured characters-per-second rather
+    # than assuming every sentence takes as long as the last one.
+
+    def __init__(self, chunks):
+        self.total = len(chunks)
+        self.done = 0
+        self.bytes_received = 0
+        self._total_weight = sum(len(chunk) for chunk in chunks) or 1
+        self._done_weight = 0
+        self._started = time.monotonic()
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def advance(self, chunk, nbytes):
+        with self._lock:
+            self.done += 1
+            self.bytes_received += nbytes
+            self._done_weight += len(chunk)
+            snapshot = self._snapshot()
+        for callback in self._subscribers:
+            callback(snapshot)
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        elapsed = time.monotonic() - self._started
+        if self._done_weight:
+            remaining = self._total_weight - self._done_weight
+            eta = elapsed * remaining / self._done_weight
+        else:
+            eta = None
+        fraction = self._done_weight / self._total_weight
+        return ProgressSnapshot(
+            self.done, self.total, fraction, self.bytes_received, elapsed, eta
+        )
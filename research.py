@@ -0,0 +1,216 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from duckduckgo_search import DDGS
+
+import tracing
+from research_cache import normalize_query
+from scheduler import scheduler, INTERACTIVE
+
+SEARCH_REGION = 'us-en'
+SEARCH_TIMELIMIT = '2m'
+MAX_RESULTS_PER_QUERY = 8
+# Seconds a search may take once the rate limiter has let it through.
+SEARCH_TIMEOUT = 15
+# Seconds a summary may take, including its wait for the text provider.
+SUMMARY_TIMEOUT = 120
+# Snippets are summarized in batches of roughly this many characters, in
+# parallel, before the partial summaries are merged.
+BATCH_CHARS = 6000
+NEAR_DUPLICATE_THRESHOLD = 0.6
+
+QUERY_TEMPLATES = [
+    "{title}",
+    "{title} latest news",
+    "{title} explained",
+    "{title} key facts",
+]
+
+SUMMARIZE_PROMPT = "Summarize the following text: "
+MERGE_PROMPT = (
+    "Combine the following partial summaries into one coherent summary, "
+    "removing repeated points: "
+)
+
+
+def expand_queries(title):
+    return [template.format(title=title) for template in QUERY_TEMPLATES]
+
+
+def search(query, region=SEARCH_REGION, timelimit=SEARCH_TIMELIMIT,
+           max_results=MAX_RESULTS_PER_QUERY):
+    return DDGS().text(
+        keywords=query,
+        region=region,
+        safesearch='off',
+        timelimit=timelimit,
+        max_results=max_results
+    ) or []
+
+
+async def _fetch(executor, query, timeout, region, timelimit, max_results, cache=None,
+                 priority=INTERACTIVE):
+    # A slow or failing query only loses its own results. The timeout starts
+    # when the scheduler admits the search, so time spent queued behind the
+    # ddgs rate limit does not count. A timed-out search is not retried; its
+    # worker thread is left to finish the request in flight.
+    with tracing.span("search", query=query) as span:
+        if cache is not None:
+            key = cache.make_key(normalize_query(query), timelimit, region, max_results)
+            cached = cache.get("search", key)
+            if cached is not None:
+                span.set(cache_hits=1, results=len(cached))
+                return cached
+            span.set(cache_misses=1)
+        loop = asyncio.get_running_loop()
+        admitted = asyncio.Event()
+        cancel = threading.Event()
+
+        def admitted_search(*args):
+            if not cancel.is_set():
+                loop.call_soon_threadsafe(admitted.set)
+            return search(*args)
+
+        call = loop.run_in_executor(
+            executor,
+            tracing.propagate(partial(
+                scheduler.call, "ddgs", admitted_search, query, region, timelimit, max_results,
+                priority=priority, cancel=cancel
+            ))
+        )
+        waiting = asyncio.ensure_future(admitted.wait())
+        try:
+            await asyncio.wait([call, waiting], return_when=asyncio.FIRST_COMPLETED)
+            results = await asyncio.wait_for(call, timeout)
+        except Exception as e:
+            cancel.set()
+            span.set(error=f"{type(e).__name__}: {e}")
+            return []
+        finally:
+            waiting.cancel()
+        span.set(results=len(results))
+        if cache is not None and results:
+            cache.put("search", key, results)
+        return results
+
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def deduplicate(results, threshold=NEAR_DUPLICATE_THRESHOLD):
+    # Drops results with a URL already seen or whose body overlaps an earlier
+    # one by at least threshold (Jaccard similarity of word 3-grams).
+    kept = []
+    seen_urls = set()
+    kept_shingles = []
+    for result in results:
+        body = result.get('body', '').strip()
+        url = result.get('href')
+        if not body or (url and url in seen_urls):
+            continue
+        shingles = _shingles(body)
+        if any(len(shingles & other) / len(shingles | other) >= threshold
+               for other in kept_shingles):
+            continue
+        kept.append(result)
+        kept_shingles.append(shingles)
+        if url:
+            seen_urls.add(url)
+    return kept
+
+
+def batch_texts(texts, max_chars=BATCH_CHARS):
+    batches = []
+    current = []
+    size = 0
+    for text in texts:
+        if current and size + len(text) > max_chars:
+            batches.append(current)
+            current, size = [], 0
+        current.append(text)
+        size += len(text) + 1
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _summarize(executor, summarize, prompt, timeout):
+    # The worker thread of a timed-out summary is left to finish in the
+    # background, like that of a timed-out search.
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, tracing.propagate(partial(summarize, prompt))), timeout
+        )
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Summarizing the search results took longer than {timeout}s.") from None
+
+
+async def research(title, summarize, timeout=SEARCH_TIMEOUT, region=SEARCH_REGION,
+                   timelimit=SEARCH_TIMELIMIT, max_results=MAX_RESULTS_PER_QUERY,
+                   cache=None, model=None, priority=INTERACTIVE,
+                   summary_timeout=SUMMARY_TIMEOUT):
+    # summarize(prompt) is a blocking LLM call; it is run in worker threads so
+    # the batch summaries are produced concurrently. With a ResearchCache,
+    # both the search results and the final summary for the given model are
+    # reused until they expire.
+    if cache is not None:
+        summary_key = cache.make_key(normalize_query(title), timelimit, region, model)
+        cached = cache.get("summary", summary_key)
+        if cached is not None:
+            tracing.annotate(cache_hits=1)
+            return cached
+        tracing.annotate(cache_misses=1)
+
+    queries = expand_queries(title)
+    # A private executor, so that asyncio.run does not wait for the threads of
+    # timed-out searches on shutdown.
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    try:
+        result_lists = await asyncio.gather(*(
+            _fetch(executor, query, timeout, region, timelimit, max_results, cache, priority)
+            for query in queries
+        ))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    # Interleave so the top hits of every query come before anyone's tail.
+    interleaved = [
+        results[i]
+        for i in range(max(len(results) for results in result_lists))
+        for results in result_lists
+        if i < len(results)
+    ]
+    results = deduplicate(interleaved)
+    if not results:
+        raise ValueError("No search results found.")
+
+    batches = batch_texts([result['body'] for result in results])
+    executor = ThreadPoolExecutor(max_workers=len(batches))
+    try:
+        with tracing.span("summarize", results=len(results), batches=len(batches)):
+            summaries = await asyncio.gather(*(
+                _summarize(executor, summarize, SUMMARIZE_PROMPT + " ".join(batch),
+                           summary_timeout)
+                for batch in batches
+            ))
+            if len(summaries) == 1:
+                summary = summaries[0]
+            else:
+                summary = await _summarize(executor, summarize,
+                                           MERGE_PROMPT + "\n\n".join(summaries), summary_timeout)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if cache is not None:
+        cache.put("summary", summary_key, summary)
+    return summary
+
+
+def search_and_summarize(title, summarize, **kwargs):
+    return asyncio.run(research(title, summarize, **kwargs))
@@ -0,0 +1,105 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.environ.get(
+    "RESEARCH_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "yt-voiceover", "research.sqlite3"),
+)
+CACHE_TTL = float(os.environ.get("RESEARCH_CACHE_TTL_HOURS", "24")) * 3600
+MAX_ENTRIES = int(os.environ.get("RESEARCH_CACHE_MAX_ENTRIES", "5000"))
+
+
+def normalize_query(query):
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class ResearchCache:
+    # SQLite store for search results and summaries. Entries expire after ttl
+    # seconds, and the least recently used ones are dropped beyond max_entries.
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " kind TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL,"
+                " PRIMARY KEY (kind, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _connect(self):
+        # A connection per operation keeps the cache usable from any thread.
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(*parts):
+        return json.dumps(parts)
+
+    def get(self, kind, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created FROM entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+                row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?", (now, kind, key)
+                )
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, kind, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(value), now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM entries WHERE rowid IN ("
+            " SELECT rowid FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResearchCache()
+        return _default_cache
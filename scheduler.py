@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+
+import httpx
+
+import tracing
+
+# Lower values are served first.
+INTERACTIVE = 0
+BATCH = 10
+BACKGROUND = 20
+
+# Requests per second, burst size and the ceiling for adaptive concurrency.
+# These are conservative defaults for free-tier keys.
+PROVIDER_LIMITS = {
+    "ddgs": {"rate": 1.0, "burst": 4, "max_concurrency": 4},
+    "gemini": {"rate": 1.0, "burst": 4, "max_concurrency": 4},
+    "groq": {"rate": 0.5, "burst": 4, "max_concurrency": 4},
+    "melotts": {"rate": 2.0, "burst": 4, "max_concurrency": 4},
+    "elevenlabs": {"rate": 2.0, "burst": 4, "max_concurrency": 4},
+}
+DEFAULT_LIMITS = {"rate": 1.0, "burst": 2, "max_concurrency": 2}
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+_THROTTLE_MESSAGE = re.compile(
+    r"\b429\b|too many requests|rate.?limit|resource.?exhausted|quota|"
+    r"\b50[0234]\b|service unavailable|overloaded|queue is full",
+    re.IGNORECASE,
+)
+
+
+def status_code(exc):
+    # Groq, ElevenLabs and httpx errors carry status_code; google.api_core
+    # errors carry an integer code.
+    for obj in (exc, getattr(exc, "response", None)):
+        for attr in ("status_code", "code"):
+            code = getattr(obj, attr, None)
+            if isinstance(code, int):
+                return code
+    return None
+
+
+def is_throttled(exc):
+    code = status_code(exc)
+    if code is not None:
+        return code == 429 or 500 <= code < 600
+    # DDGS raises RatelimitException and gradio only reports the message.
+    return "ratelimit" in type(exc).__name__.lower() or bool(_THROTTLE_MESSAGE.search(str(exc)))
+
+
+def is_transient(exc):
+    # A dropped connection or a timeout, which says nothing about the
+    # provider's limits; gradio, ElevenLabs, Groq and DDGS all use httpx.
+    return isinstance(exc, (ConnectionError, TimeoutError, httpx.TransportError))
+
+
+class Cancelled(Exception):
+    pass
+
+
+def retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        # Takes a token and returns 0, or returns how long until one is due.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    # Concurrency limit with additive increase on success and multiplicative
+    # decrease on throttling (AIMD). Waiters are admitted in priority order,
+    # first come first served within a priority. With a bucket, admission
+    # also takes a rate token, so tokens are handed out in the same order and
+    # a waiter held back by the rate does not sit on a slot meanwhile.
+
+    def __init__(self, max_concurrency, min_concurrency=1, decrease_factor=0.5,
+                 decrease_cooldown=1.0, bucket=None):
+        self.max_concurrency = max_concurrency
+        self.bucket = bucket
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=INTERACTIVE):
+        with self._condition:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiters, ticket)
+            while True:
+                if self._waiters[0] != ticket or self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                    continue
+                wait = self.bucket.take() if self.bucket is not None else 0.0
+                if not wait:
+                    break
+                # Still first in line; a caller of higher priority that
+                # arrives meanwhile goes first.
+                self._condition.wait(wait)
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            self._condition.notify_all()
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # Requests already in flight when the provider started pushing
+                # back fail together; count them as one congestion signal.
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Scheduler:
+    def __init__(self, limits=PROVIDER_LIMITS, max_attempts=MAX_ATTEMPTS,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.limits = limits
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def _provider(self, name):
+        with self._lock:
+            if name not in self._providers:
+                config = self.limits.get(name, DEFAULT_LIMITS)
+                self._providers[name] = AdaptiveLimiter(
+                    config["max_concurrency"], bucket=TokenBucket(config["rate"], config["burst"])
+                )
+            return self._providers[name]
+
+    def limiter(self, name):
+        return self._provider(name)
+
+    def call(self, provider, fn, *args, priority=INTERACTIVE, cancel=None, **kwargs):
+        # Runs fn under the provider's rate and concurrency limits. Throttling,
+        # server errors and transient connection errors are retried with
+        # full-jitter exponential backoff, honouring Retry-After when the
+        # provider sends it; any other error is raised immediately. Only
+        # throttling lowers the concurrency limit. No delay exceeds max_delay. Once cancel, a
+        # threading.Event, is set, fn is not called again and Cancelled is
+        # raised instead.
+        limiter = self._provider(provider)
+        with tracing.span(f"provider.{provider}", priority=priority) as span:
+            for attempt in range(1, self.max_attempts + 1):
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                waited = time.perf_counter()
+                limiter.acquire(priority)
+                span.add("wait_seconds", time.perf_counter() - waited)
+                throttled = False
+                try:
+                    if cancel is not None and cancel.is_set():
+                        raise Cancelled()
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    throttled = is_throttled(e)
+                    if not (throttled or is_transient(e)) or attempt == self.max_attempts:
+                        raise
+                    delay = retry_after(e)
+                finally:
+                    limiter.release(throttled)
+                if delay is None:
+                    delay = random.uniform(0, self.base_delay * 2 ** attempt)
+                delay = min(delay, self.max_delay)
+                if throttled:
+                    span.add("throttled")
+                span.add("retries")
+                time.sleep(delay)
+
+
+scheduler = Scheduler()
@@ -0,0 +1,101 @@
+import dataclasses
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from scheduler import BACKGROUND
+from synthesis_cache import get_default_cache
+from tts_backends import get_backend
+from tts_pipeline import split_script
+
+# The end of a sentence, or of a paragraph that ends without punctuation.
+_SENTENCE_END = re.compile(r'[.!?]["\'”’)]?$')
+_PARAGRAPH_BREAK = re.compile(r'\s*\n\s*\n')
+
+
+class SpeculativeSynthesis:
+    # Synthesizes the sentences of a script into the synthesis cache before
+    # anyone asks for its audio, so that rendering it later mostly finds the
+    # segments cached. Provider calls run at BACKGROUND priority and yield to
+    # interactive work on the same provider.
+    #
+    # Text can be fed while the script is still being written: a sentence is
+    # queued once the text after it has started, and finish() queues the
+    # rest. cancel() drops the sentences not started yet, e.g. when the
+    # script is regenerated.
+
+    def __init__(self, settings, cache=None):
+        self.settings = dataclasses.replace(settings, priority=BACKGROUND)
+        self.backend = get_backend(self.settings)
+        self.cache = cache or get_default_cache()
+        self._text = ""
+        # Where the text after the last queued whole sentence starts.
+        self._start = 0
+        self._queued = set()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.backend.max_workers, thread_name_prefix="speculative"
+        )
+
+    def _chunks(self, text):
+        # The same chunks text_to_speech() will ask for.
+        return split_script(text, max_chars=self.backend.max_chunk_chars, pack=False)
+
+    def feed(self, text):
+        self._text += text
+        # Only the text after the sentences already queued is split again;
+        # its last chunk may still grow.
+        tail = self._text[self._start:]
+        chunks = self._chunks(tail)[:-1]
+        self._queue(chunks)
+        self._start += self._consumed(tail, chunks)
+
+    @staticmethod
+    def _consumed(tail, chunks):
+        # The length of the text taken up by chunks, up to the end of the last
+        # one that ends a sentence: splitting what follows on its own gives
+        # the same chunks as splitting the whole text. Part of an overlong
+        # sentence, or a chunk whose whitespace split_script() changed, is
+        # not a safe place to resume from.
+        position = end = 0
+        for chunk in chunks:
+            found = tail.find(chunk, position)
+            if found < 0:
+                break
+            position = found + len(chunk)
+            if _SENTENCE_END.search(chunk) or _PARAGRAPH_BREAK.match(tail, position):
+                end = position
+        return end
+
+    def finish(self, script=None):
+        if script is not None:
+            self._text = script
+        self._queue(self._chunks(self._text))
+
+    def _queue(self, chunks):
+        with self._lock:
+            for chunk in chunks:
+                key = self.backend.cache_key(chunk)
+                if self._cancelled.is_set() or key in self._queued:
+                    continue
+                self._queued.add(key)
+                self._executor.submit(self._synthesize, chunk, key)
+
+    def _synthesize(self, chunk, key):
+        if self._cancelled.is_set() or key in self.cache:
+            return
+        try:
+            with tracing.span("speculative", backend=self.backend.name, chars_in=len(chunk)):
+                segment = self.backend.synthesize(chunk)
+        except Exception:
+            return  # the render synthesizes it again
+        self.cache.put(key, segment)
+
+    def cancel(self, wait=False):
+        # With wait, returns once the sentences already being synthesized
+        # are in the cache, so a render started next does not repeat them.
+        with self._lock:
+            self._cancelled.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,32 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The modules live at the top of the repository, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def tone(seconds=0.5, samplerate=22050, frequency=440.0, amplitude=0.3, channels=1):
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    data = amplitude * np.sin(2 * np.pi * frequency * t)
+    return np.repeat(data[:, None], channels, axis=1).astype(np.float32)
+
+
+def encode(data, samplerate=22050, format="WAV", subtype="PCM_16"):
+    buffer = io.BytesIO()
+    sf.write(buffer, data, samplerate, format=format, subtype=subtype)
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def cache_dirs(tmp_path, monkeypatch):
+    # Keeps every test away from the caches and job queues under ~/.cache.
+    import synthesis_cache
+
+    monkeypatch.setattr(synthesis_cache, "_default_cache",
+                        synthesis_cache.SynthesisCache(str(tmp_path / "tts-cache")))
+    return tmp_path
@@ -0,0 +1,118 @@
+import dataclasses
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import alignment
+import pipeline
+import synthesis_cache
+import tts_backends
+from alignment import AlignedWriter, Alignment, SAMPLES_FILE, render_mode
+from pipeline import PipelineSettings
+from synthesis_cache import cache_key
+from tts_backends import TTSBackend
+from conftest import tone, encode
+
+
+class FakeWavBackend(TTSBackend):
+    name = "fake/aligned"
+    calls = []
+
+    def cache_key(self, chunk):
+        return cache_key(chunk, self.name, "", 1, "")
+
+    def synthesize(self, chunk):
+        self.calls.append(chunk)
+        # Loud enough that processing pushes some samples past full scale.
+        return encode(tone(len(chunk) / 100, frequency=200 + 10 * len(chunk), amplitude=0.99))
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setitem(tts_backends._BACKENDS, FakeWavBackend.name, FakeWavBackend)
+    monkeypatch.setattr(FakeWavBackend, "calls", [])
+    return PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key",
+                            tts_model=FakeWavBackend.name, postprocess=False)
+
+
+SCRIPT = "The first sentence. The second sentence is longer. A third one ends it."
+EDITED = "The first sentence. A replaced sentence. A third one ends it. One more."
+
+
+def test_match_keeps_the_order_of_unchanged_sentences():
+    alignment = Alignment("samples")
+    for key in "abcd":
+        alignment.add(key, key, 0, 0, 0)
+    assert alignment.match(list("axcdb")) == [0, None, 2, 3, None]
+    assert Alignment("samples").match(["a"]) == [None]
+
+
+@pytest.mark.parametrize("postprocess", [False, True])
+def test_an_edited_render_is_identical_to_a_full_render(settings, tmp_path, postprocess):
+    settings = dataclasses.replace(settings, postprocess=postprocess)
+    assert render_mode(settings) == ("postprocess" if postprocess else "samples")
+    first, second, full = (str(tmp_path / name) for name in ("first", "second", "full"))
+    pipeline.text_to_speech(settings, SCRIPT, render_dir=first)
+    FakeWavBackend.calls.clear()
+    edited = pipeline.text_to_speech(settings, EDITED, render_dir=second, previous_dir=first)
+    assert FakeWavBackend.calls == ["A replaced sentence.", "One more."]
+    assert edited == pipeline.text_to_speech(settings, EDITED, render_dir=full)
+    assert edited == pipeline.text_to_speech(settings, EDITED)
+
+
+def test_pieces_are_stored_unquantized(tmp_path):
+    render_dir = str(tmp_path / "render")
+    # The second segment is resampled to the rate of the first.
+    segments = [encode(tone(0.5)), encode(tone(0.5, samplerate=16000, amplitude=0.99), 16000)]
+    with AlignedWriter(render_dir, "postprocess", str(tmp_path / "out.wav")) as writer:
+        for i, segment in enumerate(segments):
+            writer.write("A sentence.", f"key{i}", segment)
+        expected = np.concatenate([writer._output.prepare(segment) for segment in segments])
+    stored, _ = sf.read(os.path.join(render_dir, SAMPLES_FILE), dtype="float32", always_2d=True)
+    assert np.array_equal(stored, expected)
+
+
+def test_a_missing_previous_render_is_synthesized_again(settings, tmp_path, monkeypatch):
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    pipeline.text_to_speech(settings, SCRIPT, render_dir=first)
+    os.unlink(os.path.join(first, SAMPLES_FILE))
+    monkeypatch.setattr(synthesis_cache, "_default_cache",
+                        synthesis_cache.SynthesisCache(str(tmp_path / "cold")))
+    FakeWavBackend.calls.clear()
+    audio = pipeline.text_to_speech(settings, SCRIPT, render_dir=second, previous_dir=first)
+    assert len(FakeWavBackend.calls) == 3
+    assert audio == pipeline.text_to_speech(settings, SCRIPT)
+
+
+def test_a_previous_render_pruned_during_the_render_is_still_read(settings, tmp_path):
+    first = str(tmp_path / "first")
+    pipeline.text_to_speech(settings, SCRIPT, render_dir=first)
+    keys = [FakeWavBackend(settings).cache_key(chunk) for chunk in ["a", "b", "c"]]
+    with AlignedWriter(str(tmp_path / "second"), "samples", str(tmp_path / "out.wav"),
+                       previous_dir=first) as writer:
+        shutil.rmtree(first)
+        segment = writer.reuse("The first sentence.", keys[0], 0, as_segment=True)
+    assert segment.startswith(b"RIFF")
+    assert len(Alignment.load(str(tmp_path / "second")).sentences) == 1
+
+
+def test_renders_beyond_the_size_cap_are_removed_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(alignment, "RENDERS_DIR", str(tmp_path / "renders"))
+    renders = []
+    for age in (100, 300, 200):
+        used = time.time() - age
+        path = alignment.new_render_directory()
+        with open(os.path.join(path, SAMPLES_FILE), "wb") as f:
+            f.write(b"x" * 1000)
+        os.utime(path, (used, used))
+        renders.append(path)
+    # The first render was used last, as the previous render of another.
+    path = alignment.new_render_directory(max_age=float("inf"), max_bytes=2000)
+    assert [os.path.exists(render) for render in renders] == [True, False, True]
+    alignment.discard_render_directory(path)
+    alignment.discard_render_directory(str(tmp_path))
+    assert not os.path.exists(path) and os.path.exists(str(tmp_path))
@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+import soundfile as sf
+
+from audio import StreamWriter, StreamResampler, join_mp3, join_wav, open_writer, resample
+from conftest import tone, encode
+
+
+def test_matching_segments_are_copied_unconverted():
+    first, second = tone(0.2), tone(0.3, frequency=220)
+    buffer = io.BytesIO()
+    with StreamWriter(buffer) as writer:
+        writer.write(encode(first))
+        writer.write(encode(second))
+    data, rate = sf.read(io.BytesIO(buffer.getvalue()), dtype="int16")
+    expected, _ = sf.read(io.BytesIO(encode(np.concatenate([first, second]))), dtype="int16")
+    assert rate == 22050
+    assert np.array_equal(data, expected)
+
+
+def test_segments_are_conformed_to_the_first():
+    buffer = io.BytesIO()
+    with StreamWriter(buffer) as writer:
+        writer.write(encode(tone(0.5)))
+        writer.write(encode(tone(0.5, samplerate=44100, channels=2), samplerate=44100))
+    info = sf.info(io.BytesIO(buffer.getvalue()))
+    assert (info.samplerate, info.channels) == (22050, 1)
+    assert abs(info.frames - 22050) <= 1
+
+
+def test_block_resampling_matches_whole_resampling():
+    data = tone(0.3, samplerate=44100)
+    resampler = StreamResampler(44100, 48000)
+    blocks = [resampler.process(data[i:i + 1000]) for i in range(0, len(data), 1000)]
+    streamed = np.concatenate(blocks)
+    whole = resample(data.astype(np.float64), 44100, 48000)
+    length = min(len(streamed), len(whole))
+    assert abs(len(streamed) - len(whole)) <= 1
+    assert np.allclose(streamed[:length], whole[:length], atol=1e-4)
+
+
+def test_wav_segments_join_in_memory():
+    data, rate = join_wav([encode(tone(0.1)), encode(tone(0.1, samplerate=11025), samplerate=11025)])
+    assert rate == 22050 and abs(len(data) - 4410) <= 1
+
+
+def test_mp3_segments_are_appended_as_is():
+    buffer = io.BytesIO()
+    with open_writer("mp3", buffer, "mp3") as writer:
+        writer.write(b"frame-1")
+        writer.write(b"frame-2")
+    assert buffer.getvalue() == join_mp3([b"frame-1", b"frame-2"]) == b"frame-1frame-2"
+
+
+def test_mp3_passthrough_to_a_path(tmp_path):
+    path = tmp_path / "out.mp3"
+    with open_writer("mp3", str(path), "mp3") as writer:
+        writer.write(b"frames")
+    assert path.read_bytes() == b"frames"
@@ -0,0 +1,119 @@
+import dataclasses
+import json
+import os
+
+import pytest
+
+import batch
+from batch import read_jobs, job_directory, run_job
+from pipeline import PipelineSettings
+
+
+@pytest.fixture
+def settings():
+    return PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key")
+
+
+@pytest.fixture
+def limits():
+    import threading
+
+    return {stage: threading.BoundedSemaphore(1) for stage in ("research", "script", "tts")}
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    # Records the stages that ran instead of calling any provider.
+    calls = []
+
+    def search_and_summarize(settings, title):
+        calls.append(("research", title))
+        return f"summary of {title}"
+
+    def generate_youtube_script(settings, title, summary, length):
+        calls.append(("script", title))
+        return f"script of {title}"
+
+    def text_to_speech(settings, script, output=None):
+        calls.append(("tts", script))
+        with open(output, "wb") as f:
+            f.write(b"audio")
+
+    monkeypatch.setattr(batch.pipeline, "search_and_summarize", search_and_summarize)
+    monkeypatch.setattr(batch.pipeline, "generate_youtube_script", generate_youtube_script)
+    monkeypatch.setattr(batch.pipeline, "text_to_speech", text_to_speech)
+    return calls
+
+
+def test_csv_and_jsonl_inputs(tmp_path):
+    csv_path = tmp_path / "titles.csv"
+    csv_path.write_text("title,length\nFirst,3\n,4\nSecond,\n", encoding="utf-8")
+    assert read_jobs(str(csv_path)) == [
+        {"title": "First", "length": 3}, {"title": "Second", "length": batch.DEFAULT_LENGTH}
+    ]
+    jsonl_path = tmp_path / "titles.jsonl"
+    jsonl_path.write_text('{"title": "Third", "video_length": 7.0}\n\n', encoding="utf-8")
+    assert read_jobs(str(jsonl_path)) == [{"title": "Third", "length": 7}]
+
+
+def test_directories_depend_on_the_request_not_its_position(settings):
+    job = {"title": "A title", "length": 5}
+    directory = job_directory("out", settings, job)
+    assert os.path.basename(directory).startswith("a-title-")
+    assert job_directory("out", settings, dict(job)) == directory
+    assert job_directory("out", settings, dict(job, length=6)) != directory
+    assert job_directory("out", dataclasses.replace(settings, voice="Laura"), job) != directory
+    # Keys and priority do not change what the job produces.
+    assert job_directory("out", dataclasses.replace(settings, text_api_key="other"), job) == directory
+
+
+def test_finished_stages_are_not_run_again(settings, limits, stages, tmp_path):
+    job = {"title": "Topic", "length": 5}
+    job_dir = str(tmp_path / "job")
+    assert run_job(settings, job, job_dir, limits)["status"] == "done"
+    assert [stage for stage, _ in stages] == ["research", "script", "tts"]
+    assert os.path.exists(os.path.join(job_dir, batch.TRACE_FILE))
+
+    stages.clear()
+    assert run_job(settings, job, job_dir, limits)["status"] == "done"
+    assert stages == []
+
+
+def test_a_failed_stage_resumes_where_it_stopped(settings, limits, stages, tmp_path, monkeypatch):
+    down = [True]
+    text_to_speech = batch.pipeline.text_to_speech
+
+    def flaky(settings, script, output=None):
+        if down[0]:
+            raise RuntimeError("TTS is down")
+        text_to_speech(settings, script, output)
+
+    monkeypatch.setattr(batch.pipeline, "text_to_speech", flaky)
+    job = {"title": "Topic", "length": 5}
+    job_dir = str(tmp_path / "job")
+    state = run_job(settings, job, job_dir, limits)
+    assert (state["status"], state["error"]) == ("failed", "TTS is down")
+
+    down[0] = False
+    stages.clear()
+    assert run_job(settings, job, job_dir, limits)["status"] == "done"
+    assert stages == [("tts", "script of Topic")]
+
+
+def test_reordered_input_resumes_the_same_jobs(stages, tmp_path, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "key")
+    output_dir = str(tmp_path / "out")
+    first = tmp_path / "first.jsonl"
+    first.write_text('{"title": "One"}\n{"title": "Two"}\n{"title": "One"}\n', encoding="utf-8")
+    assert batch.main([str(first), "--output-dir", output_dir, "--text-model", "gemini-1.5-flash"]) == 0
+    assert sorted(title for stage, title in stages if stage == "research") == ["One", "Two"]
+
+    stages.clear()
+    second = tmp_path / "second.jsonl"
+    second.write_text('{"title": "Zero"}\n{"title": "Two"}\n{"title": "One"}\n', encoding="utf-8")
+    assert batch.main([str(second), "--output-dir", output_dir, "--text-model", "gemini-1.5-flash"]) == 0
+    assert [title for stage, title in stages if stage == "research"] == ["Zero"]
+    assert len(os.listdir(output_dir)) == 3
+    for name in os.listdir(output_dir):
+        with open(os.path.join(output_dir, name, batch.CHECKPOINT_FILE), encoding="utf-8") as f:
+            assert name.startswith(json.load(f)["title"].lower())
@@ -0,0 +1,63 @@
+import pytest
+
+import benchmark
+import longform
+import pipeline
+import research
+import research_cache
+import scheduler
+import synthesis_cache
+import text_backends
+import tts_backends
+from benchmark import StageTimer, compare, fake_completion
+
+
+@pytest.fixture
+def config(monkeypatch):
+    # _setup() replaces these process-wide; they are put back afterwards.
+    for module, name in [(research, "DDGS"), (text_backends, "GenerativeServiceClient"), (text_backends, "Groq"),
+                         (tts_backends, "Client"), (tts_backends, "ElevenLabs"),
+                         (pipeline, "PostProcessingWriter"), (pipeline, "open_writer"),
+                         (scheduler.scheduler, "limits"),
+                         (research_cache, "_default_cache"), (synthesis_cache, "_default_cache")]:
+        monkeypatch.setattr(module, name, getattr(module, name))
+    return {
+        "text_model": "gemini-1.5-flash", "tts_model": "mrfakename/MeloTTS",
+        "long_form": True, "postprocess": True, "format": None, "bitrate": None,
+        "jobs": 2, "concurrency": 2, "length": 1,
+        "search_latency": 0, "llm_latency": 0, "llm_tokens_per_second": 1e6,
+        "tts_latency": 0, "tts_realtime_factor": 0, "jitter": 0, "provider_limits": False,
+    }
+
+
+def test_fake_completion_answers_in_the_requested_shape():
+    assert len(fake_completion("Write exactly 4 sections of an outline").splitlines()) == 4
+    assert len(fake_completion("This part should be about 120 words long.").split()) == 120
+    assert fake_completion("anything") == fake_completion("anything")
+    script = fake_completion("A script approximately 2 minutes long")
+    assert len(script.split()) == longform.word_budget(2)
+
+
+def test_overlapping_intervals_are_counted_once():
+    timer = StageTimer()
+    timer.add("summarize", 0, 2)
+    timer.add("summarize", 1, 3)
+    timer.add("summarize", 5, 6)
+    assert timer.total("summarize") == 4
+    assert timer.total("tts") == 0
+
+
+def test_compare_reports_regressions_beyond_the_noise_floor():
+    stages = dict.fromkeys(benchmark.STAGES, 1.0)
+    baseline = {"memory": [{"minutes": 1, "peak_mb": 100, "stages": stages}]}
+    slower = {"memory": [{"minutes": 1, "peak_mb": 102, "stages": dict(stages, tts=2.0)}]}
+    assert compare(slower, baseline, 0.2) == ["1 min tts (s): 1.000 -> 2.000"]
+    assert compare(baseline, baseline, 0.2) == []
+
+
+def test_throughput_run(config):
+    result = benchmark.measure_throughput(config)
+    assert result["jobs"] == 2
+    assert set(result["stages"]) == set(benchmark.STAGES)
+    assert result["stages"]["tts"]["mean"] > 0
+    assert result["total"]["max"] >= result["total"]["p50"] > 0
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import httpx
+
+import text_backends
+from clients import ClientRegistry
+from pipeline import PipelineSettings
+from text_backends import GeminiBackend
+from test_scheduler import Throttled
+
+
+class Client:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_a_client_is_created_once_per_key():
+    registry = ClientRegistry()
+    created = []
+
+    def factory():
+        time.sleep(0.01)
+        created.append(Client())
+        return created[-1]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("b", "k", factory)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(client is created[0] for client in results)
+    assert registry.get("b", "other", Client) is not created[0]
+    assert len(registry) == 2
+
+
+def test_keys_are_not_kept_in_the_registry():
+    registry = ClientRegistry()
+    registry.get("b", "secret-key", Client)
+    assert "secret-key" not in repr(registry._entries)
+
+
+def test_idle_clients_are_closed():
+    registry = ClientRegistry(idle_timeout=0.01)
+    client = registry.get("b", "k", Client)
+    time.sleep(0.02)
+    registry.evict_idle()
+    assert client.closed and len(registry) == 0
+
+
+def test_unhealthy_clients_are_replaced():
+    registry = ClientRegistry(health_check_interval=0)
+    healthy = [True]
+    first = registry.get("b", "k", Client, health_check=lambda client: healthy[0])
+    assert registry.get("b", "k", Client) is first
+    healthy[0] = False
+    second = registry.get("b", "k", Client)
+    # Threads that already hold the old client can finish with it.
+    assert second is not first and not first.closed
+
+
+def test_a_throttled_health_check_keeps_the_client():
+    registry = ClientRegistry(health_check_interval=0)
+    errors = [Throttled(), httpx.ConnectError("down"), ValueError("bad key")]
+
+    def check(client):
+        raise errors.pop(0)
+
+    first = registry.get("b", "k", Client, health_check=check)
+    assert registry.get("b", "k", Client) is first
+    assert registry.get("b", "k", Client) is first
+    assert registry.get("b", "k", Client) is not first
+
+
+def test_gemini_clients_use_their_own_key(monkeypatch):
+    monkeypatch.setattr(text_backends, "registry", ClientRegistry())
+    monkeypatch.setattr(text_backends, "GenerativeServiceClient",
+                        lambda client_options: client_options["api_key"])
+
+    def client(key, model="gemini-1.5-flash"):
+        settings = PipelineSettings(text_model=model, text_api_key=key)
+        return GeminiBackend(settings)._client()
+
+    assert client("key-one") == "key-one"
+    assert client("key-two") == "key-two"
+    assert len(text_backends.registry) == 2
+    client("key-one", "gemini-1.5-pro")
+    assert len(text_backends.registry) == 2
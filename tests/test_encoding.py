@@ -0,0 +1,46 @@
+import io
+
+import pytest
+import soundfile as sf
+
+from audio import StreamWriter, compression_level, output_samplerate
+from conftest import tone, encode
+
+
+@pytest.mark.parametrize("output_format, container", [
+    ("wav", "WAV"), ("flac", "FLAC"), ("opus", "OGG"), ("mp3", "MP3"),
+])
+def test_segments_are_encoded_while_written(output_format, container):
+    buffer = io.BytesIO()
+    with StreamWriter(buffer, output_format, bitrate=64 if output_format == "mp3" else None) as writer:
+        for _ in range(3):
+            writer.write(encode(tone(0.5)))
+    info = sf.info(io.BytesIO(buffer.getvalue()))
+    assert info.format == container
+    assert abs(info.duration - 1.5) < 0.1
+
+
+def test_opus_is_resampled_to_a_supported_rate():
+    assert output_samplerate("opus", 22050) == 24000
+    assert output_samplerate("opus", 44100) == 48000
+    assert output_samplerate("mp3", 22050) == 22050
+    buffer = io.BytesIO()
+    with StreamWriter(buffer, "opus") as writer:
+        writer.write(encode(tone(1)))
+    assert sf.info(io.BytesIO(buffer.getvalue())).samplerate == 24000
+
+
+def test_lower_bitrates_compress_harder():
+    assert compression_level("mp3", 64, 44100, 1) > compression_level("mp3", 192, 44100, 1)
+    assert 0 <= compression_level("opus", 1000, 48000, 2) <= 0.99
+    assert 0 <= compression_level("mp3", 8, 8000, 1) <= 0.99
+
+
+def test_mp3_is_smaller_than_wav():
+    sizes = {}
+    for output_format in ("wav", "mp3"):
+        buffer = io.BytesIO()
+        with StreamWriter(buffer, output_format, bitrate=64) as writer:
+            writer.write(encode(tone(2)))
+        sizes[output_format] = len(buffer.getvalue())
+    assert sizes["mp3"] * 4 < sizes["wav"]
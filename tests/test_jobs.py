@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobQueue, public_settings, run_job
+from pipeline import PipelineSettings
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+    return JobQueue(str(tmp_path / "jobs" / "queue.sqlite3"))
+
+
+@pytest.fixture
+def settings():
+    return PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key")
+
+
+def params(settings, **values):
+    return dict(values, settings=public_settings(settings))
+
+
+def test_jobs_are_claimed_in_priority_order(queue, settings):
+    queue.submit("late", "script", params(settings), priority=10)
+    time.sleep(0.01)
+    queue.submit("first", "script", params(settings), priority=0)
+    queue.submit("second", "script", params(settings), priority=0)
+    assert [queue.claim("w")["id"] for _ in range(3)] == ["first", "second", "late"]
+    assert queue.claim("w") is None
+    job = queue.get("first")
+    assert job["status"] == jobs.RUNNING and job["worker"] == "w" and job["attempts"] == 1
+
+
+def test_keys_are_not_stored(queue, settings):
+    queue.submit("job", "script", params(settings), priority=0)
+    assert "text_api_key" not in queue.get("job")["params"]["settings"]
+
+
+def test_a_pool_only_claims_its_own_jobs(queue, settings):
+    queue.submit("mine", "script", params(settings), priority=10, pool="a")
+    queue.submit("theirs", "script", params(settings), priority=0, pool="b")
+    assert queue.claim("w", "a")["id"] == "mine"
+    assert queue.claim("w", "a") is None
+
+
+def test_jobs_of_a_stopped_pool_are_adopted(queue, settings):
+    queue.heartbeat("alive")
+    queue.submit("alive", "script", params(settings), priority=0, pool="alive")
+    queue.submit("queued", "script", params(settings), priority=0, pool="gone")
+    queue.submit("running", "script", params(settings), priority=0, pool="gone")
+    queue.claim("w", "gone")
+    queue.claim("w", "gone")
+    queue.adopt("new")
+    assert queue.get("alive")["pool"] == "alive"
+    for job_id in ("queued", "running"):
+        job = queue.get(job_id)
+        assert (job["status"], job["pool"], job["worker"]) == (jobs.QUEUED, "new", None)
+
+
+def test_a_job_that_used_up_its_attempts_fails(queue, settings):
+    queue.submit("job", "script", params(settings), priority=0, pool="gone")
+    for _ in range(jobs.MAX_ATTEMPTS):
+        queue.claim("w", "gone")
+        queue.recover(lambda worker: False, "gone")
+    assert queue.get("job")["status"] == jobs.FAILED
+
+
+def test_recover_keeps_jobs_of_live_workers(queue, settings):
+    queue.submit("kept", "script", params(settings), priority=0, pool="p")
+    queue.submit("lost", "script", params(settings), priority=0, pool="p")
+    queue.claim("alive", "p")
+    queue.claim("dead", "p")
+    queue.recover(lambda worker: worker == "alive", "p")
+    assert queue.get("kept")["status"] == jobs.RUNNING
+    assert queue.get("lost")["status"] == jobs.QUEUED
+
+
+def test_an_old_queue_gets_the_pool_column(tmp_path, settings):
+    path = str(tmp_path / "old.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL,"
+            " priority INTEGER NOT NULL, status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0,"
+            " message TEXT, result TEXT, error TEXT, worker INTEGER,"
+            " attempts INTEGER NOT NULL DEFAULT 0, cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO jobs (id, kind, params, priority, status, created, updated)"
+                     " VALUES ('old', 'script', '{}', 0, 'queued', 0, 0)")
+    queue = JobQueue(path)
+    queue.adopt("new")
+    assert queue.claim("w", "new")["id"] == "old"
+
+
+def test_cancel(queue, settings):
+    queue.submit("running", "script", params(settings), priority=0)
+    queue.claim("w")
+    queue.submit("queued", "script", params(settings), priority=0)
+    queue.cancel("queued")
+    queue.cancel("running")
+    assert queue.get("queued")["status"] == jobs.CANCELLED
+    assert queue.get("running")["status"] == jobs.RUNNING
+    assert queue.report("running", 0.5, "half way") == (True, 0)
+
+
+def test_prune_removes_old_finished_jobs(queue, settings):
+    queue.submit("done", "script", params(settings), priority=0)
+    queue.submit("queued", "script", params(settings), priority=0)
+    queue.complete("done", {"script": "text"})
+    os.makedirs(jobs.job_directory("done"))
+    queue.prune(-1)
+    assert queue.get("done") is None and not os.path.exists(jobs.job_directory("done"))
+    assert queue.get("queued") is not None
+
+
+def test_run_job(queue, settings, monkeypatch):
+    seen = []
+
+    def handler(settings, params, job_dir, report):
+        seen.append((settings.text_api_key, params["title"]))
+        report(1.0, "done")
+        return {"script": "text"}
+
+    monkeypatch.setitem(jobs.HANDLERS, "script", handler)
+    queue.submit("job", "script", params(settings, title="Title"), priority=0)
+    run_job(queue, queue.claim("w"), {"text_api_key": "key"})
+    job = queue.get("job")
+    assert seen == [("key", "Title")]
+    assert (job["status"], job["result"], job["progress"]) == (jobs.DONE, {"script": "text"}, 1)
+    assert jobs.load_trace("job")["name"] == "job.script"
+
+
+def test_run_job_without_keys_fails(queue, settings):
+    queue.submit("job", "script", params(settings, title="Title"), priority=0)
+    run_job(queue, queue.claim("w"), None)
+    assert queue.get("job")["status"] == jobs.FAILED
+
+
+def test_a_cancelled_job_stops_at_its_next_report(queue, settings, monkeypatch):
+    def handler(settings, params, job_dir, report):
+        queue.cancel("job")
+        report(1.0, "done")
+        raise AssertionError("not stopped")
+
+    monkeypatch.setitem(jobs.HANDLERS, "script", handler)
+    queue.submit("job", "script", params(settings, title="Title"), priority=0)
+    run_job(queue, queue.claim("w"), {"text_api_key": "key"})
+    assert queue.get("job")["status"] == jobs.CANCELLED
+
+
+def test_a_running_job_is_promoted_at_its_next_report(queue, settings, monkeypatch):
+    priorities = []
+
+    def handler(settings, params, job_dir, report):
+        report(0.0, "started")
+        priorities.append(settings.priority)
+        queue.prioritize("job", 0)
+        monkeypatch.setattr(jobs, "PROGRESS_INTERVAL", 0)
+        report(0.5, "half way")
+        priorities.append(settings.priority)
+        return {}
+
+    monkeypatch.setitem(jobs.HANDLERS, "script", handler)
+    queue.submit("job", "script", params(settings, title="Title"), priority=20)
+    job = queue.claim("w")
+    run_job(queue, job, {"text_api_key": "key"})
+    assert priorities == [20, 0]
+
+
+class FakeProcess:
+    def __init__(self, alive=True, **kwargs):
+        self.alive = alive
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeContext:
+    Process = FakeProcess
+
+
+def test_the_heartbeat_replaces_crashed_workers(queue, settings, monkeypatch):
+    pool = jobs.WorkerPool.__new__(jobs.WorkerPool)
+    pool.path, pool.id, pool.queue = queue.path, "pool", queue
+    pool._context, pool._secrets, pool._traces = FakeContext(), {}, None
+    pool._lock = threading.Lock()
+    pool._processes, pool._tokens = [FakeProcess(alive=False)], ["crashed"]
+    queue.heartbeat("pool")
+    queue.submit("job", "script", params(settings), priority=0, pool="pool")
+    queue.claim("crashed", "pool")
+
+    sleeps = []
+
+    def sleep(seconds):
+        if sleeps:
+            raise KeyboardInterrupt
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(jobs.time, "sleep", sleep)
+    with pytest.raises(KeyboardInterrupt):
+        pool._keep_alive()
+    assert pool._processes[0].is_alive() and pool._tokens[0] != "crashed"
+    assert queue.get("job")["status"] == jobs.QUEUED
+
+
+def test_a_job_cancelled_after_its_last_report_is_not_completed(queue, settings):
+    queue.submit("job", "script", params(settings), priority=0)
+    queue.claim("w")
+    queue.cancel("job")
+    queue.complete("job", {"script": "text"})
+    job = queue.get("job")
+    assert (job["status"], job["result"]) == (jobs.CANCELLED, None)
+
+
+def test_a_script_job_reports_between_sections(queue, settings, monkeypatch):
+    settings.long_form = True
+    monkeypatch.setattr(jobs, "PROGRESS_INTERVAL", 0)
+    monkeypatch.setattr(jobs.pipeline, "search_and_summarize", lambda settings, title: "summary")
+
+    def generate_longform_script(title, context, video_length, complete, max_workers=None,
+                                 report=None):
+        report(0.5, "1/2 sections drafted")
+        queue.cancel("job")
+        report(1.0, "2/2 sections drafted")
+        raise AssertionError("not stopped")
+
+    monkeypatch.setattr(jobs.pipeline.longform, "generate_longform_script",
+                        generate_longform_script)
+    queue.submit("job", "script", params(settings, title="Title", video_length=30), priority=0)
+    run_job(queue, queue.claim("w"), {"text_api_key": "key"})
+    job = queue.get("job")
+    assert (job["status"], job["message"]) == (jobs.CANCELLED, "2/2 sections drafted")
+    assert job["progress"] == 1.0
@@ -0,0 +1,140 @@
+import re
+import threading
+import time
+
+import longform
+from longform import (allocate_budgets, parse_outline, section_count, smooth_transitions,
+                      generate_longform_script, word_count)
+
+
+def outline_reply(prompt):
+    sections = int(re.search(r"Write exactly (\d+) sections", prompt).group(1))
+    return "\n".join(f"{i + 1}. Part {i + 1}: what part {i + 1} covers" for i in range(sections))
+
+
+def words(count, word="word"):
+    return " ".join([word] * (count - 1)) + " end."
+
+
+def test_section_count_follows_the_length():
+    assert section_count(10) == 3
+    assert section_count(40) == 10
+    assert section_count(1000) == longform.MAX_SECTIONS
+
+
+def test_intro_and_conclusion_get_half_a_section():
+    assert allocate_budgets(1500, 4) == [250, 500, 500, 250]
+
+
+def test_outline_lines_lose_their_markers():
+    assert parse_outline("1. Intro: hello\n- **Body**: more\n\nSection 3: Outro") == [
+        {"heading": "Intro", "summary": "hello"},
+        {"heading": "Body", "summary": "more"},
+        {"heading": "Outro", "summary": ""},
+    ]
+
+
+def test_transitions_drop_greetings_sign_offs_and_repeats():
+    sections = [
+        "Welcome back to the channel, everyone! Today is big. Thanks for watching.",
+        "Hello everyone and welcome to the video. Today is big. Here is more.",
+        "Last words. Thanks for watching!",
+    ]
+    assert smooth_transitions(sections) == (
+        "Welcome back to the channel, everyone! Today is big."
+        "\n\nHere is more.\n\nLast words. Thanks for watching!"
+    )
+
+
+def test_paragraph_breaks_inside_a_section_are_kept():
+    sections = ["First paragraph.\n\nSecond paragraph.", "Hi everyone, welcome back. Next one.\n\nLast."]
+    assert smooth_transitions(sections) == (
+        "First paragraph.\n\nSecond paragraph.\n\nNext one.\n\nLast."
+    )
+
+
+def test_all_sections_are_drafted_at_once():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def complete(prompt):
+        if "Write exactly" in prompt:
+            return outline_reply(prompt)
+        with lock:
+            running.append(prompt)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(prompt)
+        return words(int(re.search(r"about (\d+) words long", prompt).group(1)))
+
+    generate_longform_script("Title", "Context", 40, complete)
+    assert max(peak) == section_count(40)
+
+
+def test_workers_are_bounded_by_max_workers():
+    peak = []
+    running = []
+    lock = threading.Lock()
+
+    def complete(prompt):
+        if "Write exactly" in prompt:
+            return outline_reply(prompt)
+        with lock:
+            running.append(prompt)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(prompt)
+        return words(int(re.search(r"about (\d+) words long", prompt).group(1)))
+
+    generate_longform_script("Title", "Context", 40, complete, max_workers=2)
+    assert max(peak) == 2
+
+
+def test_sections_that_miss_their_budget_are_revised():
+    revisions = []
+
+    def complete(prompt):
+        if "Write exactly" in prompt:
+            return outline_reply(prompt)
+        target = int(re.search(r"about (\d+) words long", prompt).group(1))
+        if "is 10 words long" in prompt:
+            revisions.append(target)
+            return words(target, "revised")
+        if "Write section 2:" in prompt:
+            return words(10, "short")
+        return words(target)
+
+    script = generate_longform_script("Title", "Context", 10, complete)
+    assert len(revisions) == 1
+    assert "short" not in script and "revised" in script
+    assert abs(word_count(script) - longform.word_budget(10)) <= 0.2 * longform.word_budget(10)
+
+
+def test_progress_is_reported_per_section_and_can_stop_the_rest():
+    drafted = []
+    reports = []
+
+    class Stop(Exception):
+        pass
+
+    def complete(prompt):
+        if "Write exactly" in prompt:
+            return outline_reply(prompt)
+        drafted.append(prompt)
+        time.sleep(0.01)
+        return words(int(re.search(r"about (\d+) words long", prompt).group(1)))
+
+    def report(fraction, message):
+        reports.append(message)
+        if len(reports) == 3:
+            raise Stop()
+
+    try:
+        generate_longform_script("Title", "Context", 40, complete, max_workers=1, report=report)
+    except Stop:
+        pass
+    assert reports == ["Drafting 10 sections...", "1/10 sections drafted", "2/10 sections drafted"]
+    assert len(drafted) < section_count(40)
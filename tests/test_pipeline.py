@@ -0,0 +1,114 @@
+import dataclasses
+import io
+import os
+
+import pytest
+import soundfile as sf
+
+import pipeline
+import tts_backends
+from pipeline import PipelineSettings
+from synthesis_cache import cache_key
+from tts_backends import TTSBackend, PiperBackend
+from conftest import tone, encode
+
+
+class FakeMp3Backend(TTSBackend):
+    # Returns the text as its "MP3 frames", which are passed through as-is.
+    name = "fake/mp3"
+    native_format = "mp3"
+
+    def cache_key(self, chunk):
+        return cache_key(chunk, self.name, "", 1, "")
+
+    def synthesize(self, chunk):
+        return f"<{chunk}>".encode()
+
+
+class FakeWavBackend(TTSBackend):
+    # An offline stand-in for a local engine: one 0.1 s tone per 10
+    # characters, at a pitch that depends on the text.
+    name = "fake/wav"
+    calls = []
+
+    def cache_key(self, chunk):
+        return cache_key(chunk, self.name, "", 1, "")
+
+    def synthesize(self, chunk):
+        self.calls.append(chunk)
+        return encode(tone(len(chunk) / 100, frequency=200 + 10 * len(chunk)))
+
+
+@pytest.fixture
+def wav_settings(monkeypatch):
+    monkeypatch.setitem(tts_backends._BACKENDS, FakeWavBackend.name, FakeWavBackend)
+    monkeypatch.setattr(FakeWavBackend, "calls", [])
+    return PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key",
+                            tts_model=FakeWavBackend.name, postprocess=False)
+
+
+@pytest.fixture
+def mp3_settings(monkeypatch):
+    monkeypatch.setitem(tts_backends._BACKENDS, FakeMp3Backend.name, FakeMp3Backend)
+    return PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key",
+                            tts_model=FakeMp3Backend.name)
+
+
+def test_mp3_is_passed_through_in_memory(mp3_settings):
+    assert pipeline.text_to_speech(mp3_settings, "One. Two.") == b"<One.><Two.>"
+
+
+def test_mp3_is_passed_through_to_a_file(mp3_settings, tmp_path):
+    path = tmp_path / "out.mp3"
+    assert pipeline.text_to_speech(mp3_settings, "One. Two.", output=str(path)) == str(path)
+    assert path.read_bytes() == b"<One.><Two.>"
+
+
+def test_an_empty_script_is_an_error(mp3_settings):
+    with pytest.raises(ValueError):
+        pipeline.text_to_speech(mp3_settings, "  \n ")
+
+
+SCRIPT = "The first sentence is here. A second one follows!\n\nA new paragraph starts."
+
+
+def test_wav_render_is_the_segments_in_order(wav_settings, tmp_path):
+    segments = []
+    snapshots = []
+    path = str(tmp_path / "out.wav")
+    pipeline.text_to_speech(wav_settings, SCRIPT, output=path, on_segment=segments.append,
+                            on_progress=snapshots.append)
+    sentences = ["The first sentence is here.", "A second one follows!", "A new paragraph starts."]
+    assert sorted(FakeWavBackend.calls) == sorted(sentences)
+    assert [sf.info(io.BytesIO(s)).duration for s in segments] == pytest.approx(
+        [len(sentence) / 100 for sentence in sentences], abs=1e-3)
+    assert sf.info(path).duration == pytest.approx(sum(len(s) for s in sentences) / 100, abs=1e-3)
+    assert snapshots[0].done == 0 and snapshots[-1].done == snapshots[-1].total == 3
+
+
+def test_a_second_render_comes_from_the_cache(wav_settings):
+    first = pipeline.text_to_speech(wav_settings, SCRIPT)
+    FakeWavBackend.calls.clear()
+    assert pipeline.text_to_speech(wav_settings, SCRIPT) == first
+    assert FakeWavBackend.calls == []
+
+
+def test_postprocessed_mp3_render(wav_settings):
+    settings = dataclasses.replace(wav_settings, postprocess=True, output_format="mp3", bitrate=64)
+    audio = pipeline.text_to_speech(settings, SCRIPT)
+    info = sf.info(io.BytesIO(audio))
+    assert info.format == "MP3"
+    # Trimmed and joined with 0.25 s gaps.
+    assert 0.5 < info.duration < 1.5
+
+
+def test_piper_voices_with_the_same_file_name_have_their_own_keys(tmp_path):
+    keys = set()
+    for directory in ("a", "b"):
+        os.makedirs(tmp_path / directory)
+        path = tmp_path / directory / "voice.onnx"
+        path.write_bytes(b"model " + directory.encode())
+        settings = PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key",
+                                    tts_model=PiperBackend.name, local_voice_model=str(path))
+        keys.add(PiperBackend(settings).cache_key("Hello."))
+    assert len(keys) == 2
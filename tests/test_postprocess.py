@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+import soundfile as sf
+
+from postprocess import (PostProcessingWriter, LoudnessMeter, TruePeakMeter, compress_silence,
+                         TARGET_LUFS, PEAK_CEILING_DB)
+from conftest import tone, encode
+
+RATE = 22050
+
+
+def silence(seconds, channels=1):
+    return np.zeros((int(seconds * RATE), channels), np.float32)
+
+
+def render(segments, **kwargs):
+    buffer = io.BytesIO()
+    with PostProcessingWriter(buffer, **kwargs) as writer:
+        for segment in segments:
+            writer.write(encode(segment))
+    data, rate = sf.read(io.BytesIO(buffer.getvalue()), always_2d=True, dtype="float32")
+    assert rate == RATE
+    return data
+
+
+def test_edges_are_trimmed_and_pauses_capped():
+    data = np.concatenate([silence(1), tone(0.5), silence(2), tone(0.5), silence(1)])
+    trimmed = compress_silence(data, RATE)
+    # 50 ms at each edge, 350 ms between the tones.
+    assert abs(len(trimmed) / RATE - (0.05 + 0.5 + 0.35 + 0.5 + 0.05)) < 0.02
+
+
+def test_silent_segments_vanish():
+    assert len(compress_silence(silence(1), RATE)) == 0
+
+
+def test_loudness_is_normalized():
+    data = render([tone(3, amplitude=0.02), tone(3, amplitude=0.02, frequency=660)])
+    meter = LoudnessMeter(RATE)
+    meter.add(data)
+    assert abs(meter.integrated() - TARGET_LUFS) < 0.5
+
+
+def test_true_peak_catches_peaks_between_samples():
+    rate = 48000
+    t = np.arange(rate) / rate
+    # A quarter of the sample rate, sampled 45 degrees off its peaks.
+    data = np.sin(2 * np.pi * rate / 4 * t + np.pi / 4).astype(np.float32)[:, None]
+    meter = TruePeakMeter()
+    for start in range(0, len(data), 3000):
+        meter.add(data[start:start + 3000])
+    assert np.max(np.abs(data)) < 0.71
+    assert 0.98 < meter.peak() < 1.02
+
+
+def test_gain_keeps_the_true_peak_under_the_ceiling():
+    # Loud enough that reaching the target would clip.
+    data = render([tone(2, amplitude=0.9, frequency=5000)], target_lufs=0)
+    meter = TruePeakMeter()
+    meter.add(data)
+    assert 20 * np.log10(meter.peak()) <= PEAK_CEILING_DB + 0.1
+
+
+def test_segments_are_separated_by_the_sentence_gap():
+    data = render([tone(0.5), tone(0.5)], sentence_gap=0.25)
+    assert abs(len(data) / RATE - 1.25) < 0.01
+    middle = data[int(0.55 * RATE):int(0.7 * RATE)]
+    assert np.max(np.abs(middle)) == 0
+
+
+def test_without_a_gap_segments_are_crossfaded():
+    data = render([tone(0.5), tone(0.5)], sentence_gap=0, fade=0.01)
+    assert abs(len(data) / RATE - 0.99) < 0.002
+
+
+def test_compressed_output():
+    buffer = io.BytesIO()
+    with PostProcessingWriter(buffer, "flac") as writer:
+        writer.write(encode(tone(1)))
+    info = sf.info(io.BytesIO(buffer.getvalue()))
+    assert info.format == "FLAC" and info.samplerate == RATE
@@ -0,0 +1,27 @@
+from progress import ProgressTracker
+from tts_pipeline import synthesize_chunks
+
+
+def test_progress_is_weighted_by_text_length():
+    tracker = ProgressTracker(["x" * 10, "x" * 30])
+    tracker.advance("x" * 10, 100)
+    snapshot = tracker.snapshot()
+    assert (snapshot.done, snapshot.total) == (1, 2)
+    assert snapshot.fraction == 0.25
+    assert snapshot.bytes_received == 100
+    assert snapshot.eta is not None
+
+
+def test_no_estimate_before_the_first_segment():
+    snapshot = ProgressTracker(["abc"]).snapshot()
+    assert snapshot.fraction == 0 and snapshot.eta is None
+
+
+def test_subscribers_see_every_segment_in_order():
+    tracker = ProgressTracker(["a", "bb", "ccc"])
+    seen = []
+    tracker.subscribe(seen.append)
+    synthesize_chunks(["a", "bb", "ccc"], lambda chunk: chunk.encode(), progress=tracker)
+    assert [snapshot.done for snapshot in seen] == [1, 2, 3]
+    assert seen[-1].fraction == 1.0
+    assert seen[-1].bytes_received == 6
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+import research
+from research import deduplicate, batch_texts, search_and_summarize
+from scheduler import Scheduler
+
+
+def result(body, href=None):
+    return {"body": body, "href": href or f"https://example.com/{abs(hash(body))}"}
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    # Every query returns one result of its own after a short delay.
+    calls = []
+
+    def search(query, region, timelimit, max_results):
+        calls.append(query)
+        time.sleep(0.01)
+        return [result(f"all about {query} and nothing else")]
+
+    monkeypatch.setattr(research, "search", search)
+    monkeypatch.setattr(research, "scheduler", Scheduler())
+    return calls
+
+
+def test_near_duplicates_are_dropped():
+    results = [
+        result("the quick brown fox jumps over the lazy dog", "https://a"),
+        result("the quick brown fox jumps over the lazy dog today", "https://b"),
+        result("something else entirely", "https://a"),
+        result("a different story about cats", "https://c"),
+    ]
+    assert [r["href"] for r in deduplicate(results)] == ["https://a", "https://c"]
+
+
+def test_batches_stay_under_the_size_limit():
+    assert batch_texts(["aaaa", "bbbb", "cc"], max_chars=9) == [["aaaa", "bbbb"], ["cc"]]
+
+
+def test_queued_searches_do_not_time_out(searches, monkeypatch):
+    # One search per 0.1 s: the last query waits 0.3 s in the queue, far
+    # longer than its timeout.
+    monkeypatch.setattr(research, "scheduler", Scheduler(
+        limits={"ddgs": {"rate": 10.0, "burst": 1, "max_concurrency": 4}}
+    ))
+    prompts = []
+
+    def summarize(prompt):
+        prompts.append(prompt)
+        return "summary"
+
+    assert search_and_summarize("topic", summarize, timeout=0.2) == "summary"
+    assert len(searches) == len(research.QUERY_TEMPLATES)
+    assert all(query in prompts[0] for query in searches)
+
+
+def test_a_timed_out_search_is_not_retried(monkeypatch):
+    monkeypatch.setattr(research, "scheduler", Scheduler(base_delay=0.01))
+    calls = []
+    finished = threading.Event()
+
+    def search(query, region, timelimit, max_results):
+        calls.append(query)
+        time.sleep(0.2)
+        if query == "slow":
+            finished.set()
+            raise RuntimeError("429 Too Many Requests")
+        return [result(f"about {query}")]
+
+    monkeypatch.setattr(research, "search", search)
+    monkeypatch.setattr(research, "QUERY_TEMPLATES", ["slow"])
+    with pytest.raises(ValueError):
+        search_and_summarize("slow", lambda prompt: "summary", timeout=0.05)
+    assert finished.wait(1)
+    time.sleep(0.1)
+    assert calls == ["slow"]
+
+
+def test_summaries_time_out(searches):
+    def summarize(prompt):
+        time.sleep(1)
+        return "late"
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        search_and_summarize("topic", summarize, summary_timeout=0.05)
+    assert time.monotonic() - started < 0.9
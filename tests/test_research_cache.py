@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import research
+from research import search_and_summarize
+from research_cache import ResearchCache, normalize_query
+from scheduler import Scheduler
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResearchCache(str(tmp_path / "research.sqlite3"))
+
+
+def test_queries_are_normalized():
+    assert normalize_query("  What's NEW,  in AI? ") == normalize_query("what s new in ai")
+
+
+def test_values_round_trip(cache):
+    key = cache.make_key("query", "2m")
+    assert cache.get("search", key) is None
+    cache.put("search", key, [{"body": "text"}])
+    assert cache.get("search", key) == [{"body": "text"}]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire(cache):
+    cache.ttl = 0.01
+    cache.put("summary", "k", "old")
+    time.sleep(0.02)
+    assert cache.get("summary", "k") is None
+
+
+def test_least_recently_used_entries_are_dropped(cache):
+    cache.max_entries = 2
+    cache.put("search", "a", 1)
+    cache.put("search", "b", 2)
+    time.sleep(0.01)
+    cache.get("search", "a")
+    cache.put("search", "c", 3)
+    assert cache.get("search", "b") is None
+    assert cache.get("search", "a") == 1 and cache.get("search", "c") == 3
+
+
+def test_searches_and_summaries_are_reused(cache, monkeypatch):
+    searches = []
+
+    def search(query, region, timelimit, max_results):
+        searches.append(query)
+        return [{"body": f"all about {query}", "href": f"https://example.com/{len(searches)}"}]
+
+    monkeypatch.setattr(research, "search", search)
+    monkeypatch.setattr(research, "scheduler", Scheduler())
+    summaries = []
+
+    def summarize(prompt):
+        summaries.append(prompt)
+        return "summary"
+
+    for _ in range(2):
+        assert search_and_summarize("topic", summarize, cache=cache, model="m") == "summary"
+    assert len(summaries) == 1
+    assert len(searches) == len(research.QUERY_TEMPLATES)
+
+    # Another model summarizes again, from the cached search results.
+    search_and_summarize("topic", summarize, cache=cache, model="other")
+    assert len(summaries) == 2
+    assert len(searches) == len(research.QUERY_TEMPLATES)
@@ -0,0 +1,189 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import scheduler as scheduler_module
+from scheduler import (AdaptiveLimiter, Cancelled, Scheduler, TokenBucket, is_throttled,
+                       is_transient, retry_after, BACKGROUND, BATCH, INTERACTIVE)
+from tts_backends import get_backend_class
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(headers=headers)
+
+
+UNLIMITED = {"test": {"rate": 1e9, "burst": 1e9, "max_concurrency": 4}}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Backoff delays, recorded instead of slept.
+    delays = []
+    monkeypatch.setattr(scheduler_module.time, "sleep", delays.append)
+    return delays
+
+
+def test_throttling_is_recognized():
+    assert is_throttled(Throttled())
+    assert is_throttled(RuntimeError("Resource exhausted: quota"))
+    assert is_throttled(SimpleNamespace(status_code=503))
+    assert not is_throttled(SimpleNamespace(status_code=400))
+    assert not is_throttled(ValueError("bad prompt"))
+    assert retry_after(Throttled(7)) == 7.0
+    assert retry_after(Throttled()) is None
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=50, burst=2)
+    started = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    assert 0.03 <= time.monotonic() - started < 0.2
+
+
+def test_limiter_halves_on_throttling_and_grows_back():
+    limiter = AdaptiveLimiter(4, decrease_cooldown=0)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert 2 < limiter.limit <= 4
+
+
+def test_waiters_are_admitted_by_priority():
+    limiter = AdaptiveLimiter(1)
+    limiter.acquire()
+    order = []
+
+    def wait(priority, name):
+        limiter.acquire(priority)
+        order.append(name)
+        limiter.release()
+
+    threads = [threading.Thread(target=wait, args=(BACKGROUND, "background"))]
+    threads[0].start()
+    time.sleep(0.02)
+    threads.append(threading.Thread(target=wait, args=(INTERACTIVE, "interactive")))
+    threads[1].start()
+    time.sleep(0.02)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "background"]
+
+
+def test_rate_tokens_go_to_the_highest_priority_first():
+    limits = {"test": {"rate": 50.0, "burst": 1, "max_concurrency": 64}}
+    scheduler = Scheduler(limits=limits)
+    scheduler.call("test", lambda: None)  # uses up the burst
+    order = []
+
+    def call(priority, name):
+        scheduler.call("test", order.append, name, priority=priority)
+
+    threads = [threading.Thread(target=call, args=(BATCH, f"batch {i}")) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.005)
+    threads.append(threading.Thread(target=call, args=(INTERACTIVE, "interactive")))
+    threads[-1].start()
+    for thread in threads:
+        thread.join()
+    assert order.index("interactive") <= 1
+
+
+def test_throttled_calls_are_retried(sleeps):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise Throttled()
+        return "ok"
+
+    assert Scheduler(limits=UNLIMITED).call("test", fn) == "ok"
+    assert len(calls) == 3 and len(sleeps) == 2
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ConnectError("connection refused"), httpx.ReadTimeout("timed out"),
+    ConnectionResetError("reset by peer"),
+])
+def test_transient_errors_are_retried_without_lowering_the_limit(sleeps, error):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise error
+        return "ok"
+
+    scheduler = Scheduler(limits=UNLIMITED)
+    assert is_transient(error) and not is_throttled(error)
+    assert scheduler.call("test", fn) == "ok"
+    assert len(calls) == 3 and len(sleeps) == 2
+    assert scheduler.limiter("test").limit == 4
+
+
+def test_other_errors_are_raised_at_once(sleeps):
+    def fn():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        Scheduler(limits=UNLIMITED).call("test", fn)
+    assert sleeps == []
+
+
+def test_retry_after_is_capped(sleeps):
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Throttled(retry_after=3600)
+        return "ok"
+
+    Scheduler(limits=UNLIMITED, max_delay=5).call("test", fn)
+    assert sleeps == [5]
+
+
+def test_rate_limited_callers_do_not_hold_a_slot():
+    limits = {"test": {"rate": 5.0, "burst": 1, "max_concurrency": 1}}
+    scheduler = Scheduler(limits=limits)
+    scheduler.call("test", lambda: None)
+    limiter = scheduler.limiter("test")
+    seen = []
+    waiting = threading.Thread(target=scheduler.call, args=("test", lambda: None))
+    waiting.start()
+    time.sleep(0.05)
+    seen.append(limiter.in_flight)
+    waiting.join()
+    assert seen == [0]
+
+
+def test_cancelled_calls_stop_retrying(sleeps):
+    cancel = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        cancel.set()
+        raise Throttled()
+
+    with pytest.raises(Cancelled):
+        Scheduler(limits=UNLIMITED).call("test", fn, cancel=cancel)
+    assert len(calls) == 1
+
+
+def test_scheduled_tts_backends_are_not_retried_twice():
+    assert get_backend_class("mrfakename/MeloTTS").max_attempts == 1
+    assert get_backend_class("ElevenLabs").max_attempts == 1
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+import tts_backends
+from pipeline import PipelineSettings
+from scheduler import BACKGROUND
+from speculative import SpeculativeSynthesis
+from synthesis_cache import cache_key, get_default_cache
+from tts_backends import TTSBackend
+from tts_pipeline import split_script
+
+
+class FakeBackend(TTSBackend):
+    name = "fake/speculative"
+    max_workers = 1
+    calls = []
+    lock = threading.Lock()
+
+    def cache_key(self, chunk):
+        return cache_key(chunk, self.name, "", 1, "")
+
+    def synthesize(self, chunk):
+        with self.lock:
+            self.calls.append((chunk, self.settings.priority))
+        return chunk.encode()
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setitem(tts_backends._BACKENDS, FakeBackend.name, FakeBackend)
+    monkeypatch.setattr(FakeBackend, "calls", [])
+    return PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key",
+                            tts_model=FakeBackend.name)
+
+
+SCRIPT = ("Welcome to the show. Today we look at rivers!\n\n"
+          "Part one\n\nRivers carve valleys, slowly; over ages. \"Is that so?\" It is.")
+
+
+def stream(speculation, text, size=3):
+    for start in range(0, len(text), size):
+        speculation.feed(text[start:start + size])
+
+
+def test_fed_sentences_are_synthesized_at_background_priority(settings):
+    speculation = SpeculativeSynthesis(settings)
+    stream(speculation, SCRIPT)
+    speculation.finish()
+    speculation._executor.shutdown(wait=True)
+    chunks = split_script(SCRIPT, max_chars=FakeBackend.max_chunk_chars, pack=False)
+    assert sorted(chunk for chunk, _ in FakeBackend.calls) == sorted(chunks)
+    assert {priority for _, priority in FakeBackend.calls} == {BACKGROUND}
+    assert all(FakeBackend(settings).cache_key(chunk) in get_default_cache() for chunk in chunks)
+
+
+def test_only_the_unqueued_tail_is_split_again(settings, monkeypatch):
+    speculation = SpeculativeSynthesis(settings)
+    split = []
+    original = speculation._chunks
+    monkeypatch.setattr(speculation, "_chunks", lambda text: split.append(text) or original(text))
+    stream(speculation, SCRIPT)
+    speculation._executor.shutdown(wait=True)
+    assert SCRIPT.endswith(split[-1]) and len(split[-1]) < 20
+    assert max(len(text) for text in split) < len(SCRIPT) / 2
+    # Everything before the last sentence was queued while streaming.
+    assert [chunk for chunk, _ in FakeBackend.calls][-1] == "\"Is that so?\""
+
+
+def test_part_of_an_overlong_sentence_is_not_a_resume_point(settings, monkeypatch):
+    monkeypatch.setattr(FakeBackend, "max_chunk_chars", 20)
+    text = "one two three, four five six seven eight nine ten. Next."
+    chunks = split_script(text, max_chars=20, pack=False)
+    assert SpeculativeSynthesis._consumed(text, chunks[:2]) == 0
+    end = text.index(". ") + 1
+    assert SpeculativeSynthesis._consumed(text, chunks[:-1]) == end
+    speculation = SpeculativeSynthesis(settings)
+    stream(speculation, text)
+    speculation.finish()
+    speculation._executor.shutdown(wait=True)
+    # Pieces of the sentence taken while it was still growing may be extra.
+    assert set(chunks) <= {chunk for chunk, _ in FakeBackend.calls}
+
+
+def test_cancel_drops_sentences_not_started(settings):
+    speculation = SpeculativeSynthesis(settings)
+    speculation.cancel()
+    speculation.finish(SCRIPT)
+    assert FakeBackend.calls == []
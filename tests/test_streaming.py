@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import pytest
+
+import pipeline
+import text_backends
+import tracing
+from pipeline import PipelineSettings
+from text_backends import TextBackend, GroqBackend
+
+
+class FakeTextBackend(TextBackend):
+    name = "fake"
+    models = ("fake-model",)
+
+    def complete(self, prompt):
+        return "A whole script."
+
+    def stream(self, prompt):
+        yield from ["A ", "whole ", "script."]
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setitem(text_backends._MODELS, "fake-model", FakeTextBackend)
+    return PipelineSettings(text_model="fake-model", text_api_key=None)
+
+
+def test_tokens_are_passed_through_as_they_arrive(settings):
+    with tracing.trace("test") as trace:
+        tokens = list(pipeline.stream_youtube_script(settings, "Title", "Context", 5))
+    assert tokens == ["A ", "whole ", "script."]
+    span = next(s for s in trace.to_dict()["spans"] if s["name"] == "script")
+    assert span["attributes"]["chars_out"] == len("A whole script.")
+
+
+def test_backends_without_streaming_yield_the_whole_text(settings):
+    class Blocking(TextBackend):
+        def complete(self, prompt):
+            return "All at once."
+
+    assert list(Blocking(settings).stream("prompt")) == ["All at once."]
+
+
+def test_groq_stream_skips_empty_deltas(monkeypatch):
+    def chunk(content):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+    stream = [chunk("Hello"), chunk(None), SimpleNamespace(choices=[]), chunk(" there")]
+    monkeypatch.setattr(GroqBackend, "_create", lambda self, prompt, **kwargs: iter(stream))
+    backend = GroqBackend(PipelineSettings(text_model="gemma2-9b-it", text_api_key="k"))
+    assert list(backend.stream("prompt")) == ["Hello", " there"]
@@ -0,0 +1,51 @@
+import os
+
+from synthesis_cache import SynthesisCache, cache_key
+
+
+def test_key_ignores_whitespace_and_unicode_forms():
+    assert cache_key("Hello  world\n", "b", "v", 1, "EN") == cache_key("Hello world", "b", "v", 1, "EN")
+    assert cache_key("ﬁne", "b", "v", 1, "EN") == cache_key("fine", "b", "v", 1, "EN")
+
+
+def test_key_depends_on_every_parameter():
+    base = cache_key("text", "b", "v", 1, "EN")
+    assert base != cache_key("text", "b2", "v", 1, "EN")
+    assert base != cache_key("text", "b", "v2", 1, "EN")
+    assert base != cache_key("text", "b", "v", 1.1, "EN")
+    assert base != cache_key("text", "b", "v", 1, "FR")
+
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = SynthesisCache(str(tmp_path))
+    assert cache.get("k") is None
+    cache.put("k", b"audio")
+    assert cache.get("k") == b"audio"
+    assert "k" in cache
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entries_survive_a_restart(tmp_path):
+    SynthesisCache(str(tmp_path)).put("k", b"audio")
+    cache = SynthesisCache(str(tmp_path))
+    assert cache.get("k") == b"audio"
+    assert cache.stats()["bytes"] == len(b"audio")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SynthesisCache(str(tmp_path), max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert not os.path.exists(tmp_path / "b")
+
+
+def test_a_deleted_file_is_a_miss(tmp_path):
+    cache = SynthesisCache(str(tmp_path))
+    cache.put("k", b"audio")
+    os.unlink(tmp_path / "k")
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
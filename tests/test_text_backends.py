@@ -0,0 +1,145 @@
+import sys
+import threading
+import types
+
+import pytest
+
+import text_backends
+from clients import ClientRegistry
+from pipeline import PipelineSettings
+from text_backends import LlamaCppBackend, ModelClosed, _LlamaModel
+
+
+class FakeLlama:
+    started = None
+    release = None
+
+    def __init__(self, model_path, n_ctx, verbose):
+        self.model_path = model_path
+        self.closed = False
+
+    def set_cache(self, cache):
+        pass
+
+    def create_chat_completion(self, messages, max_tokens, stream=False):
+        assert not self.closed
+        if FakeLlama.started is not None:
+            FakeLlama.started.set()
+            FakeLlama.release.wait(5)
+        content = messages[0]["content"].upper()
+        if stream:
+            return iter([{"choices": [{"delta": {"content": word}}]} for word in content.split()])
+        return {"choices": [{"message": {"content": content}}], "usage": {}}
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def llama_cpp(monkeypatch):
+    module = types.ModuleType("llama_cpp")
+    module.Llama = FakeLlama
+    module.LlamaRAMCache = object
+    monkeypatch.setitem(sys.modules, "llama_cpp", module)
+    monkeypatch.setattr(FakeLlama, "started", None)
+    monkeypatch.setattr(FakeLlama, "release", None)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(text_backends, "registry", ClientRegistry())
+    settings = PipelineSettings(text_model="local/llama.cpp", text_api_key=None,
+                                local_text_model="model.gguf")
+    return LlamaCppBackend(settings)
+
+
+def test_complete_and_stream(backend):
+    assert backend.complete("a script") == "A SCRIPT"
+    assert list(backend.stream("a script")) == ["A", "SCRIPT"]
+
+
+def test_a_closed_model_raises_instead_of_hanging():
+    model = _LlamaModel("model.gguf")
+    model.close()
+    assert model.llm.closed
+    with pytest.raises(ModelClosed):
+        model.complete("prompt")
+    with pytest.raises(ModelClosed):
+        list(model.stream("prompt"))
+
+
+def test_close_waits_for_the_prompt_in_progress():
+    FakeLlama.started = threading.Event()
+    FakeLlama.release = threading.Event()
+    model = _LlamaModel("model.gguf")
+    results = []
+    worker = threading.Thread(target=lambda: results.append(model.complete("prompt")))
+    worker.start()
+    assert FakeLlama.started.wait(5)
+    assert model.busy()
+    closer = threading.Thread(target=model.close)
+    closer.start()
+    closer.join(0.05)
+    assert closer.is_alive() and not model.llm.closed
+    FakeLlama.release.set()
+    worker.join(5)
+    closer.join(5)
+    assert results[0]["choices"][0]["message"]["content"] == "PROMPT"
+    assert model.llm.closed and not model.busy()
+
+
+def test_a_busy_model_is_not_evicted():
+    FakeLlama.started = threading.Event()
+    FakeLlama.release = threading.Event()
+    registry = ClientRegistry(idle_timeout=0)
+    model = registry.get("llama.cpp", "model.gguf", lambda: _LlamaModel("model.gguf"))
+    worker = threading.Thread(target=model.complete, args=("prompt",))
+    worker.start()
+    assert FakeLlama.started.wait(5)
+    registry.evict_idle()
+    assert len(registry) == 1
+    FakeLlama.release.set()
+    worker.join(5)
+    registry.evict_idle()
+    assert len(registry) == 0 and model.llm.closed
+
+
+def test_an_evicted_model_is_loaded_again(backend, monkeypatch):
+    # The caller looked the model up just before the registry closed it.
+    model = backend._model()
+    text_backends.registry.discard("llama.cpp", "model.gguf")
+    assert model.closed
+    lookups = iter([model])
+    original = backend._model
+    monkeypatch.setattr(backend, "_model", lambda: next(lookups, None) or original())
+    assert backend.complete("again") == "AGAIN"
+
+
+def test_gemini_requests_and_responses(monkeypatch):
+    from google.ai.generativelanguage import Candidate, Content, GenerateContentResponse, Part
+    from text_backends import GeminiBackend
+
+    requests = []
+
+    def response(*texts):
+        return GenerateContentResponse(candidates=[Candidate(
+            content=Content(parts=[Part(text=text) for text in texts]))] if texts else [])
+
+    class Client:
+        def generate_content(self, request):
+            requests.append(request)
+            return response("A ", "script")
+
+        def stream_generate_content(self, request):
+            return iter([response("A "), response(), response("script")])
+
+    monkeypatch.setattr(text_backends, "registry", ClientRegistry())
+    monkeypatch.setattr(text_backends, "GenerativeServiceClient", lambda client_options: Client())
+    backend = GeminiBackend(PipelineSettings(text_model="gemini-1.5-flash", text_api_key="key"))
+    assert backend.complete("Write it.") == "A script"
+    assert requests[0].model == "models/gemini-1.5-flash"
+    assert requests[0].contents[0].parts[0].text == "Write it."
+    assert list(backend.stream("Write it.")) == ["A ", "script"]
+    monkeypatch.setattr(Client, "generate_content", lambda self, request: response())
+    with pytest.raises(ValueError, match="no text"):
+        backend.complete("Write it.")
@@ -0,0 +1,79 @@
+import json
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+from tracing import Metrics
+
+
+@pytest.fixture(autouse=True)
+def metrics(monkeypatch):
+    fresh = Metrics()
+    monkeypatch.setattr(tracing, "metrics", fresh)
+    return fresh
+
+
+def test_spans_nest_inside_a_trace(tmp_path):
+    with tracing.trace("job", job_id="1") as job_trace:
+        with tracing.span("llm", chars_in=10):
+            tracing.annotate(tokens_out=5)
+            with tracing.span("retry"):
+                pass
+    spans = {span["name"]: span for span in job_trace.to_dict()["spans"]}
+    assert spans["retry"]["parent"] == spans["llm"]["id"]
+    assert spans["llm"]["parent"] == spans["job"]["id"]
+    assert spans["llm"]["attributes"] == {"chars_in": 10, "tokens_out": 5}
+    path = str(tmp_path / "trace.json")
+    job_trace.save(path)
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["name"] == "job"
+
+
+def test_errors_are_recorded():
+    with pytest.raises(ValueError):
+        with tracing.trace("job") as job_trace:
+            with tracing.span("tts"):
+                raise ValueError("bad segment")
+    spans = job_trace.to_dict()["spans"]
+    assert [span["status"] for span in spans] == ["error", "error"]
+    assert spans[1]["error"] == "ValueError: bad segment"
+
+
+def test_propagate_carries_the_span_to_other_threads():
+    with tracing.trace("job") as job_trace:
+        with tracing.span("research") as parent:
+            def summarize():
+                with tracing.span("summarize"):
+                    return tracing.current().parent
+
+            with ThreadPoolExecutor(2) as executor:
+                assert executor.submit(tracing.propagate(summarize)).result() is parent
+                assert executor.submit(summarize).result() is None
+    assert [span["name"] for span in job_trace.to_dict()["spans"]].count("summarize") == 1
+
+
+def test_render(metrics):
+    metrics.observe("llm", 0.2, {"tokens_out": 7, "retries": 0})
+    metrics.observe("llm", 3, None, error="TimeoutError")
+    text = metrics.render()
+    assert 'yt_voiceover_span_duration_seconds_bucket{span="llm",le="0.25"} 1' in text
+    assert 'yt_voiceover_span_duration_seconds_count{span="llm"} 2' in text
+    assert 'yt_voiceover_spans_total{span="llm",status="error"} 1' in text
+    assert 'yt_voiceover_tokens_out_total{span="llm"} 7' in text
+    assert "retries_total" not in text
+
+
+def test_metrics_are_served_on_localhost(monkeypatch, metrics):
+    monkeypatch.setattr(tracing, "_server", None)
+    server = tracing.serve_metrics(0)
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        metrics.observe("tts", 1)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert 'span="tts"' in response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
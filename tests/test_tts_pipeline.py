@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from tts_pipeline import READ_AHEAD, split_script, iter_synthesized, synthesize_chunks
+
+
+def test_chunks_never_span_paragraphs():
+    script = "First one. Second one.\n\nThird one."
+    assert split_script(script) == ["First one. Second one.", "Third one."]
+
+
+def test_chunks_stay_under_the_limit():
+    script = " ".join(f"Sentence number {i} is here." for i in range(100))
+    chunks = split_script(script, max_chars=120)
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    assert " ".join(chunks) == script
+
+
+def test_long_sentence_is_cut_at_clauses_first():
+    sentence = "alpha beta gamma, delta epsilon zeta, eta theta iota."
+    assert split_script(sentence, max_chars=20) == [
+        "alpha beta gamma,", "delta epsilon zeta,", "eta theta iota."
+    ]
+
+
+def test_unpacked_chunks_are_sentences():
+    assert split_script("One. Two! Three?", pack=False) == ["One.", "Two!", "Three?"]
+
+
+def test_segments_come_out_in_script_order():
+    chunks = ["a", "b", "c", "d"]
+    delays = {"a": 0.04, "b": 0.03, "c": 0.02, "d": 0.0}
+
+    def synthesize(chunk):
+        time.sleep(delays[chunk])
+        return chunk.upper().encode()
+
+    assert synthesize_chunks(chunks, synthesize, max_workers=4) == [b"A", b"B", b"C", b"D"]
+
+
+def test_chunks_run_concurrently():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def synthesize(chunk):
+        with lock:
+            running.append(chunk)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(chunk)
+        return b"x"
+
+    synthesize_chunks(list("abcdef"), synthesize, max_workers=3)
+    assert max(peak) == 3
+
+
+def test_synthesis_stays_a_bounded_window_ahead_of_the_reader():
+    calls = []
+
+    def synthesize(chunk):
+        calls.append(chunk)
+        return chunk.encode()
+
+    segments = iter_synthesized([str(i) for i in range(100)], synthesize, max_workers=2)
+    assert next(segments) == b"0"
+    time.sleep(0.05)
+    assert len(calls) == READ_AHEAD * 2
+    assert list(segments) == [str(i).encode() for i in range(1, 100)]
+
+
+def test_a_failing_chunk_is_retried_on_its_own():
+    calls = []
+
+    def synthesize(chunk):
+        calls.append(chunk)
+        if chunk == "b" and calls.count("b") == 1:
+            raise RuntimeError("flaky")
+        return chunk.encode()
+
+    assert synthesize_chunks(["a", "b"], synthesize, retry_delay=0) == [b"a", b"b"]
+    assert calls.count("a") == 1 and calls.count("b") == 2
+
+
+def test_retries_give_up_after_max_attempts():
+    def synthesize(chunk):
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        synthesize_chunks(["a"], synthesize, max_attempts=2, retry_delay=0)
+
+
+def test_cached_chunks_are_not_synthesized_and_count_as_hits(tmp_path):
+    from synthesis_cache import SynthesisCache
+
+    cache = SynthesisCache(str(tmp_path))
+    cache.put("a", b"cached")
+    calls = []
+
+    def synthesize(chunk):
+        calls.append(chunk)
+        return chunk.encode()
+
+    segments = synthesize_chunks(["a", "b", "c"], synthesize, cache=cache, key_for=lambda c: c)
+    assert segments == [b"cached", b"b", b"c"]
+    assert sorted(calls) == ["b", "c"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert cache.get("b") == b"b"
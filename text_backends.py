@@ -0,0 +1,296 @@
+import contextlib
+import os
+import threading
+
+from google.ai.generativelanguage import (
+    Content, GenerateContentRequest, GenerativeServiceClient, Part
+)
+from groq import Groq
+
+import tracing
+from clients import registry
+from scheduler import scheduler, DEFAULT_LIMITS
+
+LLAMA_MODEL = os.environ.get("LLAMA_MODEL")
+LLAMA_CONTEXT = int(os.environ.get("LLAMA_CONTEXT", "8192"))
+
+_BACKENDS = {}
+_MODELS = {}
+
+
+def register_backend(cls):
+    _BACKENDS[cls.name] = cls
+    for model in cls.models:
+        _MODELS.setdefault(model, cls)
+    return cls
+
+
+def model_names():
+    return list(_MODELS)
+
+
+def get_backend_class(model):
+    try:
+        return _MODELS[model]
+    except KeyError:
+        raise ValueError(f"Unsupported text model: {model}") from None
+
+
+def get_backend(settings):
+    return get_backend_class(settings.text_model)(settings)
+
+
+class TextBackend:
+    # A text generation provider. models lists the model names it serves,
+    # requires the (setting, label) pairs that must be filled in, and
+    # api_key_env the environment variables the batch CLI reads its key from.
+    # provider names its limits in the scheduler, for backends it schedules.
+    name = None
+    label = None
+    models = ()
+    requires = ()
+    api_key_env = ()
+    provider = None
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    @classmethod
+    def missing_settings(cls, settings):
+        return [label for attr, label in cls.requires if not getattr(settings, attr)]
+
+    @property
+    def model_id(self):
+        # Identifies the model in cache keys.
+        return self.settings.text_model
+
+    @property
+    def max_concurrency(self):
+        # Requests worth sending at the same time.
+        if self.provider is None:
+            return 1
+        return scheduler.limits.get(self.provider, DEFAULT_LIMITS)["max_concurrency"]
+
+    def complete(self, prompt):
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        yield self.complete(prompt)
+
+
+def _messages(prompt):
+    return [
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+@register_backend
+class GeminiBackend(TextBackend):
+    name = "gemini"
+    label = "Gemini"
+    models = ("gemini-1.5-pro", "gemini-1.5-flash")
+    requires = (("text_api_key", "Gemini"),)
+    api_key_env = ("GEMINI_API_KEY", "GOOGLE_API_KEY")
+    provider = "gemini"
+
+    def _client(self):
+        # A service client of its own per key; genai.configure() is
+        # process-wide, and two sessions with different keys would race
+        # between configuring it and the first request.
+        key = self.settings.text_api_key
+        return registry.get(
+            "gemini", key, lambda: GenerativeServiceClient(client_options={"api_key": key})
+        )
+
+    def _request(self, prompt):
+        return GenerateContentRequest(
+            model=f"models/{self.settings.text_model}",
+            contents=[Content(role="user", parts=[Part(text=prompt)])],
+        )
+
+    @staticmethod
+    def _text(response):
+        if not response.candidates:
+            return ""
+        return "".join(part.text for part in response.candidates[0].content.parts)
+
+    def complete(self, prompt):
+        response = scheduler.call(
+            "gemini", self._client().generate_content, self._request(prompt),
+            priority=self.settings.priority
+        )
+        usage = response.usage_metadata
+        tracing.annotate(tokens_in=usage.prompt_token_count,
+                         tokens_out=usage.candidates_token_count)
+        text = self._text(response)
+        if not text:  # e.g. blocked by the safety filters
+            if response.candidates:
+                reason = response.candidates[0].finish_reason.name
+            else:
+                reason = response.prompt_feedback.block_reason.name
+            raise ValueError(f"Gemini returned no text ({reason}).")
+        return text
+
+    def stream(self, prompt):
+        # Only opening the stream goes through the scheduler; the tokens are
+        # then read without holding a slot.
+        stream = scheduler.call(
+            "gemini", self._client().stream_generate_content, self._request(prompt),
+            priority=self.settings.priority
+        )
+        for chunk in stream:
+            # Chunks without text parts, e.g. only safety ratings, are skipped.
+            text = self._text(chunk)
+            if text:
+                yield text
+
+
+@register_backend
+class GroqBackend(TextBackend):
+    name = "groq"
+    label = "Groq"
+    models = (
+        "gemma2-9b-it", "gemma2-2b-it", "llama3-8b-8192", "llama-3.1-8b-instant",
+        "llama-3.1-70b-versatile", "gemma-7b-it",
+    )
+    requires = (("text_api_key", "Groq"),)
+    api_key_env = ("GROQ_API_KEY",)
+    provider = "groq"
+
+    def _client(self):
+        key = self.settings.text_api_key
+        return registry.get(
+            "groq", key, lambda: Groq(api_key=key),
+            health_check=lambda client: client.models.list()
+        )
+
+    def _create(self, prompt, **kwargs):
+        return scheduler.call(
+            "groq",
+            self._client().chat.completions.create,
+            messages=_messages(prompt),
+            model=self.settings.text_model,
+            priority=self.settings.priority,
+            **kwargs
+        )
+
+    def complete(self, prompt):
+        response = self._create(prompt)
+        if response.usage is not None:
+            tracing.annotate(tokens_in=response.usage.prompt_tokens,
+                             tokens_out=response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+    def stream(self, prompt):
+        for chunk in self._create(prompt, stream=True):
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+
+class ModelClosed(Exception):
+    pass
+
+
+class _LlamaModel:
+    # A loaded GGUF model. llama.cpp uses every core for one prompt, so
+    # prompts run one at a time under the model lock; LlamaRAMCache lets a
+    # prompt reuse the state of a prefix it shares with an earlier one (the
+    # same prompt template). The registry does not evict the model while a
+    # prompt is running or waiting for the lock, and close() waits for the
+    # prompt in progress; a call that still reaches a closed model raises
+    # ModelClosed instead of waiting forever.
+
+    def __init__(self, model_path, n_ctx=LLAMA_CONTEXT):
+        from llama_cpp import Llama, LlamaRAMCache  # optional dependency: pip install llama-cpp-python
+
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, verbose=False)
+        self.llm.set_cache(LlamaRAMCache())
+        self.lock = threading.Lock()
+        self.closed = False
+        self._users = 0
+        self._users_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _use(self):
+        with self._users_lock:
+            self._users += 1
+        try:
+            with self.lock:
+                if self.closed:
+                    raise ModelClosed()
+                yield self.llm
+        finally:
+            with self._users_lock:
+                self._users -= 1
+
+    def busy(self):
+        with self._users_lock:
+            return self._users > 0
+
+    def complete(self, prompt):
+        with self._use() as llm:
+            return llm.create_chat_completion(messages=_messages(prompt), max_tokens=None)
+
+    def stream(self, prompt):
+        with self._use() as llm:
+            for chunk in llm.create_chat_completion(
+                    messages=_messages(prompt), max_tokens=None, stream=True):
+                text = chunk["choices"][0]["delta"].get("content")
+                if text:
+                    yield text
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            close = getattr(self.llm, "close", None)
+            if callable(close):
+                close()
+
+
+@register_backend
+class LlamaCppBackend(TextBackend):
+    # Runs a GGUF model on the CPU with llama.cpp. The model is loaded once
+    # per process and shared by every session and batch job, so there are
+    # no rate limits or per-token costs and latency does not depend on a
+    # remote provider.
+    name = "llama.cpp"
+    label = "llama.cpp (local, offline)"
+    models = ("local/llama.cpp",)
+    requires = (("local_text_model", "GGUF model"),)
+
+    def _model(self):
+        path = self.settings.local_text_model
+        return registry.get("llama.cpp", path, lambda: _LlamaModel(path))
+
+    @property
+    def model_id(self):
+        return f"{self.settings.text_model}:{os.path.basename(self.settings.local_text_model)}"
+
+    @staticmethod
+    def _content(response):
+        usage = response.get("usage") or {}
+        tracing.annotate(tokens_in=usage.get("prompt_tokens"),
+                         tokens_out=usage.get("completion_tokens"))
+        return response["choices"][0]["message"]["content"]
+
+    # The registry may close an idle model between the lookup and the call;
+    # the call is then made once more on a freshly loaded model. ModelClosed
+    # is raised before any output, so nothing is repeated.
+
+    def complete(self, prompt):
+        with tracing.span("provider.llama.cpp"):
+            try:
+                response = self._model().complete(prompt)
+            except ModelClosed:
+                response = self._model().complete(prompt)
+        return self._content(response)
+
+    def stream(self, prompt):
+        try:
+            yield from self._model().stream(prompt)
+        except ModelClosed:
+            yield from self._model().stream(prompt)
@@ -0,0 +1,280 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Span durations are observed into a histogram with these bounds (seconds).
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Numeric span attributes that are also summed into Prometheus counters.
+COUNTED_ATTRIBUTES = (
+    "chars_in", "chars_out", "tokens_in", "tokens_out", "retries", "throttled",
+    "cache_hits", "cache_misses", "results", "bytes",
+)
+METRIC_PREFIX = "yt_voiceover"
+
+_current = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+
+class Span:
+    # One timed operation. Attributes are free-form; the numeric ones in
+    # COUNTED_ATTRIBUTES also feed the process-wide metrics.
+
+    def __init__(self, name, trace=None, parent=None, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.id = next(_ids)
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def finish(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._perf_start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.trace is not None:
+            self.trace._spans.append(self)
+        metrics.observe(self.name, self.duration, self.attributes, self.error)
+
+    @property
+    def status(self):
+        return "error" if self.error else "ok"
+
+    def to_dict(self, origin):
+        return {
+            "id": self.id,
+            "parent": self.parent.id if self.parent is not None else None,
+            "name": self.name,
+            "start": self.start - origin,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    # The spans of one job, kept so the job can be inspected afterwards.
+
+    def __init__(self, name, attributes=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self._spans = []
+        self.root = None
+
+    def to_dict(self):
+        origin = self.root.start if self.root is not None else time.time()
+        spans = sorted(self._spans, key=lambda span: span.start)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "start": origin,
+            "duration": self.root.duration if self.root is not None else None,
+            "status": self.root.status if self.root is not None else None,
+            "spans": [span.to_dict(origin) for span in spans],
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+
+def current():
+    return _current.get()
+
+
+def start_span(name, **attributes):
+    # A span that is not made current, for work that spans generator
+    # yields; call finish() on it when done.
+    parent = _current.get()
+    return Span(name, parent.trace if parent is not None else None, parent, attributes)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    new_span = start_span(name, **attributes)
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.finish(e)
+        raise
+    else:
+        new_span.finish()
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def trace(name, **attributes):
+    # Starts a new trace whose root span covers the block; spans opened
+    # inside it, on this thread or through propagate(), belong to it.
+    new_trace = Trace(name, attributes)
+    root = Span(name, new_trace, None, attributes)
+    new_trace.root = root
+    token = _current.set(root)
+    try:
+        yield new_trace
+    except BaseException as e:
+        root.finish(e)
+        raise
+    else:
+        root.finish()
+    finally:
+        _current.reset(token)
+
+
+def annotate(**attributes):
+    span = _current.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def propagate(fn):
+    # Binds fn to the current span, for running it on another thread:
+    # executor threads do not inherit context variables.
+    parent = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return run
+
+
+class Metrics:
+    # Process-wide aggregates of every finished span, rendered in the
+    # Prometheus text exposition format.
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, duration, attributes=None, error=None):
+        with self._lock:
+            histogram = self._histograms.setdefault(name, [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += duration
+            status = "error" if error else "ok"
+            self._spans[name, status] = self._spans.get((name, status), 0) + 1
+            for attribute in COUNTED_ATTRIBUTES:
+                value = (attributes or {}).get(attribute)
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)) and value:
+                    key = attribute, name
+                    self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_trace(self, trace_dict):
+        # Adds the spans of a trace recorded in another process.
+        for span in trace_dict["spans"]:
+            if span["duration"] is not None:
+                self.observe(span["name"], span["duration"], span["attributes"], span["error"])
+
+    def render(self):
+        lines = []
+        with self._lock:
+            name = f"{METRIC_PREFIX}_span_duration_seconds"
+            lines.append(f"# HELP {name} Duration of pipeline stages and provider calls.")
+            lines.append(f"# TYPE {name} histogram")
+            for span_name, (counts, count, total) in sorted(self._histograms.items()):
+                label = _label(span_name)
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f'{name}_bucket{{span="{label}",le="{bound}"}} {bucket}')
+                lines.append(f'{name}_bucket{{span="{label}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{span="{label}"}} {total}')
+                lines.append(f'{name}_count{{span="{label}"}} {count}')
+
+            name = f"{METRIC_PREFIX}_spans_total"
+            lines.append(f"# HELP {name} Finished spans by outcome.")
+            lines.append(f"# TYPE {name} counter")
+            for (span_name, status), count in sorted(self._spans.items()):
+                lines.append(f'{name}{{span="{_label(span_name)}",status="{status}"}} {count}')
+
+            for attribute in COUNTED_ATTRIBUTES:
+                samples = sorted(
+                    (span_name, value) for (attr, span_name), value in self._counters.items()
+                    if attr == attribute
+                )
+                if not samples:
+                    continue
+                name = f"{METRIC_PREFIX}_{attribute}_total"
+                lines.append(f"# HELP {name} Sum of the {attribute} attribute of spans.")
+                lines.append(f"# TYPE {name} counter")
+                for span_name, value in samples:
+                    lines.append(f'{name}{{span="{_label(span_name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(path + ".tmp", path)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    # Serves metrics on http://host:port/metrics from a daemon thread; only
+    # the first call in a process starts the server. The metrics name the
+    # stages and providers in use, so other hosts are only served when
+    # asked for.
+    global _server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
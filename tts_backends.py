@@ -0,0 +1,189 @@
+import io
+import os
+import threading
+import wave
+
+from gradio_client import Client
+from elevenlabs.client import ElevenLabs
+
+from synthesis_cache import cache_key
+from clients import registry
+from scheduler import scheduler
+from tts_pipeline import MAX_ATTEMPTS
+
+ELEVEN_LABS_VOICES = ['Sarah', 'Laura', 'Charlie', 'George', 'Callum', 'Liam', 'Charlotte', 'Alice', 'Matilda', 'Will', 'Jessica', 'Eric', 'Chris', 'Brian', 'Daniel', 'Lily', 'Bill']
+PIPER_MODEL = os.environ.get("PIPER_MODEL")
+
+_BACKENDS = {}
+
+
+def register_backend(cls):
+    _BACKENDS[cls.name] = cls
+    return cls
+
+
+def backend_names():
+    return list(_BACKENDS)
+
+
+def get_backend_class(name):
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unsupported TTS model: {name}") from None
+
+
+def get_backend(settings):
+    return get_backend_class(settings.tts_model)(settings)
+
+
+class TTSBackend:
+    # A text-to-speech engine the pipeline can drive. The class attributes
+    # describe its capabilities:
+    #   native_format    encoding of the returned segments ("wav" or "mp3")
+    #   max_chunk_chars  longest text sent in one request
+    #   max_workers      requests worth running at the same time
+    #   max_attempts     tries per chunk; 1 for backends whose calls the
+    #                    scheduler already retries
+    #   requires         (setting, label) pairs that must be filled in
+    name = None
+    label = None
+    native_format = "wav"
+    max_chunk_chars = 1000
+    max_workers = 4
+    max_attempts = MAX_ATTEMPTS
+    requires = ()
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    @classmethod
+    def missing_settings(cls, settings):
+        return [label for attr, label in cls.requires if not getattr(settings, attr)]
+
+    def cache_key(self, chunk):
+        raise NotImplementedError
+
+    def synthesize(self, chunk):
+        raise NotImplementedError
+
+
+def get_melotts_client():
+    return registry.get(
+        "gradio", "mrfakename/MeloTTS", lambda: Client("mrfakename/MeloTTS"),
+        health_check=lambda client: client.view_api(print_info=False, return_format="dict")
+    )
+
+
+def get_elevenlabs_client(settings):
+    return registry.get(
+        "elevenlabs", settings.eleven_labs_api_key,
+        lambda: ElevenLabs(api_key=settings.eleven_labs_api_key)
+    )
+
+
+@register_backend
+class MeloTTSBackend(TTSBackend):
+    name = "mrfakename/MeloTTS"
+    label = "MeloTTS (hosted)"
+    max_attempts = 1
+
+    def cache_key(self, chunk):
+        return cache_key(chunk, self.name, "EN-US", 1, "EN")
+
+    def synthesize(self, chunk):
+        result = scheduler.call(
+            "melotts",
+            get_melotts_client().predict,
+            text=chunk,
+            speaker="EN-US",
+            speed=1,
+            language="EN",
+            api_name="/synthesize",
+            priority=self.settings.priority
+        )
+        # The file gradio downloaded is only needed until it is read.
+        try:
+            with open(result, "rb") as f:
+                return f.read()
+        finally:
+            try:
+                os.unlink(result)
+            except OSError:
+                pass
+
+
+@register_backend
+class ElevenLabsBackend(TTSBackend):
+    name = "ElevenLabs"
+    label = "ElevenLabs"
+    native_format = "mp3"
+    max_attempts = 1
+    requires = (("eleven_labs_api_key", "ElevenLabs"),)
+
+    def cache_key(self, chunk):
+        return cache_key(chunk, self.name, self.settings.voice, 1, "eleven_multilingual_v2")
+
+    def synthesize(self, chunk):
+        client_e = get_elevenlabs_client(self.settings)
+        # The generator is consumed inside the scheduled call, since the
+        # request is only sent once iteration starts.
+        return scheduler.call(
+            "elevenlabs",
+            lambda: b"".join(client_e.generate(
+                text=chunk,
+                voice=self.settings.voice,
+                model="eleven_multilingual_v2"
+            )),
+            priority=self.settings.priority
+        )
+
+
+class _PiperModel:
+    # A loaded Piper voice. ONNX Runtime already spreads one inference over
+    # the CPU cores, so calls into the same model are serialized.
+
+    def __init__(self, model_path):
+        from piper import PiperVoice  # optional dependency: pip install piper-tts
+
+        self.voice = PiperVoice.load(model_path)
+        self.lock = threading.Lock()
+
+    def synthesize(self, text):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            # piper-tts 1.3 renamed synthesize() to synthesize_wav().
+            synthesize_wav = getattr(self.voice, "synthesize_wav", None) or self.voice.synthesize
+            synthesize_wav(text, wav_file)
+        return buffer.getvalue()
+
+
+@register_backend
+class PiperBackend(TTSBackend):
+    # Offline CPU synthesis with a Piper ONNX voice. The model is loaded once
+    # per process and stays loaded while it is in use. Sentences are
+    # synthesized one at a time, so each is played and written as soon as
+    # it is ready.
+    name = "local/piper"
+    label = "Piper (local, offline)"
+    max_chunk_chars = 400
+    max_workers = 1
+    requires = (("local_voice_model", "Piper voice model"),)
+
+    def _model(self):
+        path = self.settings.local_voice_model
+        return registry.get("piper", path, lambda: _PiperModel(path))
+
+    def cache_key(self, chunk):
+        # The full path and the file's modification time and size tell voices
+        # apart: two voices can share a file name, and a voice file can be
+        # replaced in place.
+        path = os.path.abspath(self.settings.local_voice_model)
+        stat = os.stat(path)
+        voice = f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+        return cache_key(chunk, self.name, voice, 1, "")
+
+    def synthesize(self, chunk):
+        model = self._model()
+        with model.lock:
+            return model.synthesize(chunk)
@@ -0,0 +1,120 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+# Chunks are kept well under the request limits of MeloTTS and ElevenLabs so a
+# single request stays short and a failure only costs one chunk.
+MAX_CHUNK_CHARS = 1000
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 2
+# Chunks synthesized ahead of the reader, per worker; finished segments wait
+# in memory until they are read, so this bounds memory, not the script length.
+READ_AHEAD = 2
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|(?<=[.!?]["\'”’)])\s+')
+_CLAUSE_END = re.compile(r'(?<=[,;:])\s+')
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_END.split(text.strip()) if s.strip()]
+
+
+def _split_long(sentence, max_chars):
+    # Break an overlong sentence at clause boundaries first, then at spaces.
+    pieces = []
+    current = ""
+    for part in _CLAUSE_END.split(sentence):
+        words = [part] if len(part) <= max_chars else part.split()
+        for word in words:
+            candidate = f"{current} {word}" if current else word
+            if len(candidate) <= max_chars or not current:
+                current = candidate
+            else:
+                pieces.append(current)
+                current = word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_script(script, max_chars=MAX_CHUNK_CHARS, pack=True):
+    # Chunks never span a paragraph and never cut a sentence unless the
+    # sentence alone is longer than max_chars. With pack=False every sentence
+    # is its own chunk, which keeps chunks stable across small edits.
+    chunks = []
+    for paragraph in _PARAGRAPH_BREAK.split(script):
+        current = ""
+        for sentence in split_sentences(paragraph):
+            for piece in _split_long(sentence, max_chars):
+                candidate = f"{current} {piece}" if current else piece
+                if not current or (pack and len(candidate) <= max_chars):
+                    current = candidate
+                else:
+                    chunks.append(current)
+                    current = piece
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def _with_retries(synthesize, chunk, max_attempts, retry_delay):
+    with tracing.span("synthesize", chars_in=len(chunk)) as span:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return synthesize(chunk)
+            except Exception:
+                if attempt == max_attempts:
+                    raise
+                span.add("retries")
+                time.sleep(retry_delay * attempt)
+
+
+def iter_synthesized(chunks, synthesize, max_workers=MAX_WORKERS,
+                     max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY,
+                     cache=None, key_for=None, progress=None):
+    # Runs synthesize(chunk) for every chunk through a bounded pool, retrying
+    # each chunk on its own, and yields the results in script order as soon
+    # as each one is ready. When a cache is given, chunks whose key_for(chunk)
+    # is cached are not sent to the backend at all. A ProgressTracker passed
+    # as progress is advanced once per yielded segment.
+    # Chunks are submitted at most READ_AHEAD * max_workers ahead of the
+    # reader and a segment is dropped once read.
+    keys = [key_for(chunk) for chunk in chunks] if cache is not None else None
+    pending = [i for i in range(len(chunks)) if cache is None or keys[i] not in cache]
+    if cache is not None:
+        tracing.annotate(cache_hits=len(chunks) - len(pending), cache_misses=len(pending))
+    with_retries = tracing.propagate(_with_retries)
+    window = READ_AHEAD * max_workers
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {}
+        submitted = 0
+        for i, chunk in enumerate(chunks):
+            while submitted < len(pending) and len(futures) < window:
+                j = pending[submitted]
+                submitted += 1
+                futures[j] = executor.submit(
+                    with_retries, synthesize, chunks[j], max_attempts, retry_delay
+                )
+            if i in futures:
+                segment = futures.pop(i).result()
+                if cache is not None:
+                    cache.put(keys[i], segment)
+            else:
+                segment = cache.get(keys[i])
+                if segment is None:  # evicted since the lookup above
+                    segment = _with_retries(synthesize, chunk, max_attempts, retry_delay)
+                    cache.put(keys[i], segment)
+            if progress is not None:
+                progress.advance(chunk, len(segment))
+            yield segment
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def synthesize_chunks(chunks, synthesize, **kwargs):
+    return list(iter_synthesized(chunks, synthesize, **kwargs))